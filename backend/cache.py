@@ -0,0 +1,80 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+class AsyncTTLCache:
+    """LRU cache with per-entry expiry in front of an async loader.
+
+    Concurrent misses for one key share a single loader call. A loader
+    result of None ("not found") is cached for ``negative_ttl`` instead.
+    """
+
+    def __init__(self, loader: Callable[[Hashable], Awaitable[Any]], max_entries: int = 1024,
+                 ttl: float = 60.0, negative_ttl: float = 5.0):
+        self.loader = loader
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()  # key -> (expires_at, value)
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "loads": 0, "evictions": 0, "invalidations": 0}
+
+    async def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            del self._entries[key]
+
+        future = self._loading.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        self.stats["misses"] += 1
+        future = self._loading[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await self.loader(key)
+            self.stats["loads"] += 1
+            # Skip the store if the key was invalidated while loading
+            if self._loading.get(key) is future:
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting on it; avoid "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+
+    def put(self, key: Hashable, value: Any):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        if ttl <= 0:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, key: Hashable):
+        self.stats["invalidations"] += 1
+        self._entries.pop(key, None)
+        # A query started before the change must not repopulate the cache
+        self._loading.pop(key, None)
+
+    def snapshot(self):
+        stats = self.stats
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        return dict(stats, entries=len(self._entries),
+                    hit_ratio=(stats["hits"] + stats["coalesced"]) / lookups if lookups else 0.0)
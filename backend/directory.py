@@ -0,0 +1,135 @@
+import asyncio
+import base64
+import json
+import time
+import uuid
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+# Sort orders of the room list: name -> key function over (room, counts)
+SORTS = {
+    "activity": lambda room, counts: (-counts[0], -counts[1], room["id"]),
+    "created": lambda room, counts: (str(room.get("created_at", "")), room["id"]),
+    "name": lambda room, counts: (str(room.get("name", "")).lower(), room["id"]),
+}
+
+class InvalidCursor(Exception):
+    pass
+
+class RoomDirectory:
+    """In-memory directory of rooms for the lobby.
+
+    Room documents are loaded from Mongo once (and reloaded every ``refresh``
+    seconds when other nodes may create rooms). Active and voice counts are
+    pushed in by the connection manager as they change, and every change bumps
+    a version that doubles as the ETag of the room list.
+    """
+
+    def __init__(self, refresh: float = 0):
+        self.refresh = refresh
+        self.rooms: Dict[str, dict] = {}
+        self.counts: Dict[str, Tuple[int, int]] = {}  # room_id -> (active_users, voice_users)
+        self.version = 0
+        # Distinguishes versions of different processes and restarts
+        self.epoch = uuid.uuid4().hex[:8]
+        self.loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._sorted: Dict[str, Tuple[int, list, list]] = {}  # sort -> (version, keys, rooms)
+        self.stats = {"loads": 0, "requests": 0, "not_modified": 0, "count_updates": 0}
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.epoch}-{self.version}"'
+
+    async def ensure_loaded(self, collection):
+        if self.loaded_at is not None and not (self.refresh and time.monotonic() - self.loaded_at > self.refresh):
+            return
+        async with self._lock:
+            if self.loaded_at is not None and not (self.refresh and time.monotonic() - self.loaded_at > self.refresh):
+                return
+            rooms = await collection.find({}, {"_id": 0}).to_list(None)
+            self.rooms = {room["id"]: room for room in rooms if "id" in room}
+            self.loaded_at = time.monotonic()
+            self.stats["loads"] += 1
+            self._changed()
+
+    def add(self, room: dict):
+        self.rooms[room["id"]] = {k: v for k, v in room.items() if k != "_id"}
+        self._changed()
+
+    def update_counts(self, room_id: str, active_users: int, voice_users: int):
+        counts = (active_users, voice_users)
+        if self.counts.get(room_id, (0, 0)) == counts:
+            return
+        if counts == (0, 0):
+            del self.counts[room_id]
+        else:
+            self.counts[room_id] = counts
+        self.stats["count_updates"] += 1
+        # Connections to rooms without a document are not listed
+        if room_id in self.rooms:
+            self._changed()
+
+    def _changed(self):
+        self.version += 1
+
+    def _ordered(self, sort: str):
+        cached = self._sorted.get(sort)
+        if cached is not None and cached[0] == self.version:
+            return cached[1], cached[2]
+        key = SORTS[sort]
+        entries = sorted(
+            ((key(room, self.counts.get(room_id, (0, 0))), room) for room_id, room in self.rooms.items()),
+            key=lambda entry: entry[0]
+        )
+        keys = [entry[0] for entry in entries]
+        rooms = [entry[1] for entry in entries]
+        self._sorted[sort] = (self.version, keys, rooms)
+        return keys, rooms
+
+    @staticmethod
+    def encode_cursor(key: tuple) -> str:
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple:
+        try:
+            return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+        except (ValueError, TypeError):
+            raise InvalidCursor()
+
+    def page(self, sort: str = "created", limit: int = 100, cursor: Optional[str] = None,
+             query: Optional[str] = None, active_only: bool = False,
+             voice_only: bool = False) -> Tuple[List[dict], Optional[str]]:
+        """Return one page of rooms with their counts and the cursor of the next page."""
+        keys, rooms = self._ordered(sort)
+        start = 0
+        if cursor:
+            position = self.decode_cursor(cursor)
+            try:
+                start = bisect_right(keys, position)
+            except TypeError:
+                raise InvalidCursor()
+        if query:
+            query = query.lower()
+
+        page = []
+        last = start
+        for index in range(start, len(rooms)):
+            room = rooms[index]
+            active_users, voice_users = self.counts.get(room["id"], (0, 0))
+            if active_only and not active_users:
+                continue
+            if voice_only and not voice_users:
+                continue
+            if query and query not in room["id"].lower() and query not in str(room.get("name", "")).lower():
+                continue
+            if len(page) == limit:
+                # There is at least one more match: the page ends at the previous room
+                return page, self.encode_cursor(keys[last])
+            page.append(dict(room, active_users=active_users, voice_users=voice_users))
+            last = index
+        return page, None
+
+    def snapshot(self):
+        return dict(self.stats, rooms=len(self.rooms), active_rooms=len(self.counts), version=self.version)
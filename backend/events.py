@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import uuid
+from typing import Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+class RoomEvent:
+    """An already-encoded frame destined for a room (or one user in it) on other nodes."""
+
+    __slots__ = ('node_id', 'room_id', 'target_user_id', 'droppable', 'key', 'payload')
+
+    def __init__(self, node_id: str, room_id: str, payload: str, target_user_id: Optional[str] = None,
+                 droppable: bool = False, key: Optional[str] = None):
+        self.node_id = node_id
+        self.room_id = room_id
+        self.target_user_id = target_user_id
+        self.droppable = droppable
+        self.key = key
+        self.payload = payload
+
+    def encode(self) -> str:
+        # Header lines followed by the frame itself, so receiving nodes
+        # forward the payload without decoding and re-encoding it
+        return "\n".join((
+            self.node_id,
+            self.room_id,
+            self.target_user_id or "",
+            "1" if self.droppable else "0",
+            self.key or "",
+            self.payload
+        ))
+
+    @classmethod
+    def decode(cls, data) -> "RoomEvent":
+        if isinstance(data, bytes):
+            data = data.decode()
+        node_id, room_id, target_user_id, droppable, key, payload = data.split("\n", 5)
+        return cls(node_id, room_id, payload, target_user_id or None, droppable == "1", key or None)
+
+class InProcessHub:
+    def __init__(self):
+        self.subscribers: Dict[str, Set["InProcessEventBus"]] = {}
+
+class InProcessEventBus:
+    """Room event bus for a single process.
+
+    With the default private hub publishing is a no-op, since all members of a
+    room share the one ConnectionManager. Several buses attached to the same
+    hub behave like nodes of a cluster, which is handy for local testing.
+    """
+
+    backend = "in-process"
+
+    def __init__(self, hub: Optional[InProcessHub] = None, node_id: Optional[str] = None):
+        self.hub = hub if hub is not None else InProcessHub()
+        self.node_id = node_id or uuid.uuid4().hex[:12]
+        self.handler: Optional[Callable[[RoomEvent], None]] = None
+        self.stats = {"published": 0, "received": 0}
+
+    async def start(self, handler: Callable[[RoomEvent], None]):
+        self.handler = handler
+
+    async def close(self):
+        for subscribers in self.hub.subscribers.values():
+            subscribers.discard(self)
+
+    def track(self, room_id: str, active: bool):
+        subscribers = self.hub.subscribers.setdefault(room_id, set())
+        if active:
+            subscribers.add(self)
+        else:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.hub.subscribers[room_id]
+
+    async def publish(self, event: RoomEvent):
+        subscribers = self.hub.subscribers.get(event.room_id)
+        if not subscribers:
+            return
+        published = False
+        for bus in subscribers:
+            if bus is not self and bus.handler is not None:
+                bus.stats["received"] += 1
+                bus.handler(event)
+                published = True
+        if published:
+            self.stats["published"] += 1
+
+    def snapshot(self):
+        return dict(self.stats, backend=self.backend, node_id=self.node_id)
+
+class RedisEventBus:
+    """Room event bus over Redis pub/sub, one channel per room.
+
+    A node only subscribes to rooms that currently have local members, and a
+    broadcast is published once per node rather than once per socket. Works
+    with any server speaking the Redis protocol, including a local stand-in.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, prefix: str = "voicechat:room:", node_id: Optional[str] = None):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("EVENT_BUS_URL points to Redis but the 'redis' package is not installed")
+        self.redis = aioredis.from_url(url)
+        self.prefix = prefix
+        self.node_id = node_id or uuid.uuid4().hex[:12]
+        self.handler: Optional[Callable[[RoomEvent], None]] = None
+        self.stats = {"published": 0, "received": 0, "errors": 0}
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._wanted: Set[str] = set()
+        self._subscribed: Set[str] = set()
+        self._sync_lock = asyncio.Lock()
+        self._syncing: Set[asyncio.Task] = set()
+
+    async def start(self, handler: Callable[[RoomEvent], None]):
+        self.handler = handler
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        # Keep one subscription alive so listen() does not return while no room is active
+        await self._pubsub.subscribe(f"{self.prefix}node:{self.node_id}")
+        self._reader = asyncio.create_task(self._read())
+
+    async def close(self):
+        tasks = list(self._syncing)
+        if self._reader is not None:
+            tasks.append(self._reader)
+            self._reader = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        await self.redis.aclose()
+
+    def track(self, room_id: str, active: bool):
+        if active:
+            self._wanted.add(room_id)
+        else:
+            self._wanted.discard(room_id)
+        # The loop only keeps weak references to tasks
+        task = asyncio.create_task(self._sync())
+        self._syncing.add(task)
+        task.add_done_callback(self._syncing.discard)
+
+    async def _sync(self):
+        # Reconcile subscriptions with the set of locally active rooms
+        async with self._sync_lock:
+            to_add = self._wanted - self._subscribed
+            to_remove = self._subscribed - self._wanted
+            try:
+                if to_add:
+                    await self._pubsub.subscribe(*(self.prefix + room_id for room_id in to_add))
+                    self._subscribed |= to_add
+                if to_remove:
+                    await self._pubsub.unsubscribe(*(self.prefix + room_id for room_id in to_remove))
+                    self._subscribed -= to_remove
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error("Event bus subscription update failed: %s", e)
+
+    async def publish(self, event: RoomEvent):
+        try:
+            await self.redis.publish(self.prefix + event.room_id, event.encode())
+            self.stats["published"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error("Event bus publish to room %s failed: %s", event.room_id, e)
+
+    async def _read(self):
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    event = RoomEvent.decode(message["data"])
+                    if event.node_id == self.node_id:
+                        continue
+                    self.stats["received"] += 1
+                    self.handler(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error("Event bus reader failed, retrying: %s", e)
+                await asyncio.sleep(1)
+
+    def snapshot(self):
+        return dict(self.stats, backend=self.backend, node_id=self.node_id,
+                    subscribed_rooms=len(self._subscribed))
+
+def create_event_bus(url: str = ""):
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisEventBus(url)
+    return InProcessEventBus()
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from typing import Awaitable, Callable, Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the RTT histogram buckets in milliseconds
+RTT_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+class RttHistogram:
+    def __init__(self, buckets=RTT_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot: above the largest bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, rtt_ms: float):
+        self.counts[bisect_left(self.buckets, rtt_ms)] += 1
+        self.count += 1
+        self.total += rtt_ms
+        if rtt_ms > self.max:
+            self.max = rtt_ms
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th sample
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return float(bound)
+        return self.max
+
+    def snapshot(self):
+        labels = [f"le_{bound}" for bound in self.buckets] + ["inf"]
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+class Heartbeat:
+    """Application-level ping/pong over the chat WebSocket.
+
+    Every ``interval`` seconds all connections get a ``ping`` frame with a
+    tick id, and a ``pong`` echoing it yields the connection's RTT. A client
+    that has answered pings before and then stays silent for ``max_missed``
+    intervals is considered dead and reaped. Clients that never answered a
+    ping (older builds) are only reaped through send failures.
+    """
+
+    def __init__(self, connections: Callable[[], Iterable], send_ping: Callable[[dict], None],
+                 reap: Callable[[object, str], Awaitable], interval: float = 20.0, max_missed: int = 3):
+        self.connections = connections
+        self.send_ping = send_ping
+        self.reap = reap
+        self.interval = interval
+        self.max_missed = max_missed
+        self.rtt = RttHistogram()
+        self._tick = 0
+        self._sent: Dict[int, float] = {}  # tick id -> monotonic time the ping went out
+        self._task = None
+        self.stats = {"pings": 0, "pongs": 0, "late_pongs": 0}
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def pong(self, conn, message: dict):
+        conn.pong_seen = True
+        self.stats["pongs"] += 1
+        tick = message.get("id")
+        sent_at = self._sent.get(tick) if isinstance(tick, int) else None
+        if sent_at is None:
+            self.stats["late_pongs"] += 1
+            return
+        rtt_ms = (time.monotonic() - sent_at) * 1000
+        conn.rtt_ms = rtt_ms
+        self.rtt.observe(rtt_ms)
+
+    async def check(self):
+        now = time.monotonic()
+        deadline = now - self.interval * self.max_missed
+        dead = [conn for conn in self.connections() if conn.pong_seen and conn.last_seen < deadline]
+        for conn in dead:
+            logger.info("Reaping WebSocket of %s in room %s: no pong for %.0fs",
+                        conn.user_id, conn.room_id, now - conn.last_seen)
+            await self.reap(conn, "missed_pongs")
+
+        self._tick += 1
+        self._sent[self._tick] = now
+        # Pongs older than the reaping window are of no use any more
+        self._sent.pop(self._tick - self.max_missed - 1, None)
+        self.stats["pings"] += 1
+        self.send_ping({"type": "ping", "id": self._tick})
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error("Heartbeat check failed: %s", e)
+
+    def snapshot(self):
+        return dict(self.stats, interval=self.interval, max_missed=self.max_missed, rtt_ms=self.rtt.snapshot())
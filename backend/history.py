@@ -0,0 +1,143 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, List
+
+# Rough per-message overhead (dict, keys, datetime) on top of the text itself
+MESSAGE_OVERHEAD_BYTES = 400
+
+def estimate_size(message: dict) -> int:
+    return MESSAGE_OVERHEAD_BYTES + len(message.get("message") or "") + len(message.get("file_url") or "")
+
+def message_key(message: dict):
+    # The order history cursors page by; timestamps alone tie within a millisecond
+    return message["timestamp"], message["id"]
+
+class RoomHistory:
+    __slots__ = ('messages', 'size', 'loaded_at')
+
+    def __init__(self, capacity: int):
+        self.messages = deque(maxlen=capacity)
+        self.size = 0
+        self.loaded_at = None  # None until the room's history was read from Mongo
+
+class HistoryCache:
+    """Ring buffer of the most recent messages per room.
+
+    Rooms are loaded lazily from Mongo on first read, kept in LRU order and
+    evicted from the cold end once the estimated total size exceeds max_bytes.
+    """
+
+    def __init__(self, loader: Callable[[str, int], Awaitable[List[dict]]], per_room: int = 50,
+                 max_bytes: int = 32 * 1024 * 1024, ttl: float = 0):
+        self.loader = loader
+        self.per_room = per_room
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.rooms: "OrderedDict[str, RoomHistory]" = OrderedDict()
+        self.size = 0
+        self._loading: Dict[str, asyncio.Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0}
+
+    def _room(self, room_id: str) -> RoomHistory:
+        history = self.rooms.get(room_id)
+        if history is None:
+            history = self.rooms[room_id] = RoomHistory(self.per_room)
+        else:
+            self.rooms.move_to_end(room_id)
+        return history
+
+    def _push(self, history: RoomHistory, message: dict):
+        if len(history.messages) == history.messages.maxlen:
+            dropped = estimate_size(history.messages[0])
+            history.size -= dropped
+            self.size -= dropped
+        history.messages.append(message)
+        added = estimate_size(message)
+        history.size += added
+        self.size += added
+
+    def _evict(self, keep: str):
+        while self.size > self.max_bytes and len(self.rooms) > 1:
+            room_id, history = next(iter(self.rooms.items()))
+            if room_id == keep:
+                self.rooms.move_to_end(room_id)
+                continue
+            del self.rooms[room_id]
+            self.size -= history.size
+            self.stats["evictions"] += 1
+
+    def append(self, room_id: str, message: dict):
+        history = self._room(room_id)
+        self._push(history, message)
+        # Messages of one millisecond arrive in any id order; move it back into place
+        messages = history.messages
+        key = message_key(message)
+        index = len(messages) - 1
+        while index > 0 and message_key(messages[index - 1]) > key:
+            index -= 1
+        if index < len(messages) - 1:
+            messages.pop()
+            messages.insert(index, message)
+        self._evict(room_id)
+
+    def update(self, room_id: str, message_id: str, fields: dict) -> bool:
+        history = self.rooms.get(room_id)
+        if history is None:
+            return False
+        for index, message in enumerate(history.messages):
+            if message.get("id") == message_id:
+                # Cached dicts are shared with earlier readers, replace instead of mutating
+                history.messages[index] = {**message, **fields}
+                return True
+        return False
+
+    async def recent(self, room_id: str, limit: int) -> List[dict]:
+        history = self.rooms.get(room_id)
+        expired = (history is not None and history.loaded_at is not None and self.ttl
+                   and time.monotonic() - history.loaded_at > self.ttl)
+        if history is None or history.loaded_at is None or expired:
+            self.stats["misses"] += 1
+            await self._load(room_id)
+        else:
+            self.stats["hits"] += 1
+        history = self._room(room_id)
+        messages = history.messages
+        if limit >= len(messages):
+            return list(messages)
+        return list(messages)[-limit:]
+
+    async def _load(self, room_id: str):
+        # Concurrent misses for one room share a single Mongo query
+        future = self._loading.get(room_id)
+        if future is not None:
+            await future
+            return
+
+        future = self._loading[room_id] = asyncio.get_running_loop().create_future()
+        try:
+            loaded = await self.loader(room_id, self.per_room)
+            self.stats["loads"] += 1
+            history = self._room(room_id)
+            # Keep anything appended while the query was running
+            merged = {message["id"]: message for message in loaded}
+            for message in history.messages:
+                merged[message["id"]] = message
+            self.size -= history.size
+            history.messages.clear()
+            history.size = 0
+            for message in sorted(merged.values(), key=message_key):
+                self._push(history, message)
+            history.loaded_at = time.monotonic()
+            self._evict(room_id)
+            future.set_result(None)
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting on it; avoid "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._loading[room_id]
+
+    def snapshot(self):
+        return dict(self.stats, rooms=len(self.rooms), bytes=self.size, max_bytes=self.max_bytes)
@@ -0,0 +1,201 @@
+import logging
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Default latency buckets in seconds, from 50us (in-memory fan-out) to 10s (slow Mongo)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+class HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # per bucket, not cumulative; last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metric:
+    """One metric family in the Prometheus text format.
+
+    Values are either recorded through ``labels(...)`` children, or read at
+    scrape time from ``collect``, which returns a number (no labels) or a dict
+    of label value tuples to numbers. Collected metrics cost nothing between
+    scrapes, so counters the code already keeps are exported that way.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 collect: Optional[Callable[[], object]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._children: Dict[Tuple, object] = {}
+
+    def _new_child(self):
+        return Value()
+
+    def labels(self, *values):
+        # Callers on hot paths keep the child instead of looking it up per event
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def samples(self):
+        if self.collect is None:
+            for values, child in list(self._children.items()):
+                yield self.name, format_labels(self.labelnames, values), child.value
+            return
+        collected = self.collect()
+        if not isinstance(collected, dict):
+            collected = {(): collected}
+        for values, value in collected.items():
+            if not isinstance(values, tuple):
+                values = (values,)
+            yield self.name, format_labels(self.labelnames, values), value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for name, labels, value in self.samples():
+            yield f"{name}{labels} {format_value(value)}"
+
+class Counter(Metric):
+    kind = "counter"
+
+class Gauge(Metric):
+    kind = "gauge"
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                yield (f"{self.name}_bucket",
+                       format_labels(self.labelnames, values, f'le="{format_value(float(bound))}"'),
+                       cumulative)
+            labels = format_labels(self.labelnames, values)
+            yield f"{self.name}_sum", labels, child.sum
+            yield f"{self.name}_count", labels, child.count
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self.metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} registered twice")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = (), collect=None) -> Counter:
+        return self._register(Counter(self.prefix + name, documentation, labelnames, collect))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (), collect=None) -> Gauge:
+        return self._register(Gauge(self.prefix + name, documentation, labelnames, collect))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # One broken collector must not take the whole scrape down
+                logger.error("Failed to collect metric %s: %s", metric.name, e)
+        lines.append("")
+        return "\n".join(lines)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Latency of every Mongo command by collection and operation.
+
+    Registered on the client as an event listener. Motor runs pymongo in
+    worker threads, so the events arrive off the event loop.
+    """
+
+    def __init__(self, duration: Histogram, errors: Counter):
+        self.duration = duration
+        self.errors = errors
+        self._started: Dict[Tuple[int, object], Tuple[str, str]] = {}  # (request id, connection) -> labels
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        command = event.command
+        if event.command_name == "getMore":
+            collection = command.get("collection", "")
+        else:
+            collection = command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""  # admin and database commands
+        self._started[(event.request_id, event.connection_id)] = (collection, event.command_name)
+
+    def succeeded(self, event):
+        labels = self._started.pop((event.request_id, event.connection_id), None)
+        if labels is not None:
+            with self._lock:
+                self.duration.labels(*labels).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        labels = self._started.pop((event.request_id, event.connection_id), None)
+        if labels is not None:
+            with self._lock:
+                self.duration.labels(*labels).observe(event.duration_micros / 1e6)
+                self.errors.labels(*labels).inc()
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Overflow policies for a full outbound queue that holds no droppable frame.
+# Frames with a coalesce key replace their pending predecessor under either policy
+DROP_OLDEST = "drop_oldest"  # drop the oldest frame
+DISCONNECT = "disconnect"    # close the slow client
+OVERFLOW_POLICIES = (DROP_OLDEST, DISCONNECT)
+
+# Close code sent to clients evicted for not keeping up
+SLOW_CONSUMER_CLOSE_CODE = 4001
+
+class OutboundStats:
+    def __init__(self):
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.evicted = 0
+        self.send_errors = 0
+        self.send_timeouts = 0
+        self.max_depth = 0
+
+    def snapshot(self, queues=()):
+        depths = [len(queue) for queue in queues]
+        return {
+            "queues": len(depths),
+            "queued": sum(depths),
+            "deepest": max(depths, default=0),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "evicted": self.evicted,
+            "send_errors": self.send_errors,
+            "send_timeouts": self.send_timeouts
+        }
+
+class OutboundQueue:
+    """Bounded queue of encoded frames drained by a dedicated writer task."""
+
+    __slots__ = ('websocket', 'maxsize', 'overflow_policy', 'stats', 'send_timeout', 'max_failures', 'on_dead',
+                 'failures', '_entries', '_pending', '_wakeup', '_task', '_closing', 'closed')
+
+    def __init__(self, websocket, maxsize: int, overflow_policy: str, stats: OutboundStats,
+                 send_timeout: Optional[float] = None, max_failures: int = 1,
+                 on_dead: Optional[Callable[[], None]] = None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow_policy!r}, expected one of {OVERFLOW_POLICIES}")
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.overflow_policy = overflow_policy
+        self.stats = stats
+        self.send_timeout = send_timeout  # a send stuck this long evicts the client
+        self.max_failures = max_failures
+        self.on_dead = on_dead  # called once the socket is given up on after repeated send failures
+        self.failures = 0  # consecutive failed sends
+        self._entries = deque()  # [payload, droppable, key]
+        self._pending = {}  # coalesce key -> entry still waiting in the queue
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = None
+        self.closed = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+
+    def put(self, payload: Union[str, bytes], droppable: bool = False, key: Optional[str] = None) -> bool:
+        if self.closed:
+            return False
+
+        if key is not None:
+            entry = self._pending.get(key)
+            if entry is not None:
+                # Newer state supersedes the frame that has not been sent yet
+                entry[0] = payload
+                self.stats.coalesced += 1
+                return True
+
+        if len(self._entries) >= self.maxsize and not self._make_room(droppable):
+            return False
+
+        entry = [payload, droppable, key]
+        self._entries.append(entry)
+        if key is not None:
+            self._pending[key] = entry
+        self.stats.enqueued += 1
+        depth = len(self._entries)
+        if depth > self.stats.max_depth:
+            self.stats.max_depth = depth
+        self._wakeup.set()
+        return True
+
+    def _make_room(self, droppable: bool) -> bool:
+        for index, entry in enumerate(self._entries):
+            if entry[1]:
+                self._discard(index)
+                return True
+
+        if droppable:
+            # Nothing older to sacrifice, drop the incoming frame instead
+            self.stats.dropped += 1
+            return False
+
+        if self.overflow_policy == DROP_OLDEST:
+            self._discard(0)
+            return True
+
+        self.evict("Slow consumer")
+        return False
+
+    def _discard(self, index: int):
+        entry = self._entries[index]
+        del self._entries[index]
+        if entry[2] is not None and self._pending.get(entry[2]) is entry:
+            del self._pending[entry[2]]
+        self.stats.dropped += 1
+
+    def evict(self, reason: str):
+        if self.closed:
+            return
+        self.stats.evicted += 1
+        logger.warning("Evicting WebSocket client: %s (%d frames queued)", reason, len(self._entries))
+        self.close()
+        self._closing = asyncio.create_task(self._close_socket(reason))
+
+    async def _close_socket(self, reason: str):
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason=reason)
+        except Exception:
+            pass
+
+    def close(self):
+        self.closed = True
+        self._entries.clear()
+        self._pending.clear()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        self._task = None
+
+    async def _writer(self):
+        entries = self._entries
+        while not self.closed:
+            if not entries:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            payload, _, key = entries.popleft()
+            if key is not None:
+                self._pending.pop(key, None)
+            # Binary codecs produce bytes, JSON produces text frames
+            send = self.websocket.send_bytes if isinstance(payload, bytes) else self.websocket.send_text
+            # One send at a time per socket; a stalled client only ever blocks its own writer
+            try:
+                if self.send_timeout is not None:
+                    await asyncio.wait_for(send(payload), self.send_timeout)
+                else:
+                    await send(payload)
+                self.stats.sent += 1
+                self.failures = 0
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                self.stats.send_timeouts += 1
+                self.evict(f"Send blocked for {self.send_timeout:g}s")
+                return
+            except Exception as e:
+                self.stats.send_errors += 1
+                self.failures += 1
+                if self.failures < self.max_failures:
+                    logger.debug("WebSocket send failed (%d in a row), dropping frame: %s", self.failures, e)
+                    continue
+                logger.info("WebSocket send failed %d times in a row, stopping writer: %s", self.failures, e)
+                self.close()
+                if self.on_dead is not None:
+                    self.on_dead()
+                return
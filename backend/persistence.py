@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+class MessageWriter:
+    """Write-behind buffer for chat messages.
+
+    Messages are broadcast first and persisted afterwards in batches with
+    insert_many, flushed when the batch is full or the flush interval expires.
+    """
+
+    def __init__(self, collection, batch_size: int = 100, flush_interval: float = 0.05,
+                 max_buffer: int = 10000, max_retries: int = 5, retry_backoff: float = 0.2):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._buffer = deque()
+        self._inflight: List[dict] = []
+        self._deferred: Dict[str, dict] = {}  # message id -> fields to $set once its batch lands
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.stats = {
+            "submitted": 0,
+            "inserted": 0,
+            "failed": 0,
+            "retries": 0,
+            "batches": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "flush_seconds_total": 0.0,
+            "flush_seconds_max": 0.0,
+            "backpressure_waits": 0
+        }
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, message: dict):
+        # Bounded buffer: block the producer instead of growing without limit
+        while len(self._buffer) >= self.max_buffer:
+            self.stats["backpressure_waits"] += 1
+            self._space.clear()
+            await self._space.wait()
+        # pymongo adds _id to inserted documents, keep the caller's dict clean
+        self._buffer.append(dict(message))
+        self.stats["submitted"] += 1
+        self._wakeup.set()
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+
+    def pending_for_room(self, room_id: str) -> List[dict]:
+        # Messages accepted but not yet confirmed by Mongo
+        return [
+            {k: v for k, v in message.items() if k != "_id"}
+            for message in (*self._inflight, *self._buffer)
+            if message.get("room_id") == room_id
+        ]
+
+    async def update(self, message_id: str, fields: dict):
+        # Patch a message wherever it currently is: still buffered, being
+        # inserted right now, or already in Mongo
+        for message in self._buffer:
+            if message.get("id") == message_id:
+                message.update(fields)
+                return
+        if any(message.get("id") == message_id for message in self._inflight):
+            self._deferred.setdefault(message_id, {}).update(fields)
+            return
+        await self.collection.update_one({"id": message_id}, {"$set": fields})
+
+    async def close(self):
+        # Drain everything that was accepted before shutting down
+        self._closing = True
+        self._wakeup.set()
+        self._full.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        while self._buffer:
+            await self._flush_batch()
+        if self.stats["failed"]:
+            logger.error("Message writer closed with %d messages lost", self.stats["failed"])
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if len(self._buffer) < self.batch_size and not self._closing:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush_batch()
+            if self._closing and not self._buffer:
+                return
+
+    async def _flush_batch(self):
+        batch = []
+        while self._buffer and len(batch) < self.batch_size:
+            batch.append(self._buffer.popleft())
+        if not self._buffer:
+            self._wakeup.clear()
+        if len(self._buffer) < self.batch_size:
+            self._full.clear()
+        self._space.set()
+        if not batch:
+            return
+
+        self._inflight = batch
+        started = time.perf_counter()
+        try:
+            await self._insert_with_retry(batch)
+        finally:
+            self._inflight = []
+        if self._deferred:
+            await self._apply_deferred(batch)
+
+        elapsed = time.perf_counter() - started
+        stats = self.stats
+        stats["batches"] += 1
+        stats["last_batch_size"] = len(batch)
+        stats["max_batch_size"] = max(stats["max_batch_size"], len(batch))
+        stats["flush_seconds_total"] += elapsed
+        stats["flush_seconds_max"] = max(stats["flush_seconds_max"], elapsed)
+
+    async def _apply_deferred(self, batch: List[dict]):
+        for message in batch:
+            fields = self._deferred.pop(message.get("id"), None)
+            if fields:
+                try:
+                    await self.collection.update_one({"id": message["id"]}, {"$set": fields})
+                except Exception as e:
+                    logger.error("Failed to update message %s after insert: %s", message["id"], e)
+
+    async def _insert_with_retry(self, batch: List[dict]):
+        attempt = 0
+        while True:
+            try:
+                await self.collection.insert_many(batch, ordered=False)
+                self.stats["inserted"] += len(batch)
+                return
+            except BulkWriteError as e:
+                # Documents from an earlier attempt keep their _id, so duplicates
+                # on retry mean the write already landed
+                errors = e.details.get("writeErrors", [])
+                if errors and all(error.get("code") == DUPLICATE_KEY for error in errors):
+                    self.stats["inserted"] += len(batch)
+                    return
+                failure = e
+            except Exception as e:
+                failure = e
+
+            attempt += 1
+            if attempt > self.max_retries:
+                self.stats["failed"] += len(batch)
+                logger.error("Dropping %d chat messages after %d attempts: %s", len(batch), attempt, failure)
+                return
+            self.stats["retries"] += 1
+            delay = self.retry_backoff * (2 ** (attempt - 1))
+            logger.warning("insert_many of %d messages failed (%s), retrying in %.1fs", len(batch), failure, delay)
+            await asyncio.sleep(delay)
+
+    def snapshot(self):
+        stats = self.stats
+        return {
+            **{k: v for k, v in stats.items() if not k.startswith("flush_seconds")},
+            "buffered": len(self._buffer) + len(self._inflight),
+            "avg_batch_size": (stats["inserted"] + stats["failed"]) / stats["batches"] if stats["batches"] else 0.0,
+            "avg_flush_ms": stats["flush_seconds_total"] / stats["batches"] * 1000 if stats["batches"] else 0.0,
+            "max_flush_ms": stats["flush_seconds_max"] * 1000
+        }
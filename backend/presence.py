@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+class PresenceWriter:
+    """Debounced writer of users' online status.
+
+    Online/offline transitions are recorded in memory and flushed with one
+    bulk_write per debounce window. Only the latest state of each user is
+    written, so a reconnect that flaps offline and online again inside the
+    window costs a single update, or none at all.
+    """
+
+    def __init__(self, collection, debounce: float = 0.5, max_retries: int = 3):
+        self.collection = collection
+        self.debounce = debounce
+        self.max_retries = max_retries
+        self._pending: Dict[str, Tuple[bool, Optional[str]]] = {}  # user_id -> (is_online, username)
+        self._wakeup = asyncio.Event()
+        self._closed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.stats = {"marked": 0, "collapsed": 0, "written": 0, "batches": 0, "failed": 0}
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def mark(self, user_id: str, is_online: bool, username: Optional[str] = None):
+        self.stats["marked"] += 1
+        previous = self._pending.get(user_id)
+        if previous is not None:
+            self.stats["collapsed"] += 1
+            # Keep the username of an earlier online mark when going offline
+            if username is None:
+                username = previous[1]
+        self._pending[user_id] = (is_online, username)
+        self._wakeup.set()
+
+    async def close(self):
+        self._closing = True
+        self._wakeup.set()
+        self._closed.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        if self._pending:
+            await self._flush()
+
+    async def _run(self):
+        while not self._closing:
+            await self._wakeup.wait()
+            if not self._closing:
+                # Let transitions of the same users pile up for one window,
+                # cut short by close()
+                try:
+                    await asyncio.wait_for(self._closed.wait(), self.debounce)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            await self._flush()
+
+    async def _flush(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        operations = []
+        for user_id, (is_online, username) in pending.items():
+            fields = {"is_online": is_online}
+            if username is not None:
+                fields["username"] = username
+            # A join creates the user (even if it already left again within the
+            # window); a bare leave only updates an existing one
+            operations.append(UpdateOne({"id": user_id}, {"$set": fields}, upsert=username is not None))
+
+        attempt = 0
+        while True:
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+                break
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or self._closing:
+                    self.stats["failed"] += len(operations)
+                    logger.error("Dropping %d presence updates after %d attempts: %s", len(operations), attempt, e)
+                    return
+                await asyncio.sleep(self.debounce * attempt)
+        self.stats["written"] += len(operations)
+        self.stats["batches"] += 1
+
+    def snapshot(self):
+        return dict(self.stats, pending=len(self._pending))
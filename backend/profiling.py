@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a sleeping task.
+
+    Every lag sample goes to ``histogram``. A watchdog thread notices a loop
+    that has not ticked for ``interval + threshold`` while it is still
+    blocked, and captures the loop thread's stack at that moment, which shows
+    the code holding the loop up.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.2, histogram=None, keep: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self.histogram = histogram
+        self.stalls: Deque[dict] = deque(maxlen=keep)  # most recent captured stalls, with stacks
+        self.stats = {"samples": 0, "stalls": 0, "captured": 0}
+        self.max_lag = 0.0
+        self._beat = time.monotonic()  # last time the loop task ran
+        self._captured_beat = None
+        self._loop_thread = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def close(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _run(self):
+        while True:
+            beat = self._beat
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - beat - self.interval)
+            self._beat = now
+            self.stats["samples"] += 1
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if self.histogram is not None:
+                self.histogram.observe(lag)
+            if lag >= self.threshold:
+                self.stats["stalls"] += 1
+                if self._captured_beat == beat and self.stalls:
+                    # The watchdog caught this one while it lasted; record how long it took in the end
+                    self.stalls[-1]["duration_ms"] = round(lag * 1000, 1)
+                else:
+                    logger.warning("Event loop stalled for %.0fms", lag * 1000)
+
+    def _watch(self):
+        check_every = max(0.01, self.threshold / 4)
+        while not self._stop.wait(check_every):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold or self._captured_beat == beat:
+                continue
+            self._captured_beat = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)
+            del frame
+            self.stats["captured"] += 1
+            self.stalls.append({
+                "at": datetime.utcnow().isoformat(),
+                "blocked_ms": round(blocked * 1000, 1),
+                "duration_ms": None,  # filled in once the loop runs again
+                "stack": [line.rstrip() for line in stack]
+            })
+            logger.warning("Event loop blocked for %.0fms so far:\n%s", blocked * 1000, "".join(stack))
+
+    def snapshot(self):
+        return dict(self.stats,
+                    interval_ms=self.interval * 1000,
+                    threshold_ms=self.threshold * 1000,
+                    max_lag_ms=self.max_lag * 1000)
+
+def frame_label(code) -> str:
+    # Same "function (file:line)" shape py-spy uses in collapsed output
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class ProfileInProgress(Exception):
+    pass
+
+class SamplingProfiler:
+    """Time-boxed sampling profiler for the live process.
+
+    A background thread snapshots the stacks of all other threads every
+    ``interval`` seconds, so the event loop keeps serving while it runs.
+    The result is in the collapsed-stack format read by flamegraph.pl,
+    speedscope and similar tools: one ``thread;frame;...;frame count`` line
+    per distinct stack.
+    """
+
+    def __init__(self, max_seconds: float = 60.0):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self.stats = {"profiles": 0, "samples": 0}
+
+    def sample(self, seconds: float, interval: float) -> Dict[str, int]:
+        if not self._lock.acquire(blocking=False):
+            raise ProfileInProgress()
+        try:
+            return self._sample(min(seconds, self.max_seconds), interval)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float) -> Dict[str, int]:
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        labels: Dict[object, str] = {}  # code object -> frame label
+        deadline = time.monotonic() + seconds
+        samples = 0
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                path: List[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = frame_label(code)
+                    path.append(label)
+                    frame = frame.f_back
+                path.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(path))] += 1
+            samples += 1
+            time.sleep(interval)
+        self.stats["profiles"] += 1
+        self.stats["samples"] += samples
+        return stacks
+
+    async def profile(self, seconds: float, interval: float = 0.005) -> str:
+        stacks = await asyncio.to_thread(self.sample, seconds, interval)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def snapshot(self):
+        return dict(self.stats, running=self._lock.locked(), max_seconds=self.max_seconds)
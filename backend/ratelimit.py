@@ -0,0 +1,141 @@
+import time
+from typing import Dict, Iterable, Tuple
+
+# Scopes a limit can apply to
+CONNECTION = "connection"
+USER = "user"
+ROOM = "room"
+SCOPES = (CONNECTION, USER, ROOM)
+
+# Limits under this message type apply to every inbound frame of a connection
+ANY = "*"
+
+# Idle user/room buckets are dropped this often once they have refilled
+PRUNE_INTERVAL = 60.0
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+class RateLimited(Exception):
+    def __init__(self, message_type: str, scope: str, retry_after: float, notify: bool):
+        super().__init__(f"{message_type} rate limited per {scope}")
+        self.message_type = message_type
+        self.scope = scope
+        self.retry_after = retry_after
+        self.notify = notify  # False while a recent notice for this type is still fresh
+
+    def notice(self) -> dict:
+        return {
+            "type": "rate_limited",
+            "message_type": self.message_type,
+            "scope": self.scope,
+            "retry_after_ms": int(self.retry_after * 1000) + 1
+        }
+
+class RateLimiter:
+    """Token-bucket admission control for inbound WebSocket messages.
+
+    ``limits`` maps a message type to ``{scope: (rate_per_second, burst)}``;
+    a frame is admitted only if every bucket that applies to it has a token.
+    Frames of types in ``deferrable`` wait up to ``max_defer`` seconds for
+    their tokens instead of being dropped, which holds back reads from that
+    one connection only. Dropped frames raise RateLimited.
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, Tuple[float, float]]], deferrable: Iterable[str] = (),
+                 max_defer: float = 0.25, scale: float = 1.0, notice_interval: float = 1.0):
+        for message_type, scoped in limits.items():
+            for scope in scoped:
+                if scope not in SCOPES:
+                    raise ValueError(f"Unknown rate limit scope {scope!r} for {message_type}")
+        self.max_defer = max_defer
+        self.notice_interval = notice_interval
+        # Flattened per message type: (scope, shared table, bucket name, rate, burst), any-type
+        # limits last. A burst below one token would never admit anything
+        self._shared = {USER: {}, ROOM: {}}  # scope -> (bucket name, user or room id) -> bucket
+        def rules(name, scoped):
+            return tuple((scope, self._shared.get(scope), name, rate * scale, max(burst * scale, 1.0))
+                         for scope, (rate, burst) in scoped.items())
+        self._default = rules(ANY, limits.get(ANY, {}))
+        self._rules = {message_type: rules(message_type, scoped) + self._default
+                       for message_type, scoped in limits.items() if message_type != ANY}
+        self._deferrable = frozenset(deferrable)
+        self._next_prune = time.monotonic() + PRUNE_INTERVAL
+        self.stats = {"admitted": 0, "deferred": 0, "dropped": 0, "notices": 0}
+        self.dropped_by_scope = dict.fromkeys(SCOPES, 0)
+        self.dropped_by_type: Dict[str, int] = {}
+
+    def admit(self, conn, message_type) -> float:
+        """Take the tokens for one message; returns seconds to wait before handling it."""
+        now = time.monotonic()
+        if now >= self._next_prune:
+            self.prune(now)
+        rules = self._rules.get(message_type) if isinstance(message_type, str) else None
+        if rules is None:
+            # Unknown types only count against the any-type limits
+            message_type, rules = ANY, self._default
+        wait = 0.0
+        limiting = None
+        taken = []
+        # Refill inline and remember the longest wait; this runs for every inbound frame
+        for scope, table, name, rate, burst in rules:
+            if table is None:
+                table, key = conn.rate_buckets, name
+            else:
+                key = (name, conn.user_id if scope == USER else conn.room_id)
+            bucket = table.get(key)
+            if bucket is None:
+                bucket = table[key] = TokenBucket(rate, burst, now)
+            tokens = bucket.tokens + (now - bucket.updated) * rate
+            if tokens > burst:
+                tokens = burst
+            bucket.tokens = tokens
+            bucket.updated = now
+            if tokens < 1 and (1 - tokens) / rate > wait:
+                wait, limiting = (1 - tokens) / rate, scope
+            taken.append(bucket)
+
+        if wait and (wait > self.max_defer or message_type not in self._deferrable):
+            raise self._drop(conn, message_type, limiting, wait, now)
+        # Deferred frames take their tokens now, so later ones queue up behind them
+        for bucket in taken:
+            bucket.tokens -= 1
+        if wait:
+            self.stats["deferred"] += 1
+        else:
+            self.stats["admitted"] += 1
+        return wait
+
+    def _drop(self, conn, message_type: str, scope: str, wait: float, now: float) -> RateLimited:
+        self.stats["dropped"] += 1
+        self.dropped_by_scope[scope] += 1
+        self.dropped_by_type[message_type] = self.dropped_by_type.get(message_type, 0) + 1
+        # One notice per message type and interval; the notices must not become a flood themselves
+        notify = now >= conn.rate_notices.get(message_type, 0.0)
+        if notify:
+            conn.rate_notices[message_type] = now + self.notice_interval
+            self.stats["notices"] += 1
+        return RateLimited(message_type, scope, wait, notify)
+
+    def prune(self, now: float):
+        # Connection buckets go away with their connection; shared ones once idle
+        self._next_prune = now + PRUNE_INTERVAL
+        for table in self._shared.values():
+            for key in [key for key, bucket in table.items() if bucket.is_full(now)]:
+                del table[key]
+
+    def snapshot(self):
+        return dict(self.stats,
+                    dropped_by_scope=dict(self.dropped_by_scope),
+                    dropped_by_type=dict(self.dropped_by_type),
+                    user_buckets=len(self._shared[USER]),
+                    room_buckets=len(self._shared[ROOM]))
@@ -0,0 +1,127 @@
+import time
+from typing import Dict, List, Optional
+
+class Connection:
+    __slots__ = ('websocket', 'room_id', 'user_id', 'username', 'is_in_voice', 'outbound', 'ice_batch', 'codec', 'compressor',
+                 'last_seen', 'pong_seen', 'rtt_ms', 'rate_buckets', 'rate_notices')
+
+    def __init__(self, websocket, room_id: str, user_id: str, username: str, outbound=None):
+        self.websocket = websocket
+        self.room_id = room_id
+        self.user_id = user_id
+        self.username = username
+        self.is_in_voice = False
+        self.outbound = outbound
+        self.ice_batch = False  # client understands batched ice-candidates frames
+        self.codec = None  # wire codec negotiated through the WebSocket subprotocol
+        self.compressor = None  # set when the client accepts compressed frames
+        self.last_seen = time.monotonic()  # last inbound frame of any kind
+        self.pong_seen = False  # client answers heartbeat pings
+        self.rtt_ms = None
+        self.rate_buckets = {}  # message type -> inbound token bucket of this connection
+        self.rate_notices = {}  # message type -> time until which no further rate_limited notice is sent
+
+class Room:
+    __slots__ = ('room_id', 'connections', 'users', 'voice_count', 'version', '_roster', '_roster_version')
+
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.connections: Dict[object, Connection] = {}  # websocket -> connection, in join order
+        self.users: Dict[str, Dict[object, Connection]] = {}  # user_id -> {websocket: connection}
+        self.voice_count = 0  # connections currently in voice
+        self.version = 0
+        self._roster: List[dict] = []
+        self._roster_version = -1
+
+    def __len__(self):
+        return len(self.connections)
+
+    def roster(self) -> List[dict]:
+        # Shared snapshot, rebuilt only after membership or voice changes.
+        # Callers must treat it as read-only.
+        if self._roster_version != self.version:
+            self._roster = [
+                {
+                    "id": conn.user_id,
+                    "username": conn.username,
+                    "is_in_voice": conn.is_in_voice
+                }
+                for conn in self.connections.values()
+            ]
+            self._roster_version = self.version
+        return self._roster
+
+class RoomRegistry:
+    """Connection records indexed by websocket, by user and by room."""
+
+    def __init__(self):
+        self.rooms: Dict[str, Room] = {}
+        self.by_websocket: Dict[object, Connection] = {}
+        self.by_user: Dict[str, Dict[object, Connection]] = {}
+
+    def __len__(self):
+        return len(self.by_websocket)
+
+    def add(self, conn: Connection) -> Room:
+        room = self.rooms.get(conn.room_id)
+        if room is None:
+            room = self.rooms[conn.room_id] = Room(conn.room_id)
+        room.connections[conn.websocket] = conn
+        room.users.setdefault(conn.user_id, {})[conn.websocket] = conn
+        room.version += 1
+        self.by_websocket[conn.websocket] = conn
+        self.by_user.setdefault(conn.user_id, {})[conn.websocket] = conn
+        return room
+
+    def remove(self, websocket) -> Optional[Connection]:
+        conn = self.by_websocket.pop(websocket, None)
+        if conn is None:
+            return None
+
+        user_conns = self.by_user.get(conn.user_id)
+        if user_conns is not None:
+            user_conns.pop(websocket, None)
+            if not user_conns:
+                del self.by_user[conn.user_id]
+
+        room = self.rooms.get(conn.room_id)
+        if room is not None:
+            if room.connections.pop(websocket, None) is not None and conn.is_in_voice:
+                room.voice_count -= 1
+            room_user_conns = room.users.get(conn.user_id)
+            if room_user_conns is not None:
+                room_user_conns.pop(websocket, None)
+                if not room_user_conns:
+                    del room.users[conn.user_id]
+            room.version += 1
+            # Clean up empty rooms
+            if not room.connections:
+                del self.rooms[conn.room_id]
+        return conn
+
+    def get(self, websocket) -> Optional[Connection]:
+        return self.by_websocket.get(websocket)
+
+    def room(self, room_id: str) -> Optional[Room]:
+        return self.rooms.get(room_id)
+
+    def room_size(self, room_id: str) -> int:
+        room = self.rooms.get(room_id)
+        return len(room.connections) if room is not None else 0
+
+    def set_voice(self, room_id: str, user_id: str, is_in_voice: bool) -> bool:
+        room = self.rooms.get(room_id)
+        if room is None:
+            return False
+        user_conns = room.users.get(user_id)
+        if not user_conns:
+            return False
+        changed = False
+        for conn in user_conns.values():
+            if conn.is_in_voice != is_in_voice:
+                conn.is_in_voice = is_in_voice
+                room.voice_count += 1 if is_in_voice else -1
+                changed = True
+        if changed:
+            room.version += 1
+        return changed
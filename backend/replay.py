@@ -0,0 +1,70 @@
+import uuid
+from collections import OrderedDict, deque
+from typing import List, Optional, Tuple
+
+class RoomLog:
+    __slots__ = ('epoch', 'seq', 'events')
+
+    def __init__(self, capacity: int):
+        # A new epoch whenever a log starts from scratch (restart, eviction),
+        # so clients never match sequence numbers of an older log
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.events = deque(maxlen=capacity)
+
+class ReplayLog:
+    """Per-room sequence numbers and a bounded log of recent room events.
+
+    Every sequenced room event gets the next ``seq`` of its room. A client
+    that reconnects with the epoch and the last seq it applied gets the
+    events it missed, as long as they are all still in the log.
+    """
+
+    def __init__(self, per_room: int = 200, max_rooms: int = 1000):
+        self.per_room = per_room
+        self.max_rooms = max_rooms
+        self.rooms: "OrderedDict[str, RoomLog]" = OrderedDict()
+        self.stats = {"sequenced": 0, "resumed": 0, "replayed": 0, "fallbacks": 0, "evictions": 0}
+
+    def _log(self, room_id: str) -> RoomLog:
+        log = self.rooms.get(room_id)
+        if log is None:
+            log = self.rooms[room_id] = RoomLog(self.per_room)
+            if len(self.rooms) > self.max_rooms:
+                self.rooms.popitem(last=False)
+                self.stats["evictions"] += 1
+        else:
+            self.rooms.move_to_end(room_id)
+        return log
+
+    def append(self, room_id: str, message: dict) -> dict:
+        """Return a copy of the message stamped with the room's next seq."""
+        log = self._log(room_id)
+        log.seq += 1
+        stamped = dict(message, seq=log.seq)
+        log.events.append(stamped)
+        self.stats["sequenced"] += 1
+        return stamped
+
+    def position(self, room_id: str) -> Tuple[str, int]:
+        log = self._log(room_id)
+        return log.epoch, log.seq
+
+    def since(self, room_id: str, epoch: Optional[str], last_seq: Optional[int]) -> Optional[List[dict]]:
+        """Events after last_seq, or None when the client needs a full snapshot."""
+        log = self.rooms.get(room_id)
+        if log is None or epoch != log.epoch or last_seq is None or not 0 <= last_seq <= log.seq:
+            self.stats["fallbacks"] += 1
+            return None
+        missed = log.seq - last_seq
+        if missed > len(log.events):
+            # The gap reaches past the oldest event still kept
+            self.stats["fallbacks"] += 1
+            return None
+        events = list(log.events)[len(log.events) - missed:] if missed else []
+        self.stats["resumed"] += 1
+        self.stats["replayed"] += len(events)
+        return events
+
+    def snapshot(self):
+        return dict(self.stats, rooms=len(self.rooms), per_room=self.per_room)
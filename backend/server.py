@@ -1,25 +1,55 @@
-from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, UploadFile, File, Form, HTTPException
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, UploadFile, File, Form, HTTPException, Request, Depends, Header
+from fastapi.responses import HTMLResponse, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
-import json
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
 import uuid
 from datetime import datetime
-import aiofiles
 import shutil
+import asyncio
+import time
+import base64
+import hmac
+from functools import partial
+from outbound import OutboundQueue, OutboundStats, DISCONNECT, OVERFLOW_POLICIES
+from registry import Connection, RoomRegistry
+from signaling import IceCandidateBatcher
+from events import RoomEvent, create_event_bus
+from persistence import MessageWriter
+from presence import PresenceWriter
+from directory import RoomDirectory, SORTS, InvalidCursor
+from cache import AsyncTTLCache
+from typing_indicators import TypingAggregator
+from replay import ReplayLog
+from heartbeat import Heartbeat
+from ratelimit import RateLimiter, RateLimited
+from wire import CodecRegistry, EncodedFrames, FrameCompressor, MessageDispatcher, create_json_codec
+from history import HistoryCache
+from storage import FORM_OVERHEAD, ContentStore, UploadSizeLimit, UploadTooLarge, UnsupportedContent
+from variants import VariantPipeline
+from static_files import UploadFiles
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry, MongoCommandMetrics
+from profiling import LoopLagMonitor, ProfileInProgress, SamplingProfiler
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Prometheus metrics, served at /metrics
+metrics = MetricsRegistry("voicechat_")
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+mongo_metrics = MongoCommandMetrics(
+    metrics.histogram("mongo_operation_duration_seconds", "Mongo command latency by collection and operation",
+                      ("collection", "operation")),
+    metrics.counter("mongo_operation_errors_total", "Failed Mongo commands by collection and operation",
+                    ("collection", "operation"))
+)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_metrics])
 db = client[os.environ['DB_NAME']]
 
 # Create uploads directory
@@ -29,12 +59,20 @@ uploads_dir.mkdir(exist_ok=True)
 # Create the main app without a prefix
 app = FastAPI()
 
-# Serve uploaded files
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Serve uploaded files. Upload names are content hashes or uuids and never
+# change, so responses are cacheable forever and support Range requests
+upload_files = UploadFiles(uploads_dir)
+app.mount("/uploads", upload_files, name="uploads")
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+def utcnow_ms() -> datetime:
+    # Mongo stores datetimes with millisecond precision. Cached, buffered and
+    # stored copies of a message, and the cursors built from them, must agree
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
 # Pydantic models
 class ChatMessage(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -44,7 +82,8 @@ class ChatMessage(BaseModel):
     message: str
     message_type: str = "text"  # text, image, file
     file_url: Optional[str] = None
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    variants: Optional[Dict[str, str]] = None  # variant name -> url, filled in after upload
+    timestamp: datetime = Field(default_factory=utcnow_ms)
 
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -53,38 +92,229 @@ class User(BaseModel):
     is_online: bool = True
     is_in_voice: bool = False
 
-# WebRTC Signaling and Chat
-class ConnectionManager:
+# JSON implementation for text frames: stdlib or orjson. Clients may also
+# negotiate binary msgpack frames through the WebSocket subprotocol
+WIRE_JSON = os.environ.get('WIRE_JSON', 'stdlib')
+wire_codecs = CodecRegistry(create_json_codec(WIRE_JSON))
+
+# Clients connecting with ?compress=true get frames of at least this many bytes
+# (room_info, SDP offers/answers) as zlib-compressed binary frames; 0 disables.
+# Run uvicorn with --ws-per-message-deflate false so nothing else compresses frames
+WS_COMPRESSION_THRESHOLD = int(os.environ.get('WS_COMPRESSION_THRESHOLD', '1024'))
+WS_COMPRESSION_LEVEL = int(os.environ.get('WS_COMPRESSION_LEVEL', '6'))
+frame_compressor = FrameCompressor(WS_COMPRESSION_THRESHOLD, WS_COMPRESSION_LEVEL) if WS_COMPRESSION_THRESHOLD > 0 else None
+
+# Per-connection outbound queues
+OUTBOUND_QUEUE_SIZE = int(os.environ.get('OUTBOUND_QUEUE_SIZE', '256'))
+# What to do when a queue is full and nothing can be dropped: disconnect or drop_oldest
+SLOW_CONSUMER_POLICY = os.environ.get('SLOW_CONSUMER_POLICY', DISCONNECT)
+if SLOW_CONSUMER_POLICY not in OVERFLOW_POLICIES:
+    raise ValueError(f"SLOW_CONSUMER_POLICY must be one of {', '.join(OVERFLOW_POLICIES)}, got {SLOW_CONSUMER_POLICY!r}")
+# A single send blocked for this long evicts the client (0 waits forever)
+SEND_TIMEOUT = float(os.environ.get('SEND_TIMEOUT', '10'))
+# Event types that may be dropped when the client falls behind
+DROPPABLE_EVENTS = {"user_typing", "ping", "rate_limited"}
+# Event types where only the latest pending frame per key matters
+COALESCED_EVENTS = {"user_voice_update": "user_id", "typing_snapshot": "room_id"}
+
+# Room event bus shared by all workers/instances, e.g. redis://localhost:6379/0.
+# Empty means a single process where every room lives in one ConnectionManager
+EVENT_BUS_URL = os.environ.get('EVENT_BUS_URL', '')
+
+# Write-behind persistence of chat messages
+MESSAGE_FLUSH_BATCH = int(os.environ.get('MESSAGE_FLUSH_BATCH', '100'))
+MESSAGE_FLUSH_INTERVAL_MS = float(os.environ.get('MESSAGE_FLUSH_INTERVAL_MS', '50'))
+MESSAGE_BUFFER_SIZE = int(os.environ.get('MESSAGE_BUFFER_SIZE', '10000'))
+MESSAGE_WRITE_RETRIES = int(os.environ.get('MESSAGE_WRITE_RETRIES', '5'))
+
+# Online/offline status writes to db.users are coalesced per user within this window
+PRESENCE_DEBOUNCE_MS = float(os.environ.get('PRESENCE_DEBOUNCE_MS', '500'))
+
+# Lobby room list kept in memory; reloaded periodically when other nodes may create rooms
+ROOM_DIRECTORY_REFRESH = float(os.environ.get('ROOM_DIRECTORY_REFRESH', '30' if EVENT_BUS_URL else '0'))
+
+# Room documents looked up by get_room/create_room and every WebSocket join
+ROOM_CACHE_SIZE = int(os.environ.get('ROOM_CACHE_SIZE', '10000'))
+ROOM_CACHE_TTL = float(os.environ.get('ROOM_CACHE_TTL', '60'))
+# Unknown room ids are remembered for a shorter time, rooms may be created on other nodes
+ROOM_CACHE_NEGATIVE_TTL = float(os.environ.get('ROOM_CACHE_NEGATIVE_TTL', '5'))
+
+# In-memory ring buffer of recent messages per room
+HISTORY_CACHE_PER_ROOM = int(os.environ.get('HISTORY_CACHE_PER_ROOM', '50'))
+HISTORY_CACHE_MAX_BYTES = int(os.environ.get('HISTORY_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+# Other nodes' messages only reach this cache through Mongo, so reload periodically when clustered
+HISTORY_CACHE_TTL = float(os.environ.get('HISTORY_CACHE_TTL', '30' if EVENT_BUS_URL else '0'))
+
+# Uploads are streamed to disk in chunks and rejected beyond this size
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.environ.get('UPLOAD_CHUNK_BYTES', str(256 * 1024)))
+# Garbage collection of uploaded blobs no message references any more
+UPLOAD_GC_INTERVAL = float(os.environ.get('UPLOAD_GC_INTERVAL', '3600'))
+UPLOAD_GC_GRACE = float(os.environ.get('UPLOAD_GC_GRACE', '3600'))
+# Preview variants (thumbnail/medium WebP) rendered in a process pool; 0 workers disables them
+VARIANT_WORKERS = int(os.environ.get('VARIANT_WORKERS', '1'))
+VARIANT_QUALITY = int(os.environ.get('VARIANT_QUALITY', '80'))
+
+# Server-side batching window for trickled ICE candidates (0 disables batching).
+# Only applies to clients that connect with ?ice_batch=true
+ICE_BATCH_WINDOW_MS = float(os.environ.get('ICE_BATCH_WINDOW_MS', '25'))
+
+# Room events carry a per-room seq; reconnecting clients that send the epoch and
+# last_seq they saw get only what they missed from this many recent events (0 disables)
+REPLAY_LOG_SIZE = int(os.environ.get('REPLAY_LOG_SIZE', '200'))
+REPLAY_LOG_ROOMS = int(os.environ.get('REPLAY_LOG_ROOMS', '1000'))
+# Ephemeral events are not worth replaying and get no seq. Stale WebRTC signaling
+# would restart negotiation with a peer connection that no longer exists;
+# message_updated stays sequenced since resumed clients don't reload history
+UNSEQUENCED_EVENTS = {"user_typing", "typing_snapshot", "offer", "answer", "ice-candidate", "ice-candidates"}
+
+# Application-level heartbeat: a ping frame every interval (0 disables). Clients
+# that answer pings are reaped after this many silent intervals
+HEARTBEAT_INTERVAL = float(os.environ.get('HEARTBEAT_INTERVAL', '20'))
+HEARTBEAT_MISSED_PONGS = int(os.environ.get('HEARTBEAT_MISSED_PONGS', '3'))
+# Consecutive failed sends after which a connection is reaped
+SEND_FAILURE_LIMIT = int(os.environ.get('SEND_FAILURE_LIMIT', '3'))
+# Close code sent to connections reaped as dead
+DEAD_CONNECTION_CLOSE_CODE = 4002
+
+# Typing indicators are aggregated into one typing_snapshot per room and interval
+# (0 forwards every typing event as user_typing, as before)
+TYPING_SNAPSHOT_INTERVAL_MS = float(os.environ.get('TYPING_SNAPSHOT_INTERVAL_MS', '250'))
+# A typer disappears from snapshots when it stops refreshing for this long
+TYPING_TTL = float(os.environ.get('TYPING_TTL', '5'))
+# Minimum spacing of accepted "still typing" events per user
+TYPING_MIN_INTERVAL_MS = float(os.environ.get('TYPING_MIN_INTERVAL_MS', '1000'))
+
+# Inbound WebSocket rate limits: message type -> {scope: (messages per second, burst)}.
+# "*" limits every frame of a connection, including unknown types
+RATE_LIMITS = {
+    "*": {"connection": (50, 100)},
+    "join": {"connection": (1, 3), "user": (2, 6), "room": (20, 40)},  # each join queries room and history
+    "offer": {"connection": (5, 20)},
+    "answer": {"connection": (5, 20)},
+    "ice-candidate": {"connection": (50, 100)},
+    "join_voice": {"connection": (2, 5), "room": (20, 40)},
+    "leave_voice": {"connection": (2, 5), "room": (20, 40)},
+    "typing": {"connection": (5, 10), "room": (50, 100)},
+    "pong": {"connection": (1, 5)},
+}
+# Over-budget frames of these types wait for tokens instead of being dropped;
+# losing them would break a call or leave the client without room state
+DEFERRABLE_EVENTS = {"join", "offer", "answer", "ice-candidate", "join_voice", "leave_voice"}
+RATE_LIMIT_MAX_DEFER_MS = float(os.environ.get('RATE_LIMIT_MAX_DEFER_MS', '250'))
+# Multiplies every rate and burst above (0 disables rate limiting)
+RATE_LIMIT_SCALE = float(os.environ.get('RATE_LIMIT_SCALE', '1'))
+
+rate_limiter = RateLimiter(RATE_LIMITS, DEFERRABLE_EVENTS, RATE_LIMIT_MAX_DEFER_MS / 1000,
+                           RATE_LIMIT_SCALE) if RATE_LIMIT_SCALE > 0 else None
+
+# Event loop lag sampling interval (0 disables). Stalls longer than the threshold
+# are logged with the stack of the code that blocked the loop
+LOOP_LAG_INTERVAL_MS = float(os.environ.get('LOOP_LAG_INTERVAL_MS', '100'))
+LOOP_STALL_THRESHOLD_MS = float(os.environ.get('LOOP_STALL_THRESHOLD_MS', '200'))
+
+# Bearer token for the /api/admin endpoints; empty disables them
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '60'))
+
+loop_monitor = LoopLagMonitor(
+    LOOP_LAG_INTERVAL_MS / 1000, LOOP_STALL_THRESHOLD_MS / 1000,
+    metrics.histogram("event_loop_lag_seconds", "How late the event loop ran a task that was due").labels()
+) if LOOP_LAG_INTERVAL_MS > 0 else None
+profiler = SamplingProfiler(PROFILE_MAX_SECONDS)
+
+def outbound_policy(message: dict):
+    message_type = message.get("type")
+    key_field = COALESCED_EVENTS.get(message_type)
+    key = f"{message_type}:{message.get(key_field)}" if key_field else None
+    return message_type in DROPPABLE_EVENTS, key
+
+class FanoutStats:
+    # Per-broadcast timing, bucketed by the number of recipients
+    BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
     def __init__(self):
-        self.active_connections: Dict[str, List[Dict]] = {}  # room_id -> list of {websocket, user_id, username}
-        self.connection_users: Dict[WebSocket, Dict] = {}  # websocket -> {room_id, user_id, username}
+        self.broadcasts = 0
+        self.recipients = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = 0.0
+        self.by_size = {bucket: [0, 0.0, 0.0] for bucket in self.BUCKETS}  # count, total, max
+        self.by_size[float('inf')] = [0, 0.0, 0.0]
 
-    async def connect(self, websocket: WebSocket, room_id: str, user_id: str, username: str):
-        await websocket.accept()
-        
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-        
-        user_data = {
-            'websocket': websocket,
-            'user_id': user_id,
-            'username': username,
-            'is_in_voice': False
+    def record(self, recipients: int, seconds: float):
+        self.broadcasts += 1
+        self.recipients += recipients
+        self.total_seconds += seconds
+        self.last_seconds = seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+        for bucket, entry in self.by_size.items():
+            if recipients <= bucket:
+                entry[0] += 1
+                entry[1] += seconds
+                if seconds > entry[2]:
+                    entry[2] = seconds
+                break
+
+    def snapshot(self):
+        return {
+            "broadcasts": self.broadcasts,
+            "recipients": self.recipients,
+            "avg_ms": (self.total_seconds / self.broadcasts * 1000) if self.broadcasts else 0.0,
+            "max_ms": self.max_seconds * 1000,
+            "last_ms": self.last_seconds * 1000,
+            "by_room_size": [
+                {
+                    "max_recipients": None if bucket == float('inf') else bucket,
+                    "broadcasts": count,
+                    "avg_ms": (total / count * 1000) if count else 0.0,
+                    "max_ms": worst * 1000
+                }
+                for bucket, (count, total, worst) in self.by_size.items()
+                if count
+            ]
         }
+
+# Observed on every broadcast; children are resolved once, not per call
+broadcast_duration = metrics.histogram(
+    "broadcast_duration_seconds", "Time to queue a room broadcast for local recipients and the event bus"
+).labels()
+broadcast_recipients = metrics.histogram(
+    "broadcast_recipients", "Local recipients per room broadcast", buckets=(0,) + FanoutStats.BUCKETS
+).labels()
+
+# WebRTC Signaling and Chat
+class ConnectionManager:
+    def __init__(self, bus):
+        self.bus = bus
+        self.registry = RoomRegistry()
+        self.fanout_stats = FanoutStats()
+        self.outbound_stats = OutboundStats()
+        self.signaling_stats = {"targeted": 0, "broadcast": 0, "unroutable": 0}
+        self.reaped = {"missed_pongs": 0, "send_failures": 0}
+        self._reaping = set()
+
+    async def connect(self, websocket: WebSocket, room_id: str, user_id: str, username: str,
+                      ice_batch: bool = False, compress: bool = False) -> Connection:
+        subprotocol, codec = wire_codecs.negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
         
-        self.active_connections[room_id].append(user_data)
-        self.connection_users[websocket] = {
-            'room_id': room_id,
-            'user_id': user_id,
-            'username': username
-        }
+        outbound = OutboundQueue(websocket, OUTBOUND_QUEUE_SIZE, SLOW_CONSUMER_POLICY,
+                                 self.outbound_stats, SEND_TIMEOUT if SEND_TIMEOUT > 0 else None, SEND_FAILURE_LIMIT,
+                                 on_dead=lambda: self._reap_later(websocket, "send_failures"))
+        outbound.start()
+        conn = Connection(websocket, room_id, user_id, username, outbound)
+        conn.ice_batch = ice_batch
+        conn.codec = codec
+        conn.compressor = frame_compressor if compress else None
+        room = self.registry.add(conn)
+        if len(room) == 1:
+            self.bus.track(room_id, True)
+        self._sync_directory(room_id)
         
-        # Update user status in database
-        await db.users.update_one(
-            {"id": user_id},
-            {"$set": {"is_online": True, "username": username}},
-            upsert=True
-        )
+        # Persisted in the background; the join does not wait on Mongo
+        presence_writer.mark(user_id, True, username)
         
         # Notify others in room about new connection  
         await self.broadcast_to_room(room_id, {
@@ -95,64 +325,193 @@ class ConnectionManager:
                 "username": username,
                 "is_in_voice": False
             },
-            "total_users": len(self.active_connections[room_id])
+            "total_users": self.registry.room_size(room_id)
         }, exclude=websocket)
+        return conn
 
-    def disconnect(self, websocket: WebSocket):
-        user_data = self.connection_users.get(websocket)
-        if user_data:
-            room_id = user_data['room_id']
-            if room_id in self.active_connections:
-                # Remove user from room
-                self.active_connections[room_id] = [
-                    conn for conn in self.active_connections[room_id] 
-                    if conn['websocket'] != websocket
-                ]
-                
-                # Clean up empty rooms
-                if not self.active_connections[room_id]:
-                    del self.active_connections[room_id]
-                    
-            del self.connection_users[websocket]
-            return user_data
-        return None
+    def disconnect(self, websocket: WebSocket) -> Optional[Connection]:
+        conn = self.registry.remove(websocket)
+        if conn:
+            conn.outbound.close()
+            if self.registry.room(conn.room_id) is None:
+                self.bus.track(conn.room_id, False)
+            self._sync_directory(conn.room_id)
+        return conn
 
-    async def send_personal_message(self, message: dict, websocket: WebSocket):
+    async def leave(self, websocket: WebSocket):
+        # Idempotent: runs once per connection, whether the client closed the
+        # socket or the connection was reaped as dead
+        conn = self.disconnect(websocket)
+        if not conn:
+            return
+        room_id = conn.room_id
+        # Still online while another tab or device keeps a connection open
+        if conn.user_id not in self.registry.by_user:
+            presence_writer.mark(conn.user_id, False)
+        room = self.registry.room(room_id)
+        if typing_aggregator and (room is None or conn.user_id not in room.users):
+            typing_aggregator.remove_user(room_id, conn.user_id)
+        
+        # Notify others about user leaving
+        await self.broadcast_to_room(room_id, {
+            "type": "user_left",
+            "room_id": room_id,
+            "user": {
+                "id": conn.user_id,
+                "username": conn.username
+            },
+            "total_users": self.room_size(room_id)
+        })
+
+    async def reap(self, websocket: WebSocket, reason: str):
+        if self.registry.get(websocket) is None:
+            return
+        self.reaped[reason] += 1
+        await self.leave(websocket)
         try:
-            await websocket.send_text(json.dumps(message))
-        except:
+            # Also ends the endpoint's receive loop if the socket is only half-open
+            await websocket.close(code=DEAD_CONNECTION_CLOSE_CODE, reason=reason)
+        except Exception:
             pass
 
-    async def broadcast_to_room(self, room_id: str, message: dict, exclude: WebSocket = None):
-        if room_id in self.active_connections:
-            for connection_data in self.active_connections[room_id]:
-                connection = connection_data['websocket']
-                if connection != exclude:
-                    try:
-                        await connection.send_text(json.dumps(message))
-                    except:
-                        pass
+    def _reap_later(self, websocket: WebSocket, reason: str):
+        task = asyncio.create_task(self.reap(websocket, reason))
+        self._reaping.add(task)
+        task.add_done_callback(self._reaping.discard)
+
+    def send_to_all(self, message: dict):
+        frames = EncodedFrames(wire_codecs.text, message)
+        droppable, key = outbound_policy(message)
+        for conn in self.registry.by_websocket.values():
+            conn.outbound.put(frames.encode(conn.codec), droppable, key)
+
+    def _sync_directory(self, room_id: str):
+        room = self.registry.room(room_id)
+        if room is None:
+            room_directory.update_counts(room_id, 0, 0)
+        else:
+            room_directory.update_counts(room_id, len(room), room.voice_count)
+
+    def room_size(self, room_id: str) -> int:
+        return self.registry.room_size(room_id)
+
+    async def send_personal_message(self, message: dict, websocket: WebSocket):
+        conn = self.registry.get(websocket)
+        if conn:
+            droppable, key = outbound_policy(message)
+            frame = EncodedFrames(wire_codecs.text, message).encode(conn.codec, conn.compressor)
+            conn.outbound.put(frame, droppable, key)
+
+    async def broadcast_to_room(self, room_id: str, message: dict, exclude: WebSocket = None, publish: bool = True):
+        started = time.perf_counter()
+        # Serialize once per codec and share the encoded frame between all
+        # recipients; each connection's writer task does the actual send
+        if replay_log is not None and message.get("type") not in UNSEQUENCED_EVENTS:
+            message = replay_log.append(room_id, message)
+        frames = EncodedFrames(wire_codecs.text, message)
+        droppable, key = outbound_policy(message)
+        recipients = 0
+        room = self.registry.room(room_id)
+        if room is not None:
+            for websocket, conn in room.connections.items():
+                if websocket is not exclude:
+                    conn.outbound.put(frames.encode(conn.codec, conn.compressor), droppable, key)
+                    recipients += 1
+
+        # Other nodes get the JSON text frame once and fan it out to their own sockets
+        if publish:
+            await self.bus.publish(RoomEvent(self.bus.node_id, room_id, frames.text, None, droppable, key))
+
+        elapsed = time.perf_counter() - started
+        broadcast_duration.observe(elapsed)
+        broadcast_recipients.observe(recipients)
+        if recipients:
+            self.fanout_stats.record(recipients, elapsed)
+        logger.debug("Broadcast %s to room %s: %d recipients in %.2fms",
+                     message.get("type"), room_id, recipients, elapsed * 1000)
+
+    async def publish_to_nodes(self, room_id: str, message: dict):
+        # Reaches other nodes only, for state every node merges into its own broadcasts
+        droppable, key = outbound_policy(message)
+        payload = wire_codecs.text.encode(message)
+        await self.bus.publish(RoomEvent(self.bus.node_id, room_id, payload, None, droppable, key))
+
+    def deliver_remote(self, event: RoomEvent):
+        room = self.registry.room(event.room_id)
+        if room is None:
+            return
+        if typing_aggregator is not None and event.key == f"typing_snapshot:{event.room_id}":
+            # Nodes share only their own typers; local sockets get the merged set
+            typing_aggregator.merge(event.room_id, event.node_id,
+                                    wire_codecs.text.decode(event.payload).get("users") or [])
+            return
+        if event.target_user_id is not None:
+            connections = room.users.get(event.target_user_id)
+            if not connections:
+                return
+            frames = EncodedFrames(wire_codecs.text, text=event.payload)
+        else:
+            connections = room.connections
+            if replay_log is not None:
+                # Sequence numbers are per node: restamp with this node's seq
+                message = wire_codecs.text.decode(event.payload)
+                if "seq" in message:
+                    frames = EncodedFrames(wire_codecs.text, replay_log.append(event.room_id, message))
+                else:
+                    frames = EncodedFrames(wire_codecs.text, message, event.payload)
+            else:
+                frames = EncodedFrames(wire_codecs.text, text=event.payload)
+        for conn in connections.values():
+            conn.outbound.put(frames.encode(conn.codec, conn.compressor), event.droppable, event.key)
+
+    async def send_to_user(self, room_id: str, user_id: str, message: dict) -> bool:
+        # Deliver to every connection the user has in this room, via the user index
+        room = self.registry.room(room_id)
+        user_conns = room.users.get(user_id) if room is not None else None
+        frames = EncodedFrames(wire_codecs.text, message)
+        droppable, key = outbound_policy(message)
+        # The user may also be connected to this room through other nodes
+        await self.bus.publish(RoomEvent(self.bus.node_id, room_id, frames.text, user_id, droppable, key))
+        if not user_conns:
+            self.signaling_stats["unroutable"] += 1
+            logger.debug("No local connection for %s to user %s in room %s", message.get("type"), user_id, room_id)
+            return False
+
+        self.signaling_stats["targeted"] += 1
+        for conn in user_conns.values():
+            conn.outbound.put(frames.encode(conn.codec, conn.compressor), droppable, key)
+        return True
+
+    def accepts_ice_batches(self, room_id: str, user_id: str) -> bool:
+        room = self.registry.room(room_id)
+        user_conns = room.users.get(user_id) if room is not None else None
+        return bool(user_conns) and all(conn.ice_batch for conn in user_conns.values())
 
     def get_room_users(self, room_id: str):
-        if room_id in self.active_connections:
-            return [
-                {
-                    "id": conn['user_id'],
-                    "username": conn['username'],
-                    "is_in_voice": conn.get('is_in_voice', False)
-                }
-                for conn in self.active_connections[room_id]
-            ]
+        # Cached roster snapshot; rebuilt only when the room's membership changes
+        room = self.registry.room(room_id)
+        if room is not None:
+            return room.roster()
         return []
 
     async def update_voice_status(self, room_id: str, user_id: str, is_in_voice: bool):
-        if room_id in self.active_connections:
-            for conn in self.active_connections[room_id]:
-                if conn['user_id'] == user_id:
-                    conn['is_in_voice'] = is_in_voice
-                    break
+        if self.registry.set_voice(room_id, user_id, is_in_voice):
+            self._sync_directory(room_id)
 
-manager = ConnectionManager()
+event_bus = create_event_bus(EVENT_BUS_URL)
+message_writer = MessageWriter(db.messages, MESSAGE_FLUSH_BATCH, MESSAGE_FLUSH_INTERVAL_MS / 1000,
+                               MESSAGE_BUFFER_SIZE, MESSAGE_WRITE_RETRIES)
+presence_writer = PresenceWriter(db.users, PRESENCE_DEBOUNCE_MS / 1000)
+replay_log = ReplayLog(REPLAY_LOG_SIZE, REPLAY_LOG_ROOMS) if REPLAY_LOG_SIZE > 0 else None
+room_directory = RoomDirectory(ROOM_DIRECTORY_REFRESH)
+manager = ConnectionManager(event_bus)
+ice_batcher = IceCandidateBatcher(ICE_BATCH_WINDOW_MS / 1000, manager.send_to_user) if ICE_BATCH_WINDOW_MS > 0 else None
+heartbeat = Heartbeat(manager.registry.by_websocket.values, manager.send_to_all,
+                      lambda conn, reason: manager.reap(conn.websocket, reason),
+                      HEARTBEAT_INTERVAL, HEARTBEAT_MISSED_PONGS) if HEARTBEAT_INTERVAL > 0 else None
+typing_aggregator = TypingAggregator(partial(manager.broadcast_to_room, publish=False),
+                                     TYPING_SNAPSHOT_INTERVAL_MS / 1000, TYPING_TTL, TYPING_MIN_INTERVAL_MS / 1000,
+                                     manager.publish_to_nodes) if TYPING_SNAPSHOT_INTERVAL_MS > 0 else None
 
 # API Routes
 @api_router.get("/")
@@ -177,15 +536,20 @@ async def health_check():
             "timestamp": datetime.utcnow().isoformat()
         }
 
+async def load_room(room_id: str):
+    return await db.rooms.find_one({"id": room_id}, {"_id": 0})
+
+room_cache = AsyncTTLCache(load_room, ROOM_CACHE_SIZE, ROOM_CACHE_TTL, ROOM_CACHE_NEGATIVE_TTL)
+
 @api_router.post("/rooms")
 async def create_room(room_data: dict):
     # Check if room already exists
-    existing_room = await db.rooms.find_one({"id": room_data.get("id")})
+    existing_room = await room_cache.get(room_data["id"]) if room_data.get("id") else None
     if existing_room:
-        # Return existing room
-        if "_id" in existing_room:
-            del existing_room["_id"]
-        existing_room["active_users"] = len(manager.active_connections.get(existing_room["id"], []))
+        # Return existing room; cached documents are shared, copy before adding fields
+        existing_room = dict(existing_room)
+        room_directory.add(existing_room)
+        existing_room["active_users"] = manager.room_size(existing_room["id"])
         return existing_room
     
     # Create new room
@@ -200,17 +564,18 @@ async def create_room(room_data: dict):
     # Return room without ObjectId
     if "_id" in room:
         del room["_id"]
+    # Drops a cached "not found" for this id and any lookup still in flight
+    room_cache.invalidate(room["id"])
+    room_cache.put(room["id"], dict(room))
+    room_directory.add(room)
     return room
 
 @api_router.get("/rooms/{room_id}")
 async def get_room(room_id: str):
-    room = await db.rooms.find_one({"id": room_id})
+    room = await room_cache.get(room_id)
     if not room:
         return {"error": "Room not found"}
-    
-    # Convert ObjectId to string and remove it
-    if "_id" in room:
-        del room["_id"]
+    room = dict(room)
     
     # Get active users
     active_users = manager.get_room_users(room_id)
@@ -220,25 +585,190 @@ async def get_room(room_id: str):
     return room
 
 @api_router.get("/rooms")
-async def get_rooms():
-    rooms = await db.rooms.find().to_list(100)
+async def get_rooms(request: Request, response: Response, limit: int = 100, cursor: Optional[str] = None,
+                    sort: str = "created", q: Optional[str] = None, active: bool = False, voice: bool = False):
+    if sort not in SORTS:
+        raise HTTPException(status_code=400, detail="Invalid sort")
+    await room_directory.ensure_loaded(db.rooms)
+    room_directory.stats["requests"] += 1
+    # The version changes with every room or count change, so an unchanged
+    # list costs pollers a 304 and nothing else
+    etag = room_directory.etag
+    if request.headers.get("if-none-match") == etag:
+        room_directory.stats["not_modified"] += 1
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    try:
+        rooms, next_cursor = room_directory.page(sort, max(1, min(limit, 500)), cursor, q, active, voice)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     for room in rooms:
-        # Convert ObjectId to string and remove it
-        if "_id" in room:
-            del room["_id"]
-        active_users = manager.get_room_users(room["id"])
-        room["active_users"] = len(active_users)
-        room["users"] = active_users
+        room["users"] = manager.get_room_users(room["id"])
+    
+    response.headers["ETag"] = etag
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return rooms
 
+@api_router.get("/stats")
+async def get_stats():
+    return {
+        "connections": {
+            "total": len(manager.registry),
+            "users": len(manager.registry.by_user),
+            "rooms": len(manager.registry.rooms)
+        },
+        "fanout": manager.fanout_stats.snapshot(),
+        "signaling": dict(manager.signaling_stats),
+        "wire": dict(wire_codecs.snapshot(), dispatched=dispatcher.snapshot()),
+        "compression": frame_compressor.snapshot() if frame_compressor else None,
+        "replay": replay_log.snapshot() if replay_log else None,
+        "heartbeat": dict(heartbeat.snapshot() if heartbeat else {}, reaped=dict(manager.reaped)),
+        "rate_limits": rate_limiter.snapshot() if rate_limiter else None,
+        "event_loop": loop_monitor.snapshot() if loop_monitor else None,
+        "profiler": profiler.snapshot(),
+        "ice_batching": ice_batcher.snapshot() if ice_batcher else None,
+        "typing": typing_aggregator.snapshot() if typing_aggregator else None,
+        "event_bus": event_bus.snapshot(),
+        "message_writer": message_writer.snapshot(),
+        "presence": presence_writer.snapshot(),
+        "room_directory": room_directory.snapshot(),
+        "room_cache": room_cache.snapshot(),
+        "history_cache": history_cache.snapshot(),
+        "uploads": content_store.snapshot(),
+        "variants": variant_pipeline.snapshot(),
+        "static": upload_files.snapshot(),
+        "outbound": manager.outbound_stats.snapshot(
+            conn.outbound for conn in manager.registry.by_websocket.values()
+        ),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    # Without a configured token the admin endpoints do not exist
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+@api_router.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_process(seconds: float = 10, interval_ms: float = 5):
+    # Samples the live process while it keeps serving; the response is a
+    # collapsed-stack file for flamegraph.pl or speedscope
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}]")
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be in [1, 1000]")
+    try:
+        collapsed = await profiler.profile(seconds, interval_ms / 1000)
+    except ProfileInProgress:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    filename = f"profile-{datetime.utcnow():%Y%m%dT%H%M%S}.folded"
+    return Response(collapsed, media_type="text/plain; charset=utf-8",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@api_router.get("/admin/stalls", dependencies=[Depends(require_admin)])
+async def get_stalls():
+    # Most recent event loop stalls with the stack captured while the loop was blocked
+    return {"stalls": list(loop_monitor.stalls) if loop_monitor else []}
+
 # Chat endpoints
+# History pagination: opaque keyset cursors over (timestamp, id)
+MESSAGE_FIELDS = {"id", "room_id", "user_id", "username", "message", "message_type", "file_url", "variants", "timestamp"}
+
+def encode_cursor(message: dict) -> str:
+    timestamp = message["timestamp"]
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.isoformat()
+    return base64.urlsafe_b64encode(f"{timestamp}|{message['id']}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, message_id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), message_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def project_message(message: dict, fields: Optional[set]) -> dict:
+    if fields is None:
+        return message
+    return {k: v for k, v in message.items() if k in fields}
+
+async def query_messages(room_id: str, limit: int, before: Optional[str] = None, after: Optional[str] = None,
+                         fields: Optional[set] = None):
+    query = {"room_id": room_id}
+    position = None
+    if before:
+        position = decode_cursor(before)
+        query["$or"] = [{"timestamp": {"$lt": position[0]}},
+                        {"timestamp": position[0], "id": {"$lt": position[1]}}]
+    elif after:
+        position = decode_cursor(after)
+        query["$or"] = [{"timestamp": {"$gt": position[0]}},
+                        {"timestamp": position[0], "id": {"$gt": position[1]}}]
+    # Newest-first unless paging forward, matching the (room_id, timestamp, id) index
+    direction = 1 if after else -1
+    projection = {"_id": 0}
+    if fields is not None:
+        projection.update({field: 1 for field in fields})
+    messages = await db.messages.find(query, projection) \
+        .sort([("timestamp", direction), ("id", direction)]).limit(limit).to_list(limit)
+    
+    # Include messages that were broadcast but are still waiting in the write-behind buffer
+    pending = message_writer.pending_for_room(room_id)
+    if pending:
+        seen = {message["id"] for message in messages}
+        for message in pending:
+            if message["id"] in seen:
+                continue
+            key = (message["timestamp"], message["id"])
+            if (before and key >= position) or (after and key <= position):
+                continue
+            messages.append(project_message(message, fields))
+        messages.sort(key=lambda message: (message["timestamp"], message["id"]), reverse=direction < 0)
+        del messages[limit:]
+    if direction < 0:
+        messages.reverse()
+    return messages
+
+async def load_recent_messages(room_id: str, limit: int):
+    return await query_messages(room_id, limit)
+
+# Long-running and fire-and-forget tasks, cancelled on shutdown
+background_tasks: List[asyncio.Task] = []
+
+content_store = ContentStore(uploads_dir, db.blobs, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_BYTES,
+                             variants_dir=uploads_dir / "variants")
+variant_pipeline = VariantPipeline(uploads_dir / "variants", "/uploads/variants", VARIANT_WORKERS,
+                                   quality=VARIANT_QUALITY)
+
+history_cache = HistoryCache(load_recent_messages, HISTORY_CACHE_PER_ROOM, HISTORY_CACHE_MAX_BYTES,
+                             HISTORY_CACHE_TTL)
+
 @api_router.get("/rooms/{room_id}/messages")
-async def get_room_messages(room_id: str, limit: int = 50):
-    messages = await db.messages.find({"room_id": room_id}).sort("timestamp", -1).limit(limit).to_list(limit)
-    for message in messages:
-        if "_id" in message:
-            del message["_id"]
-    return {"messages": list(reversed(messages))}
+async def get_room_messages(room_id: str, limit: int = 50, before: Optional[str] = None,
+                            after: Optional[str] = None, fields: Optional[str] = None):
+    limit = max(1, min(limit, 500))
+    selected = None
+    if fields:
+        # id and timestamp are always returned, cursors are built from them
+        selected = {field.strip() for field in fields.split(",")} & MESSAGE_FIELDS | {"id", "timestamp"}
+    
+    if not before and not after and limit <= HISTORY_CACHE_PER_ROOM:
+        messages = await history_cache.recent(room_id, limit)
+        if selected is not None:
+            messages = [project_message(message, selected) for message in messages]
+    else:
+        messages = await query_messages(room_id, limit, before, after, selected)
+    
+    return {
+        "messages": messages,
+        "has_more": len(messages) == limit,
+        "before": encode_cursor(messages[0]) if messages else before,
+        "after": encode_cursor(messages[-1]) if messages else after
+    }
 
 @api_router.post("/rooms/{room_id}/messages")
 async def send_message(room_id: str, message_data: dict):
@@ -250,22 +780,21 @@ async def send_message(room_id: str, message_data: dict):
         message_type=message_data.get("message_type", "text")
     )
     
-    # Save to database
+    # Broadcast to room via WebSocket, then hand off to the write-behind buffer
     message_dict = chat_message.dict()
-    await db.messages.insert_one(message_dict)
-    
-    # Remove _id for response
-    if "_id" in message_dict:
-        del message_dict["_id"]
-    
-    # Broadcast to room via WebSocket
+    history_cache.append(room_id, message_dict)
     await manager.broadcast_to_room(room_id, {
         "type": "new_message",
         "message": message_dict
     })
+    await message_writer.submit(message_dict)
     
     return message_dict
 
+upload_duration = metrics.histogram("upload_duration_seconds", "Time to stream and store an upload", ("result",))
+upload_bytes = metrics.histogram("upload_bytes", "Size of stored uploads",
+                                 buckets=tuple(2 ** exponent for exponent in range(10, 25))).labels()
+
 @api_router.post("/rooms/{room_id}/upload")
 async def upload_file(room_id: str, file: UploadFile = File(...), user_id: str = Form(...), username: str = Form(...)):
     # Validate file type
@@ -273,21 +802,26 @@ async def upload_file(room_id: str, file: UploadFile = File(...), user_id: str =
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="Неподдерживаемый тип файла")
     
-    # Generate unique filename
-    file_extension = file.filename.split('.')[-1]
-    unique_filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = uploads_dir / unique_filename
-    
-    # Save file
+    # Stream to the content-addressed store in chunks; the stored type comes from
+    # the content, not the client, and duplicates reuse the existing blob
+    started = time.perf_counter()
     try:
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+        stored = await content_store.put(file)
+    except UploadTooLarge:
+        upload_duration.labels("too_large").observe(time.perf_counter() - started)
+        raise HTTPException(status_code=413, detail="Файл слишком большой")
+    except UnsupportedContent:
+        upload_duration.labels("unsupported").observe(time.perf_counter() - started)
+        raise HTTPException(status_code=400, detail="Неподдерживаемый тип файла")
     except Exception as e:
+        upload_duration.labels("error").observe(time.perf_counter() - started)
+        logger.error("Failed to store upload %s: %s", file.filename, e)
         raise HTTPException(status_code=500, detail="Ошибка при сохранении файла")
+    upload_duration.labels("deduplicated" if stored.deduplicated else "stored").observe(time.perf_counter() - started)
+    upload_bytes.observe(stored.size)
     
     # Create message with file
-    file_url = f"/uploads/{unique_filename}"
+    file_url = content_store.url_for(stored.path.name)
     chat_message = ChatMessage(
         room_id=room_id,
         user_id=user_id,
@@ -297,101 +831,194 @@ async def upload_file(room_id: str, file: UploadFile = File(...), user_id: str =
         file_url=file_url
     )
     
-    # Save to database
+    # Broadcast to room, then hand off to the write-behind buffer
     message_dict = chat_message.dict()
-    await db.messages.insert_one(message_dict)
-    
-    # Remove _id for response
-    if "_id" in message_dict:
-        del message_dict["_id"]
-    
-    # Broadcast to room
+    history_cache.append(room_id, message_dict)
     await manager.broadcast_to_room(room_id, {
         "type": "new_message",
         "message": message_dict
     })
+    await message_writer.submit(message_dict)
+    try:
+        await content_store.add_reference(stored)
+    except Exception as e:
+        # The garbage collector counts references from messages, nothing is lost
+        logger.warning("Failed to update metadata of blob %s: %s", stored.sha256, e)
+    
+    # Previews are rendered in the background and announced with message_updated
+    if variant_pipeline.enabled:
+        task = asyncio.create_task(attach_variants(room_id, message_dict["id"], stored))
+        background_tasks.append(task)
+        task.add_done_callback(background_tasks.remove)
     
     return message_dict
 
+async def attach_variants(room_id: str, message_id: str, stored):
+    variants = await variant_pipeline.generate(stored.path, stored.sha256)
+    if not variants:
+        return
+    history_cache.update(room_id, message_id, {"variants": variants})
+    try:
+        await message_writer.update(message_id, {"variants": variants})
+    except Exception as e:
+        logger.error("Failed to store variants of message %s: %s", message_id, e)
+    await manager.broadcast_to_room(room_id, {
+        "type": "message_updated",
+        "room_id": room_id,
+        "message_id": message_id,
+        "changes": {"variants": variants}
+    })
+
+# WebSocket message handlers, dispatched by message type
+dispatcher = MessageDispatcher(
+    metrics.histogram("ws_handler_duration_seconds", "Time spent handling inbound WebSocket messages", ("type",))
+)
+
+@dispatcher.on("offer", "answer", "ice-candidate")
+async def handle_signaling(conn: Connection, message: dict):
+    # Forward WebRTC signaling messages; the sender is always stamped
+    # by the server so peers can address their replies
+    room_id, user_id = conn.room_id, conn.user_id
+    message["from_user_id"] = user_id
+    target_user_id = message.get("target_user_id")
+    if target_user_id:
+        if (message["type"] == "ice-candidate" and ice_batcher is not None
+                and manager.accepts_ice_batches(room_id, target_user_id)):
+            await ice_batcher.add(room_id, user_id, target_user_id, message)
+        else:
+            if ice_batcher is not None:
+                # Pending candidates must not be overtaken by the next offer/answer
+                await ice_batcher.flush(room_id, user_id, target_user_id)
+            await manager.send_to_user(room_id, target_user_id, message)
+    else:
+        # Old clients don't address peers, fall back to the whole room
+        manager.signaling_stats["broadcast"] += 1
+        await manager.broadcast_to_room(room_id, message, exclude=conn.websocket)
+
+@dispatcher.on("pong")
+async def handle_pong(conn: Connection, message: dict):
+    if heartbeat:
+        heartbeat.pong(conn, message)
+
+@dispatcher.on("join")
+async def handle_join(conn: Connection, message: dict):
+    last_seq = message.get("last_seq")
+    if replay_log is not None and isinstance(last_seq, int):
+        # Resuming client: send only the events it missed, if the log still has them.
+        # Frames already queued since connect may repeat some; clients skip seq <= last applied
+        events = replay_log.since(conn.room_id, message.get("epoch"), last_seq)
+        if events is not None:
+            epoch, seq = replay_log.position(conn.room_id)
+            await manager.send_personal_message({
+                "type": "room_delta",
+                "room_id": conn.room_id,
+                "epoch": epoch,
+                "seq": seq,
+                "events": events
+            }, conn.websocket)
+            return
+
+    # Send current room info and recent messages
+    room_info = await get_room(conn.room_id)
+    messages_response = await get_room_messages(conn.room_id, 50)
+    reply = {
+        "type": "room_info",
+        "data": room_info,
+        "messages": messages_response["messages"]
+    }
+    if replay_log is not None:
+        # Position the snapshot reflects; later room events have a higher seq
+        reply["epoch"], reply["seq"] = replay_log.position(conn.room_id)
+    await manager.send_personal_message(reply, conn.websocket)
+
+@dispatcher.on("join_voice", "leave_voice")
+async def handle_voice(conn: Connection, message: dict):
+    # User joined or left the voice call
+    is_in_voice = message["type"] == "join_voice"
+    await manager.update_voice_status(conn.room_id, conn.user_id, is_in_voice)
+    await manager.broadcast_to_room(conn.room_id, {
+        "type": "user_voice_update",
+        "user_id": conn.user_id,
+        "username": conn.username,
+        "is_in_voice": is_in_voice
+    })
+
+@dispatcher.on("typing")
+async def handle_typing(conn: Connection, message: dict):
+    if typing_aggregator:
+        # Throttled and folded into the room's next typing_snapshot
+        typing_aggregator.update(conn.room_id, conn.user_id, conn.username, bool(message.get("is_typing", False)))
+    else:
+        # Forward typing indicators
+        await manager.broadcast_to_room(conn.room_id, {
+            "type": "user_typing",
+            "user_id": conn.user_id,
+            "username": conn.username,
+            "is_typing": message.get("is_typing", False)
+        }, exclude=conn.websocket)
+
 # WebSocket endpoint for signaling and chat
 @api_router.websocket("/ws/{room_id}")
-async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str = "", username: str = ""):
+async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str = "", username: str = "",
+                             ice_batch: bool = False, compress: bool = False):
     if not user_id or not username:
         await websocket.close(code=4000, reason="Missing user_id or username")
         return
         
-    await manager.connect(websocket, room_id, user_id, username)
+    conn = await manager.connect(websocket, room_id, user_id, username, ice_batch=ice_batch, compress=compress)
+    codec, compressor = conn.codec, conn.compressor
     try:
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
-            
-            # Handle different message types
-            message_type = message.get("type")
-            
-            if message_type in ["offer", "answer", "ice-candidate"]:
-                # Forward WebRTC signaling messages to other peers in the room
-                await manager.broadcast_to_room(room_id, message, exclude=websocket)
-                
-            elif message_type == "join":
-                # Send current room info and recent messages
-                room_info = await get_room(room_id)
-                messages_response = await get_room_messages(room_id, 50)
-                await manager.send_personal_message({
-                    "type": "room_info",
-                    "data": room_info,
-                    "messages": messages_response["messages"]
-                }, websocket)
-                
-            elif message_type == "join_voice":
-                # User joined voice call
-                await manager.update_voice_status(room_id, user_id, True)
-                await manager.broadcast_to_room(room_id, {
-                    "type": "user_voice_update",
-                    "user_id": user_id,
-                    "username": username,
-                    "is_in_voice": True
-                })
-                
-            elif message_type == "leave_voice":
-                # User left voice call
-                await manager.update_voice_status(room_id, user_id, False)
-                await manager.broadcast_to_room(room_id, {
-                    "type": "user_voice_update",
-                    "user_id": user_id,
-                    "username": username,
-                    "is_in_voice": False
-                })
-                
-            elif message_type == "typing":
-                # Forward typing indicators
-                await manager.broadcast_to_room(room_id, {
-                    "type": "user_typing",
-                    "user_id": user_id,
-                    "username": username,
-                    "is_typing": message.get("is_typing", False)
-                }, exclude=websocket)
+            # Text or binary, depending on the negotiated codec
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            conn.last_seen = time.monotonic()
+            data = frame.get("text")
+            if data is None:
+                data = frame.get("bytes")
+                if compressor is not None and compressor.is_compressed(data):
+                    data = compressor.inflate(data)
+            message = codec.decode(data)
+            if rate_limiter is not None:
+                try:
+                    delay = rate_limiter.admit(conn, message.get("type"))
+                except RateLimited as e:
+                    if e.notify:
+                        await manager.send_personal_message(e.notice(), websocket)
+                    continue
+                if delay:
+                    # Only this connection's reads are held back
+                    await asyncio.sleep(delay)
+            await dispatcher.dispatch(conn, message)
                 
     except WebSocketDisconnect:
-        user_data = manager.disconnect(websocket)
-        if user_data:
-            # Update user status in database
-            await db.users.update_one(
-                {"id": user_data['user_id']},
-                {"$set": {"is_online": False}}
-            )
-            
-            # Notify others about user leaving
-            remaining_users = manager.get_room_users(room_id)
-            await manager.broadcast_to_room(room_id, {
-                "type": "user_left",
-                "room_id": room_id,
-                "user": {
-                    "id": user_data['user_id'],
-                    "username": user_data['username']
-                },
-                "total_users": len(remaining_users)
-            })
+        pass
+    finally:
+        # Also runs when the loop fails on a bad frame; a no-op if the
+        # connection was already reaped
+        await manager.leave(websocket)
+
+# Values the app already counts are read at scrape time instead of being recorded twice
+metrics.gauge("connections", "Open WebSocket connections", collect=lambda: len(manager.registry))
+metrics.gauge("users", "Distinct users with an open WebSocket", collect=lambda: len(manager.registry.by_user))
+metrics.gauge("rooms", "Rooms with at least one open WebSocket", collect=lambda: len(manager.registry.rooms))
+metrics.counter("ws_messages_total", "Inbound WebSocket messages by type", ("type",),
+                collect=lambda: dict(dispatcher.stats, unknown=dispatcher.unknown))
+metrics.counter("ws_rate_limited_total", "Inbound WebSocket messages dropped by rate limiting", ("type",),
+                collect=lambda: dict(rate_limiter.dropped_by_type) if rate_limiter else {})
+metrics.counter("outbound_dropped_total", "Outbound frames dropped for slow consumers",
+                collect=lambda: manager.outbound_stats.dropped)
+metrics.counter("dead_connections_reaped_total", "Connections reaped as dead", ("reason",),
+                collect=lambda: dict(manager.reaped))
+metrics.counter("event_loop_stalls_total", "Event loop lag samples above the stall threshold",
+                collect=lambda: loop_monitor.stats["stalls"] if loop_monitor else 0)
+metrics.gauge("message_writer_buffered", "Chat messages waiting to be written to Mongo",
+              collect=lambda: message_writer.snapshot()["buffered"])
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -401,12 +1028,18 @@ cors_origins = os.environ.get('CORS_ORIGINS', '*')
 if cors_origins != '*':
     cors_origins = [origin.strip() for origin in cors_origins.split(',')]
 
+# Oversized uploads are refused before the form parser spools them to disk;
+# added before CORS so the 413 still carries the CORS headers
+app.add_middleware(UploadSizeLimit, max_bytes=MAX_UPLOAD_BYTES + FORM_OVERHEAD, detail="Файл слишком большой")
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=cors_origins,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Room list pagination and revalidation headers must be readable from the browser
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 # Configure logging
@@ -416,6 +1049,54 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def ensure_indexes():
+    indexes = [
+        (db.messages, [("room_id", 1), ("timestamp", -1), ("id", -1)], {"name": "room_timeline"}),
+        (db.messages, [("id", 1)], {"unique": True}),
+        (db.messages, [("file_url", 1)], {"sparse": True}),
+        (db.blobs, [("id", 1)], {"unique": True}),
+        (db.rooms, [("id", 1)], {"unique": True}),
+        (db.users, [("id", 1)], {"unique": True}),
+    ]
+    for collection, keys, options in indexes:
+        try:
+            await collection.create_index(keys, **options)
+        except Exception as e:
+            # Duplicate ids from older data or an unreachable database must not block startup
+            logger.error("Failed to create index %s on %s: %s", keys, collection.name, e)
+
+@app.on_event("startup")
+async def start_background_services():
+    if loop_monitor:
+        loop_monitor.start()
+    await ensure_indexes()
+    await event_bus.start(manager.deliver_remote)
+    logger.info("Room event bus: %s (node %s)", event_bus.backend, event_bus.node_id)
+    message_writer.start()
+    presence_writer.start()
+    if typing_aggregator:
+        typing_aggregator.start()
+    if heartbeat:
+        heartbeat.start()
+    background_tasks.append(asyncio.create_task(
+        content_store.run_garbage_collector(db.messages, UPLOAD_GC_INTERVAL, UPLOAD_GC_GRACE)
+    ))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in list(background_tasks):
+        task.cancel()
+    variant_pipeline.close()
+    if typing_aggregator:
+        await typing_aggregator.close()
+    if heartbeat:
+        await heartbeat.close()
+    if loop_monitor:
+        await loop_monitor.close()
+    if ice_batcher:
+        await ice_batcher.close()
+    await event_bus.close()
+    # Flush buffered chat messages before the Mongo client goes away
+    await message_writer.close()
+    await presence_writer.close()
     client.close()
\ No newline at end of file
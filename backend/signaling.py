@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+class IceCandidateBatcher:
+    """Collects trickled ICE candidates per (room, sender, target) and forwards
+    them as a single ``ice-candidates`` frame once the window closes."""
+
+    def __init__(self, window: float, deliver: Callable[[str, str, dict], Awaitable]):
+        self.window = window
+        self.deliver = deliver
+        self._batches: Dict[Tuple[str, str, str], list] = {}
+        self._timers: Dict[Tuple[str, str, str], asyncio.TimerHandle] = {}
+        self._flushing: Set[asyncio.Task] = set()  # flushes started by expired windows
+        self.stats = {"candidates": 0, "batches": 0, "end_of_candidates": 0, "errors": 0}
+
+    @staticmethod
+    def is_end_of_candidates(message: dict) -> bool:
+        candidate = message.get("candidate")
+        if isinstance(candidate, dict):
+            candidate = candidate.get("candidate")
+        return not candidate
+
+    async def add(self, room_id: str, sender_id: str, target_id: str, message: dict):
+        key = (room_id, sender_id, target_id)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = []
+            loop = asyncio.get_running_loop()
+            self._timers[key] = loop.call_later(self.window, self._expire, key)
+        batch.append(message.get("candidate"))
+        self.stats["candidates"] += 1
+
+        if self.is_end_of_candidates(message):
+            self.stats["end_of_candidates"] += 1
+            await self.flush(room_id, sender_id, target_id)
+
+    def _expire(self, key):
+        self._timers.pop(key, None)
+        if key in self._batches:
+            # The loop only keeps weak references to tasks
+            task = asyncio.create_task(self._flush_expired(key))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    async def _flush_expired(self, key):
+        try:
+            await self.flush(*key)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error("Failed to deliver ICE candidates from %s to %s in room %s: %s", key[1], key[2], key[0], e)
+
+    async def close(self):
+        # Deliver what is still batched; peers are mid-negotiation
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for key in list(self._batches):
+            await self._flush_expired(key)
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+
+    async def flush(self, room_id: str, sender_id: str, target_id: str):
+        key = (room_id, sender_id, target_id)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        candidates = self._batches.pop(key, None)
+        if not candidates:
+            return
+        self.stats["batches"] += 1
+        await self.deliver(room_id, target_id, {
+            "type": "ice-candidates",
+            "from_user_id": sender_id,
+            "target_user_id": target_id,
+            "candidates": candidates
+        })
+
+    def snapshot(self):
+        return dict(self.stats,
+                    pending=len(self._batches),
+                    frames_saved=self.stats["candidates"] - self.stats["batches"] - sum(
+                        len(batch) for batch in self._batches.values()))
@@ -0,0 +1,225 @@
+import mimetypes
+import os
+import stat
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Tuple
+
+import aiofiles
+
+CHUNK_SIZE = 256 * 1024
+
+# Everything under uploads/ is write-once: content-addressed blobs, their
+# variants and legacy uuid names never change once written
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+class FileMeta:
+    __slots__ = ('path', 'size', 'mtime', 'etag', 'last_modified', 'content_type', 'checked_at')
+
+    def __init__(self, path: str, st: os.stat_result):
+        self.path = path
+        self.size = st.st_size
+        self.mtime = int(st.st_mtime)
+        stem = Path(path).name.split(".", 1)[0]
+        # Content-addressed names already are a strong validator
+        self.etag = f'"{stem}"' if len(stem) >= 64 else f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+        self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.checked_at = time.monotonic()
+
+class UploadFiles:
+    """ASGI app serving uploads with immutable caching, conditional and Range requests.
+
+    The file is opened before any response starts, so a blob removed by the
+    upload GC is a clean 404. File metadata is kept in a small LRU cache, so a
+    hit costs no stat() call on top of that open, and bodies go out through
+    the zero-copy send extensions when the server offers them.
+    """
+
+    def __init__(self, directory: Path, cache_size: int = 4096, revalidate_after: float = 60.0):
+        self.directory = os.path.realpath(directory)
+        self.cache_size = cache_size
+        self.revalidate_after = revalidate_after
+        self._meta: "OrderedDict[str, FileMeta]" = OrderedDict()
+        self.stats = {"requests": 0, "not_modified": 0, "partial": 0, "not_found": 0,
+                      "meta_hits": 0, "meta_misses": 0, "zerocopy": 0, "bytes_sent": 0}
+
+    async def __call__(self, scope, receive, send):
+        assert scope["type"] == "http"
+        self.stats["requests"] += 1
+        if scope["method"] not in ("GET", "HEAD"):
+            await self._respond(send, 405, [(b"allow", b"GET, HEAD")])
+            return
+
+        opened = self._open(self._route_path(scope))
+        if opened is None:
+            self.stats["not_found"] += 1
+            await self._respond(send, 404)
+            return
+        meta, fd = opened
+        try:
+            await self._serve(scope, send, meta, fd)
+        finally:
+            os.close(fd)
+
+    async def _serve(self, scope, send, meta: FileMeta, fd: int):
+        headers = dict(scope["headers"])
+        base_headers = [
+            (b"cache-control", IMMUTABLE_CACHE_CONTROL.encode()),
+            (b"etag", meta.etag.encode()),
+            (b"last-modified", meta.last_modified.encode()),
+            (b"accept-ranges", b"bytes"),
+        ]
+
+        if self._not_modified(headers, meta):
+            self.stats["not_modified"] += 1
+            await self._respond(send, 304, base_headers)
+            return
+
+        start, end = 0, meta.size - 1
+        status = 200
+        range_header = headers.get(b"range")
+        if range_header and meta.size and self._if_range_matches(headers, meta):
+            requested = self._parse_range(range_header.decode("latin-1"), meta.size)
+            if requested == "invalid":
+                await self._respond(send, 416, [(b"content-range", f"bytes */{meta.size}".encode())])
+                return
+            if requested is not None:
+                start, end = requested
+                status = 206
+                self.stats["partial"] += 1
+                base_headers.append((b"content-range", f"bytes {start}-{end}/{meta.size}".encode()))
+
+        length = end - start + 1 if meta.size else 0
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": base_headers + [
+                (b"content-type", meta.content_type.encode()),
+                (b"content-length", str(length).encode()),
+            ],
+        })
+        if scope["method"] == "HEAD" or not length:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        await self._send_body(scope, send, meta, fd, start, length)
+        self.stats["bytes_sent"] += length
+
+    def _route_path(self, scope) -> str:
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        # Newer Starlette keeps the mount prefix in path and root_path
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        return path
+
+    def _open(self, route_path: str) -> Optional[Tuple[FileMeta, int]]:
+        """The file's metadata and an fd open for reading, or None for a 404."""
+        parts = [part for part in route_path.split("/") if part]
+        # No traversal, no hidden entries such as the .incoming temp directory
+        if not parts or any(part.startswith(".") for part in parts):
+            return None
+        full_path = os.path.join(self.directory, *parts)
+        try:
+            fd = os.open(full_path, os.O_RDONLY)
+        except OSError:
+            # Also drops metadata cached before the upload GC removed the file
+            self._meta.pop(full_path, None)
+            return None
+
+        meta = self._meta.get(full_path)
+        now = time.monotonic()
+        if meta is not None and now - meta.checked_at < self.revalidate_after:
+            self._meta.move_to_end(full_path)
+            self.stats["meta_hits"] += 1
+            return meta, fd
+
+        self.stats["meta_misses"] += 1
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            os.close(fd)
+            self._meta.pop(full_path, None)
+            return None
+        meta = FileMeta(full_path, st)
+        self._meta[full_path] = meta
+        self._meta.move_to_end(full_path)
+        if len(self._meta) > self.cache_size:
+            self._meta.popitem(last=False)
+        return meta, fd
+
+    @staticmethod
+    def _not_modified(headers, meta: FileMeta) -> bool:
+        if_none_match = headers.get(b"if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.decode("latin-1").split(",")]
+            return "*" in tags or meta.etag in tags or f"W/{meta.etag}" in tags
+        if_modified_since = headers.get(b"if-modified-since")
+        if if_modified_since is not None:
+            try:
+                return int(parsedate_to_datetime(if_modified_since.decode("latin-1")).timestamp()) >= meta.mtime
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _if_range_matches(headers, meta: FileMeta) -> bool:
+        if_range = headers.get(b"if-range")
+        if if_range is None:
+            return True
+        value = if_range.decode("latin-1").strip()
+        return value == meta.etag or value == meta.last_modified
+
+    @staticmethod
+    def _parse_range(value: str, size: int):
+        # Single byte ranges only; anything else is served in full
+        if not value.startswith("bytes=") or "," in value:
+            return None
+        first, _, last = value[6:].strip().partition("-")
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+            else:
+                suffix = int(last)
+                if suffix <= 0:
+                    return "invalid"
+                start, end = max(size - suffix, 0), size - 1
+        except ValueError:
+            return None
+        if start >= size or start > end:
+            return "invalid"
+        return start, min(end, size - 1)
+
+    async def _send_body(self, scope, send, meta: FileMeta, fd: int, start: int, length: int):
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            self.stats["zerocopy"] += 1
+            await send({"type": "http.response.zerocopysend", "file": fd,
+                        "offset": start, "count": length})
+            return
+        if "http.response.pathsend" in extensions and start == 0 and length == meta.size:
+            self.stats["zerocopy"] += 1
+            await send({"type": "http.response.pathsend", "path": meta.path})
+            return
+
+        async with aiofiles.open(fd, "rb", closefd=False) as f:
+            await f.seek(start)
+            remaining = length
+            while remaining:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+
+    @staticmethod
+    async def _respond(send, status: int, headers=None):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": (headers or []) + [(b"content-length", b"0")]})
+        await send({"type": "http.response.body", "body": b""})
+
+    def snapshot(self):
+        return dict(self.stats, cached_entries=len(self._meta))
@@ -0,0 +1,279 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Tuple
+
+import aiofiles
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+# Candidate blobs looked up per reference query during garbage collection
+GC_LOOKUP_BATCH = 500
+
+# Magic numbers of the image formats chat accepts
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png", "png"),
+    (b"\xff\xd8\xff", "image/jpeg", "jpg"),
+    (b"GIF87a", "image/gif", "gif"),
+    (b"GIF89a", "image/gif", "gif"),
+)
+
+class UploadTooLarge(Exception):
+    pass
+
+class UnsupportedContent(Exception):
+    pass
+
+# Multipart boundaries, part headers and the small form fields sent next to the file
+FORM_OVERHEAD = 64 * 1024
+
+class UploadSizeLimit:
+    """ASGI middleware that turns away oversized uploads before they are spooled.
+
+    The form parser writes the whole body to a temporary file before the
+    endpoint sees it. Upload requests announcing more than ``max_bytes`` get a
+    413 straight away, and bodies without a Content-Length are cut off as soon
+    as they pass the limit.
+    """
+
+    def __init__(self, app, max_bytes: int, path_suffix: str = "/upload", detail: str = "Upload too large"):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_suffix = path_suffix
+        self.detail = detail
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].endswith(self.path_suffix):
+            await self.app(scope, receive, send)
+            return
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if value.isdigit() and int(value) > self.max_bytes:
+                    await self._reject(scope, receive, send)
+                    return
+                break
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Looks like a disconnect to the parser, which stops reading
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            # The app's answer to the cut-off body is replaced by the 413
+            if not exceeded:
+                await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
+        if exceeded:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        logger.info("Rejected upload to %s: larger than %d bytes", scope["path"], self.max_bytes)
+        response = JSONResponse({"detail": self.detail}, status_code=413, headers={"Connection": "close"})
+        await response(scope, receive, send)
+
+class StoredUpload:
+    __slots__ = ('path', 'size', 'sha256', 'content_type', 'extension', 'deduplicated')
+
+    def __init__(self, path: Path, size: int, sha256: str, content_type: str, extension: str,
+                 deduplicated: bool = False):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.content_type = content_type
+        self.extension = extension
+        self.deduplicated = deduplicated
+
+def sniff_image_type(head: bytes) -> Optional[Tuple[str, str]]:
+    for signature, content_type, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type, extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", "webp"
+    return None
+
+# Blob files are named after the SHA-256 of their content
+BLOB_NAME = re.compile(r"([0-9a-f]{64})\.(png|jpg|gif|webp)")
+
+class ContentStore:
+    """Content-addressed, deduplicated storage for uploaded images.
+
+    Blobs are stored once as ``<sha256>.<ext>``, with their metadata in the
+    ``blobs`` collection next to ``messages``. A garbage collector removes
+    blobs that no message points to any more; a blob's mtime is its last use.
+    """
+
+    def __init__(self, directory: Path, blobs=None, max_bytes: int = 10 * 1024 * 1024,
+                 chunk_size: int = CHUNK_SIZE, variants_dir: Optional[Path] = None):
+        self.directory = directory
+        self.variants_dir = variants_dir
+        self.blobs = blobs
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.stats = {
+            "uploads": 0,
+            "deduplicated": 0,
+            "bytes_written": 0,
+            "bytes_saved": 0,
+            "gc_runs": 0,
+            "gc_removed": 0,
+            "gc_bytes_reclaimed": 0
+        }
+
+    def url_for(self, name: str) -> str:
+        return f"/uploads/{name}"
+
+    async def put(self, upload) -> StoredUpload:
+        """Store an upload, reading it in fixed-size chunks.
+
+        The first pass hashes, sniffs and size-checks the content without
+        writing anything, so a duplicate never touches the disk. New content is
+        copied to a temporary file and atomically renamed into place.
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        detected = None
+        await upload.seek(0)
+        while True:
+            chunk = await upload.read(self.chunk_size)
+            if not chunk:
+                break
+            if detected is None:
+                detected = sniff_image_type(chunk)
+                if detected is None:
+                    raise UnsupportedContent()
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise UploadTooLarge()
+            hasher.update(chunk)
+        if detected is None:
+            raise UnsupportedContent()
+
+        content_type, extension = detected
+        sha256 = hasher.hexdigest()
+        final_path = self.directory / f"{sha256}.{extension}"
+        self.stats["uploads"] += 1
+        try:
+            # A duplicate restarts the grace period: its new message may still be in the write-behind buffer
+            os.utime(final_path)
+        except FileNotFoundError:
+            pass
+        else:
+            self.stats["deduplicated"] += 1
+            self.stats["bytes_saved"] += size
+            return StoredUpload(final_path, size, sha256, content_type, extension, deduplicated=True)
+
+        incoming = self.directory / ".incoming"
+        incoming.mkdir(exist_ok=True)
+        temp_path = incoming / f"{uuid.uuid4().hex}.part"
+        try:
+            await upload.seek(0)
+            async with aiofiles.open(temp_path, "wb") as out:
+                while True:
+                    chunk = await upload.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    await out.write(chunk)
+            os.replace(temp_path, final_path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self.stats["bytes_written"] += size
+        return StoredUpload(final_path, size, sha256, content_type, extension)
+
+    async def add_reference(self, stored: StoredUpload):
+        if self.blobs is None:
+            return
+        await self.blobs.update_one(
+            {"id": stored.sha256},
+            {
+                "$set": {"last_referenced": datetime.utcnow()},
+                "$setOnInsert": {
+                    "file_url": self.url_for(stored.path.name),
+                    "size": stored.size,
+                    "content_type": stored.content_type,
+                    "created_at": datetime.utcnow()
+                }
+            },
+            upsert=True
+        )
+
+    def _scan(self, grace_seconds: float):
+        cutoff = time.time() - grace_seconds
+        candidates = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                match = BLOB_NAME.fullmatch(entry.name)
+                if match and entry.is_file():
+                    stat = entry.stat()
+                    if stat.st_mtime < cutoff:
+                        candidates.append((match.group(1), entry.name, stat.st_size))
+        return candidates
+
+    async def collect_garbage(self, messages, grace_seconds: float) -> int:
+        # Blobs younger than the grace period may belong to messages that are
+        # still in the write-behind buffer
+        candidates = await asyncio.to_thread(self._scan, grace_seconds)
+        # One query per batch on the file_url index instead of one per blob
+        referenced = set()
+        for start in range(0, len(candidates), GC_LOOKUP_BATCH):
+            urls = [self.url_for(name) for _, name, _ in candidates[start:start + GC_LOOKUP_BATCH]]
+            referenced.update(await messages.distinct("file_url", {"file_url": {"$in": urls}}))
+        removed = 0
+        for sha256, name, size in candidates:
+            if self.url_for(name) in referenced:
+                continue
+            path = self.directory / name
+            try:
+                if os.stat(path).st_mtime >= time.time() - grace_seconds:
+                    continue  # uploaded again since the scan
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            if self.variants_dir is not None:
+                for variant in self.variants_dir.glob(f"{sha256}_*"):
+                    variant.unlink(missing_ok=True)
+            if self.blobs is not None:
+                await self.blobs.delete_one({"id": sha256})
+            removed += 1
+            self.stats["gc_removed"] += 1
+            self.stats["gc_bytes_reclaimed"] += size
+        self.stats["gc_runs"] += 1
+        return removed
+
+    async def run_garbage_collector(self, messages, interval: float, grace_seconds: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await self.collect_garbage(messages, grace_seconds)
+                if removed:
+                    logger.info("Upload GC removed %d unreferenced blobs", removed)
+            except Exception as e:
+                logger.error("Upload GC failed: %s", e)
+
+    def snapshot(self):
+        stats = self.stats
+        return dict(stats, dedupe_ratio=stats["deduplicated"] / stats["uploads"] if stats["uploads"] else 0.0)
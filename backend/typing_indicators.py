@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+class TypingAggregator:
+    """Aggregates typing indicators into one ``typing_snapshot`` frame per room.
+
+    Repeated "still typing" events of a user are rate limited, typers that stop
+    refreshing expire after ``ttl`` seconds, and a room's snapshot is sent at
+    most once per ``interval`` and only when its set of typers changed.
+
+    With ``publish`` set, this node's own typers are shared with the other
+    nodes, which ``merge`` them into the snapshots for their local sockets.
+    Remote typers expire like local ones unless their node refreshes them.
+    """
+
+    def __init__(self, emit: Callable[[str, dict], Awaitable], interval: float = 0.25,
+                 ttl: float = 5.0, min_interval: float = 1.0,
+                 publish: Optional[Callable[[str, dict], Awaitable]] = None):
+        self.emit = emit
+        self.publish = publish
+        self.interval = interval
+        self.ttl = ttl
+        self.min_interval = min_interval
+        self._typers: Dict[str, Dict[str, Tuple[str, float]]] = {}  # room -> user -> (username, expires_at)
+        self._remote: Dict[str, Dict[str, Dict[str, Tuple[str, float]]]] = {}  # room -> node -> user -> ...
+        self._last_event: Dict[Tuple[str, str], float] = {}
+        self._dirty: Set[str] = set()  # rooms whose local sockets need a new snapshot
+        self._changed: Set[str] = set()  # rooms whose local typers other nodes need to hear about
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"events": 0, "throttled": 0, "expired": 0, "snapshots": 0, "published": 0, "merged": 0}
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def update(self, room_id: str, user_id: str, username: str, is_typing: bool):
+        self.stats["events"] += 1
+        now = time.monotonic()
+        typers = self._typers.get(room_id)
+        if not is_typing:
+            self._last_event.pop((room_id, user_id), None)
+            if typers and typers.pop(user_id, None) is not None:
+                self._dirty.add(room_id)
+                self._changed.add(room_id)
+            return
+
+        key = (room_id, user_id)
+        if typers is not None and user_id in typers and now - self._last_event.get(key, 0) < self.min_interval:
+            self.stats["throttled"] += 1
+            return
+        self._last_event[key] = now
+        if typers is None:
+            typers = self._typers[room_id] = {}
+        if user_id not in typers:
+            self._dirty.add(room_id)
+        # Refreshes go out too, or other nodes would expire a user who keeps typing
+        self._changed.add(room_id)
+        typers[user_id] = (username, now + self.ttl)
+
+    def remove_user(self, room_id: str, user_id: str):
+        self.update(room_id, user_id, "", False)
+
+    def merge(self, room_id: str, node_id: str, users: list):
+        """Replace the typers another node reported for a room."""
+        self.stats["merged"] += 1
+        expires_at = time.monotonic() + self.ttl
+        nodes = self._remote.setdefault(room_id, {})
+        before = nodes.pop(node_id, {})
+        typers = {user["user_id"]: (user.get("username", ""), expires_at)
+                  for user in users if isinstance(user, dict) and user.get("user_id")}
+        if typers:
+            nodes[node_id] = typers
+        elif not nodes:
+            del self._remote[room_id]
+        if typers.keys() != before.keys():
+            self._dirty.add(room_id)
+
+    def _expire(self, now: float):
+        for room_id, typers in list(self._typers.items()):
+            stale = [user_id for user_id, (_, expires_at) in typers.items() if expires_at <= now]
+            for user_id in stale:
+                del typers[user_id]
+                self._last_event.pop((room_id, user_id), None)
+                self.stats["expired"] += 1
+            if stale:
+                self._dirty.add(room_id)
+                self._changed.add(room_id)
+        for room_id, nodes in list(self._remote.items()):
+            for node_id, typers in list(nodes.items()):
+                stale = [user_id for user_id, (_, expires_at) in typers.items() if expires_at <= now]
+                for user_id in stale:
+                    del typers[user_id]
+                    self.stats["expired"] += 1
+                if stale:
+                    self._dirty.add(room_id)
+                if not typers:
+                    del nodes[node_id]
+            if not nodes:
+                del self._remote[room_id]
+
+    @staticmethod
+    def _frame(room_id: str, typers: Dict[str, Tuple[str, float]]) -> dict:
+        return {
+            "type": "typing_snapshot",
+            "room_id": room_id,
+            "users": [{"user_id": user_id, "username": username}
+                      for user_id, (username, _) in typers.items()]
+        }
+
+    async def flush(self):
+        self._expire(time.monotonic())
+        dirty, self._dirty = self._dirty, set()
+        changed, self._changed = self._changed, set()
+        if self.publish is not None:
+            # Only this node's typers; every node merges in the others itself
+            for room_id in changed:
+                self.stats["published"] += 1
+                await self.publish(room_id, self._frame(room_id, self._typers.get(room_id) or {}))
+        for room_id in dirty:
+            typers = {}
+            for remote in self._remote.get(room_id, {}).values():
+                typers.update(remote)
+            typers.update(self._typers.get(room_id) or {})
+            if not self._typers.get(room_id):
+                self._typers.pop(room_id, None)
+            self.stats["snapshots"] += 1
+            await self.emit(room_id, self._frame(room_id, typers))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Typing snapshot flush failed: %s", e)
+
+    def snapshot(self):
+        return dict(self.stats,
+                    rooms=len(self._typers),
+                    typers=sum(len(typers) for typers in self._typers.values()),
+                    remote_typers=sum(len(typers) for nodes in self._remote.values() for typers in nodes.values()))
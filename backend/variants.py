@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, previews are skipped without it
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> longest side in pixels
+DEFAULT_SIZES = {"thumb": 320, "medium": 1280}
+
+def variant_name(sha256: str, variant: str) -> str:
+    return f"{sha256}_{variant}.webp"
+
+def render_variants(source: str, output_dir: str, sha256: str, sizes: Dict[str, int], quality: int) -> Dict[str, str]:
+    # Runs in a worker process. Only pixels are written back out, so EXIF,
+    # ICC and other metadata of the original are dropped.
+    output = Path(output_dir)
+    rendered = {}
+    with Image.open(source) as original:
+        original.seek(0)
+        image = ImageOps.exif_transpose(original)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        for variant, longest_side in sizes.items():
+            resized = image.copy()
+            resized.thumbnail((longest_side, longest_side), Image.LANCZOS)
+            name = variant_name(sha256, variant)
+            temp_path = output / f".{name}.{os.getpid()}.tmp"
+            resized.save(temp_path, "WEBP", quality=quality, method=4)
+            os.replace(temp_path, output / name)
+            rendered[variant] = name
+    return rendered
+
+class VariantPipeline:
+    """Generates preview variants of uploaded images in a process pool, off the event loop."""
+
+    def __init__(self, directory: Path, url_prefix: str, workers: int = 1,
+                 sizes: Optional[Dict[str, int]] = None, quality: int = 80):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self.workers = workers
+        self.sizes = sizes or DEFAULT_SIZES
+        self.quality = quality
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.stats = {"generated": 0, "reused": 0, "failed": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None and self.workers > 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # spawn: forking a process that runs an event loop and driver threads is unsafe
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def urls(self, names: Dict[str, str]) -> Dict[str, str]:
+        return {variant: f"{self.url_prefix}/{name}" for variant, name in names.items()}
+
+    async def generate(self, source: Path, sha256: str) -> Optional[Dict[str, str]]:
+        if not self.enabled:
+            return None
+
+        # Content-addressed: a duplicate upload already has its variants
+        existing = {variant: variant_name(sha256, variant) for variant in self.sizes}
+        if all((self.directory / name).exists() for name in existing.values()):
+            self.stats["reused"] += 1
+            return self.urls(existing)
+
+        loop = asyncio.get_running_loop()
+        try:
+            names = await loop.run_in_executor(self._pool(), render_variants, str(source),
+                                               str(self.directory), sha256, self.sizes, self.quality)
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.warning("Failed to render variants of %s: %s", source.name, e)
+            return None
+        self.stats["generated"] += 1
+        return self.urls(names)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def snapshot(self):
+        return dict(self.stats, enabled=self.enabled, workers=self.workers)
@@ -0,0 +1,249 @@
+import json
+import logging
+import time
+import zlib
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json is used without it
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional, the msgpack subprotocol is not offered without it
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+Frame = Union[str, bytes]
+
+def json_default(value):
+    # Match FastAPI's encoding of datetimes in REST responses
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class JsonCodec:
+    """JSON text frames encoded with the stdlib json module."""
+
+    name = "json"
+    implementation = "stdlib"
+    binary = False
+
+    def encode(self, message: dict) -> str:
+        return json.dumps(message, default=json_default)
+
+    def decode(self, data: Frame) -> dict:
+        return json.loads(data)
+
+class OrjsonCodec(JsonCodec):
+    """The same JSON text frames, encoded and parsed by orjson."""
+
+    implementation = "orjson"
+
+    def encode(self, message: dict) -> str:
+        # Naive datetimes come out exactly like datetime.isoformat()
+        return orjson.dumps(message, default=json_default).decode()
+
+    def decode(self, data: Frame) -> dict:
+        return orjson.loads(data)
+
+class MsgpackCodec:
+    """Compact binary frames. Datetimes travel as ISO strings, as in JSON."""
+
+    name = "msgpack"
+    implementation = "msgpack"
+    binary = True
+
+    def encode(self, message: dict) -> bytes:
+        return msgpack.packb(message, default=json_default)
+
+    def decode(self, data: Frame) -> dict:
+        if isinstance(data, str):
+            # A text frame on a msgpack connection is still plain JSON
+            return json.loads(data)
+        return msgpack.unpackb(data)
+
+# WebSocket subprotocol names a client can offer, e.g.
+# new WebSocket(url, ["voicechat.msgpack", "voicechat.json"])
+SUBPROTOCOL_PREFIX = "voicechat."
+
+def create_json_codec(implementation: str = "stdlib") -> JsonCodec:
+    if implementation == "orjson":
+        if orjson is not None:
+            return OrjsonCodec()
+        logger.warning("WIRE_JSON=orjson but orjson is not installed, using stdlib json")
+    return JsonCodec()
+
+class CodecRegistry:
+    """Codecs offered to clients through the WebSocket subprotocol.
+
+    ``text`` is the default codec; it is used for clients that offer no known
+    subprotocol and for frames passed between nodes over the event bus.
+    """
+
+    def __init__(self, text: JsonCodec):
+        self.text = text
+        self.codecs = {text.name: text}
+        if msgpack is not None:
+            self.codecs[MsgpackCodec.name] = MsgpackCodec()
+        self.stats = {name: 0 for name in self.codecs}
+
+    def negotiate(self, offered: List[str]) -> Tuple[Optional[str], JsonCodec]:
+        # First subprotocol in the client's order of preference that we support
+        for subprotocol in offered:
+            if subprotocol.startswith(SUBPROTOCOL_PREFIX):
+                codec = self.codecs.get(subprotocol[len(SUBPROTOCOL_PREFIX):])
+                if codec is not None:
+                    self.stats[codec.name] += 1
+                    return subprotocol, codec
+        self.stats[self.text.name] += 1
+        return None, self.text
+
+    def snapshot(self):
+        return {"json": self.text.implementation, "available": list(self.codecs), "negotiated": dict(self.stats)}
+
+# Every zlib stream starts with this byte (deflate, 32K window); JSON text never
+# arrives as a binary frame and no msgpack map starts with it
+ZLIB_HEADER = 0x78
+
+class FrameCompressor:
+    """zlib compression of outbound frames above a size threshold.
+
+    Compressed frames are sent as binary frames holding a zlib stream, so
+    small frames such as ICE candidates and typing snapshots skip the CPU
+    cost entirely. Frames that do not shrink are sent as they are. This
+    replaces permessage-deflate, which compresses every frame and must be
+    turned off in the server (``--ws-per-message-deflate false``), or large
+    frames would be deflated twice.
+    """
+
+    def __init__(self, threshold: int = 1024, level: int = 6, max_inflated: int = 1024 * 1024):
+        self.threshold = threshold
+        self.level = level
+        self.max_inflated = max_inflated
+        self.stats = {"compressed": 0, "below_threshold": 0, "incompressible": 0, "inflated": 0,
+                      "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0}
+
+    def compress(self, frame: Frame) -> Frame:
+        data = frame.encode() if isinstance(frame, str) else frame
+        if len(data) < self.threshold:
+            self.stats["below_threshold"] += 1
+            return frame
+        started = time.thread_time()
+        compressed = zlib.compress(data, self.level)
+        self.stats["cpu_seconds"] += time.thread_time() - started
+        if len(compressed) >= len(data):
+            self.stats["incompressible"] += 1
+            return frame
+        self.stats["compressed"] += 1
+        self.stats["bytes_in"] += len(data)
+        self.stats["bytes_out"] += len(compressed)
+        return compressed
+
+    def inflate(self, data: bytes) -> bytes:
+        # Inbound frames come from clients: a small frame must not expand without bound
+        decompressor = zlib.decompressobj()
+        inflated = decompressor.decompress(data, self.max_inflated)
+        if decompressor.unconsumed_tail:
+            raise ValueError(f"Compressed frame inflates beyond {self.max_inflated} bytes")
+        self.stats["inflated"] += 1
+        return inflated
+
+    @staticmethod
+    def is_compressed(data: Frame) -> bool:
+        return isinstance(data, bytes) and len(data) > 1 and data[0] == ZLIB_HEADER
+
+    def snapshot(self):
+        stats = self.stats
+        return {
+            **{k: v for k, v in stats.items() if k != "cpu_seconds"},
+            "threshold": self.threshold,
+            "level": self.level,
+            "bytes_saved": stats["bytes_in"] - stats["bytes_out"],
+            "ratio": stats["bytes_out"] / stats["bytes_in"] if stats["bytes_in"] else 1.0,
+            "cpu_ms": stats["cpu_seconds"] * 1000
+        }
+
+class EncodedFrames:
+    """One message encoded lazily, at most once per codec and compressor.
+
+    Built either from the message itself or from an already encoded text
+    frame (as received from the event bus), which is only decoded when a
+    recipient needs a different codec.
+    """
+
+    __slots__ = ('text_codec', '_message', '_frames')
+
+    def __init__(self, text_codec: JsonCodec, message: Optional[dict] = None, text: Optional[str] = None):
+        self.text_codec = text_codec
+        self._message = message
+        self._frames: Dict[object, Frame] = {}
+        if text is not None:
+            self._frames[text_codec] = text
+
+    @property
+    def text(self) -> str:
+        return self.encode(self.text_codec)
+
+    def encode(self, codec, compressor: Optional[FrameCompressor] = None) -> Frame:
+        if compressor is not None:
+            key = (codec, compressor)
+            frame = self._frames.get(key)
+            if frame is None:
+                frame = self._frames[key] = compressor.compress(self.encode(codec))
+            return frame
+        frame = self._frames.get(codec)
+        if frame is None:
+            if self._message is None:
+                self._message = self.text_codec.decode(self._frames[self.text_codec])
+            frame = self._frames[codec] = codec.encode(self._message)
+        return frame
+
+Handler = Callable[..., Awaitable]
+
+class MessageDispatcher:
+    """Table of handlers for inbound WebSocket messages, keyed by message type.
+
+    With a ``histogram`` (anything with ``labels(message_type).observe(seconds)``)
+    the time spent in each handler is recorded per message type.
+    """
+
+    def __init__(self, histogram=None):
+        self.handlers: Dict[str, Handler] = {}
+        self.stats: Dict[str, int] = {}
+        self.unknown = 0
+        self.histogram = histogram
+        self._timers: Dict[str, object] = {}
+
+    def on(self, *message_types: str):
+        def register(handler: Handler) -> Handler:
+            for message_type in message_types:
+                self.handlers[message_type] = handler
+                self.stats[message_type] = 0
+                if self.histogram is not None:
+                    self._timers[message_type] = self.histogram.labels(message_type)
+            return handler
+        return register
+
+    async def dispatch(self, conn, message: dict):
+        message_type = message.get("type")
+        handler = self.handlers.get(message_type)
+        if handler is None:
+            self.unknown += 1
+            return
+        self.stats[message_type] += 1
+        timer = self._timers.get(message_type)
+        if timer is None:
+            await handler(conn, message)
+            return
+        started = time.perf_counter()
+        try:
+            await handler(conn, message)
+        finally:
+            timer.observe(time.perf_counter() - started)
+
+    def snapshot(self):
+        return dict(self.stats, unknown=self.unknown)
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite for Discord-like Voice Chat Backend
+Microbenchmarks for the hot paths of backend/server.py, run in-process without a live server.
+
+Usage: python backend_bench.py <benchmark> [options]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def print_table(title, rows):
+    print(f"\n📊 {title}")
+    if not rows:
+        return
+    headers = list(rows[0].keys())
+    widths = [max(len(str(h)), *(len(str(row[h])) for row in rows)) for h in headers]
+    print("  " + "  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  " + "  ".join(str(row[h]).ljust(w) for h, w in zip(headers, widths)))
+
+# ---------------------------------------------------------------------------
+# Uploads: peak RSS of concurrent uploads, whole-file read vs chunked streaming
+# ---------------------------------------------------------------------------
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+async def legacy_store(upload, directory):
+    # The original upload_file implementation
+    import aiofiles
+    import uuid
+    async with aiofiles.open(directory / f"{uuid.uuid4()}.png", "wb") as f:
+        content = await upload.read()
+        await f.write(content)
+
+async def run_upload_variant(variant, concurrency, size_mb):
+    from starlette.datastructures import UploadFile
+    from storage import ContentStore
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-upload-"))
+    sources = []
+    for i in range(concurrency):
+        path = workdir / f"source-{i}.png"
+        with open(path, "wb") as f:
+            f.write(PNG_HEADER)
+            block = os.urandom(1024 * 1024)
+            for _ in range(size_mb):
+                f.write(block)
+        sources.append(path)
+    target = workdir / "uploads"
+    target.mkdir()
+
+    baseline = peak_rss_mb()
+    uploads = [UploadFile(file=open(path, "rb"), filename=path.name) for path in sources]
+    started = time.perf_counter()
+    if variant == "legacy":
+        await asyncio.gather(*(legacy_store(upload, target) for upload in uploads))
+    else:
+        store = ContentStore(target, max_bytes=1 << 40)
+        await asyncio.gather(*(store.put(upload) for upload in uploads))
+    elapsed = time.perf_counter() - started
+    for upload in uploads:
+        upload.file.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "variant": variant,
+        "concurrency": concurrency,
+        "file_mb": size_mb,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(concurrency * size_mb / elapsed, 1),
+        "peak_rss_growth_mb": round(peak_rss_mb() - baseline, 1)
+    }
+
+def bench_upload(args):
+    if args.variant:
+        # Child process: one variant per process so ru_maxrss is not shared
+        result = asyncio.run(run_upload_variant(args.variant, args.concurrency, args.size_mb))
+        print(json.dumps(result))
+        return result
+
+    rows = []
+    for variant in ("legacy", "stream"):
+        output = subprocess.run(
+            [sys.executable, __file__, "upload", "--variant", variant,
+             "--concurrency", str(args.concurrency), "--size-mb", str(args.size_mb)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        rows.append(json.loads(output.strip().splitlines()[-1]))
+    print_table(f"Concurrent uploads ({args.concurrency} x {args.size_mb} MB)", rows)
+    return rows
+
+# ---------------------------------------------------------------------------
+# Static serving: StaticFiles vs UploadFiles for full, revalidated and ranged GETs
+# ---------------------------------------------------------------------------
+
+async def run_static_variant(name, app, paths, requests, concurrency, headers):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        received = 0
+        queue = [paths[i % len(paths)] for i in range(requests)]
+
+        async def worker():
+            nonlocal received
+            while queue:
+                response = await client.get(queue.pop(), headers=headers)
+                received += len(response.content)
+
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+
+    megabytes = received / (1024 * 1024)
+    return {
+        "server": name,
+        "req_per_s": round(requests / elapsed),
+        "mb_sent": round(megabytes, 1),
+        "cpu_ms_per_mb": round(cpu * 1000 / megabytes, 2) if megabytes else "-",
+        "cpu_us_per_req": round(cpu * 1e6 / requests, 1)
+    }
+
+def bench_static(args):
+    import hashlib
+    from starlette.staticfiles import StaticFiles
+    from static_files import UploadFiles
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-static-"))
+    paths = []
+    for _ in range(args.files):
+        content = PNG_HEADER + os.urandom(args.size_kb * 1024)
+        name = f"{hashlib.sha256(content).hexdigest()}.png"
+        (workdir / name).write_bytes(content)
+        paths.append(f"/{name}")
+
+    servers = {"StaticFiles": StaticFiles(directory=workdir), "UploadFiles": UploadFiles(workdir)}
+    scenarios = {
+        "full": {},
+        "range 64KB": {"Range": "bytes=0-65535"},
+    }
+    rows = []
+    for scenario, headers in scenarios.items():
+        for name, app in servers.items():
+            row = asyncio.run(run_static_variant(name, app, paths, args.requests, args.concurrency, headers))
+            rows.append({"scenario": scenario, **row})
+
+    # Revalidation with the validator each server handed out
+    for name, app in servers.items():
+        async def etag():
+            import httpx
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                return (await client.get(paths[0])).headers["etag"]
+        headers = {"If-None-Match": asyncio.run(etag())}
+        row = asyncio.run(run_static_variant(name, app, paths[:1], args.requests, args.concurrency, headers))
+        rows.append({"scenario": "if-none-match", **row})
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    print_table(f"Static serving ({args.files} files x {args.size_kb} KB, {args.requests} requests)", rows)
+    return rows
+
+# ---------------------------------------------------------------------------
+# Typing indicators: frames/sec of per-keystroke forwarding vs aggregated snapshots
+# ---------------------------------------------------------------------------
+
+async def run_typing_variant(variant, args):
+    import random
+    from typing_indicators import TypingAggregator
+
+    frames = 0
+    recipients = args.members - 1
+
+    async def emit(room_id, message):
+        nonlocal frames
+        # Snapshots go to the whole room, typists included
+        frames += args.members
+
+    aggregator = None
+    if variant == "aggregated":
+        aggregator = TypingAggregator(emit, args.interval_ms / 1000, args.ttl, args.min_interval_ms / 1000)
+        aggregator.start()
+
+    deadline = time.monotonic() + args.seconds
+    rng = random.Random(1)
+
+    async def typist(room_id, user_id):
+        nonlocal frames
+        # Bursts of typing followed by a pause, one event per keystroke
+        while time.monotonic() < deadline:
+            burst_end = time.monotonic() + rng.uniform(1, 4)
+            while time.monotonic() < min(burst_end, deadline):
+                if aggregator:
+                    aggregator.update(room_id, user_id, user_id, True)
+                else:
+                    frames += recipients
+                await asyncio.sleep(args.keystroke_ms / 1000 * rng.uniform(0.5, 1.5))
+            if aggregator:
+                aggregator.update(room_id, user_id, user_id, False)
+            else:
+                frames += recipients
+            await asyncio.sleep(rng.uniform(0.5, 2))
+
+    cpu_started = time.process_time()
+    await asyncio.gather(*(typist(f"room-{room}", f"user-{i}")
+                           for room in range(args.rooms) for i in range(args.typists)))
+    if aggregator:
+        await aggregator.flush()
+        await aggregator.close()
+    cpu = time.process_time() - cpu_started
+
+    return {
+        "variant": variant,
+        "rooms": args.rooms,
+        "members": args.members,
+        "typists": args.typists,
+        "frames": frames,
+        "frames_per_s": round(frames / args.seconds),
+        "cpu_s": round(cpu, 2)
+    }
+
+def bench_typing(args):
+    rows = [asyncio.run(run_typing_variant(variant, args)) for variant in ("forward", "aggregated")]
+    print_table(f"Typing indicators ({args.seconds}s, keystroke every ~{args.keystroke_ms}ms)", rows)
+    return rows
+
+# ---------------------------------------------------------------------------
+# Wire codecs: encode/decode of typical frames and message type dispatch
+# ---------------------------------------------------------------------------
+
+def sample_frames():
+    from datetime import datetime
+    import uuid
+
+    sdp = "v=0\r\n" + "a=candidate:1 1 udp 2122260223 192.168.1.10 54400 typ host generation 0\r\n" * 30
+    chat = {
+        "id": str(uuid.uuid4()), "room_id": "general", "user_id": str(uuid.uuid4()), "username": "Алиса",
+        "message": "Привет! Как дела? " * 3, "message_type": "text", "file_url": None, "variants": None,
+        "timestamp": datetime.utcnow()
+    }
+    return {
+        "offer": {"type": "offer", "offer": {"type": "offer", "sdp": sdp},
+                  "target_user_id": "user-2", "from_user_id": "user-1"},
+        "ice-candidate": {"type": "ice-candidate", "target_user_id": "user-2", "from_user_id": "user-1",
+                          "candidate": {"candidate": "candidate:1 1 udp 2122260223 192.168.1.10 54400 typ host",
+                                        "sdpMid": "0", "sdpMLineIndex": 0}},
+        "new_message": {"type": "new_message", "message": chat},
+        "room_info": {"type": "room_info",
+                      "data": {"id": "general", "name": "General", "created_at": datetime.utcnow(), "active_users": 12,
+                               "users": [{"id": f"user-{i}", "username": f"User {i}", "is_in_voice": i % 3 == 0}
+                                         for i in range(12)]},
+                      "messages": [dict(chat, id=str(uuid.uuid4())) for _ in range(50)]},
+    }
+
+def ops_per_second(function, argument, seconds):
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while True:
+        for _ in range(100):
+            function(argument)
+        count += 100
+        now = time.perf_counter()
+        if now >= deadline:
+            return count / (now - started)
+
+def bench_codec(args):
+    from wire import JsonCodec, MessageDispatcher, MsgpackCodec, OrjsonCodec, msgpack, orjson
+
+    codecs = [JsonCodec()]
+    if orjson is not None:
+        codecs.append(OrjsonCodec())
+    if msgpack is not None:
+        codecs.append(MsgpackCodec())
+
+    rows = []
+    for frame_type, message in sample_frames().items():
+        for codec in codecs:
+            encoded = codec.encode(message)
+            rows.append({
+                "frame": frame_type,
+                "codec": codec.implementation,
+                "bytes": len(encoded if codec.binary else encoded.encode()),
+                "encode_k_per_s": round(ops_per_second(codec.encode, message, args.seconds) / 1000, 1),
+                "decode_k_per_s": round(ops_per_second(codec.decode, encoded, args.seconds) / 1000, 1)
+            })
+    print_table("Wire codecs", rows)
+
+    # Dispatch of already decoded messages: table lookup vs the old if/elif chain
+    async def noop(conn, message):
+        pass
+
+    dispatcher = MessageDispatcher()
+    for message_type in ("offer", "answer", "ice-candidate", "join", "join_voice", "leave_voice", "typing"):
+        dispatcher.on(message_type)(noop)
+
+    async def chain(conn, message):
+        message_type = message.get("type")
+        if message_type in ["offer", "answer", "ice-candidate"]:
+            await noop(conn, message)
+        elif message_type == "join":
+            await noop(conn, message)
+        elif message_type == "join_voice":
+            await noop(conn, message)
+        elif message_type == "leave_voice":
+            await noop(conn, message)
+        elif message_type == "typing":
+            await noop(conn, message)
+
+    messages = [{"type": message_type} for message_type in ("ice-candidate", "typing", "join_voice", "offer")]
+    iterations = 200000
+
+    async def run(dispatch):
+        started = time.perf_counter()
+        for i in range(iterations):
+            await dispatch(None, messages[i & 3])
+        return (time.perf_counter() - started) / iterations * 1e9
+
+    dispatch_rows = [
+        {"dispatch": "if/elif", "ns_per_message": round(asyncio.run(run(chain)))},
+        {"dispatch": "table", "ns_per_message": round(asyncio.run(run(dispatcher.dispatch)))},
+    ]
+    print_table(f"Message dispatch ({iterations} messages)", dispatch_rows)
+    return rows + dispatch_rows
+
+# ---------------------------------------------------------------------------
+# Metrics: cost of the instrumentation on the broadcast hot path
+# ---------------------------------------------------------------------------
+
+class NullOutbound:
+    def put(self, frame, droppable=False, key=None):
+        pass
+
+class NullTimer:
+    def observe(self, value):
+        pass
+
+def bench_metrics(args):
+    # server.py reads its Mongo settings at import; the client only connects on first use
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "bench")
+    os.environ["REPLAY_LOG_SIZE"] = "0"
+    import logging
+    logging.disable(logging.INFO)
+    import server
+    from registry import Connection
+
+    histogram = server.metrics.histogram("bench_observe_seconds", "benchmark only").labels()
+    observe_ns = 1e9 / ops_per_second(histogram.observe, 0.0007, args.seconds)
+
+    async def broadcasts_per_second(room_id):
+        message = {"type": "user_voice_update", "user_id": "user-0", "username": "User 0", "is_in_voice": True}
+        count = 0
+        started = time.perf_counter()
+        deadline = started + args.seconds
+        while True:
+            for _ in range(100):
+                await server.manager.broadcast_to_room(room_id, message)
+            count += 100
+            now = time.perf_counter()
+            if now >= deadline:
+                return count / (now - started)
+
+    instrumented = (server.broadcast_duration, server.broadcast_recipients)
+    rows = []
+    for members in args.members:
+        room_id = f"bench-{members}"
+        for i in range(members):
+            conn = Connection(object(), room_id, f"user-{i}", f"User {i}", NullOutbound())
+            conn.codec = server.wire_codecs.text
+            server.manager.registry.add(conn)
+        # Alternate the variants and keep the best round of each; single runs are noisier than the overhead
+        bare = measured = 0.0
+        for _ in range(args.rounds):
+            server.broadcast_duration, server.broadcast_recipients = NullTimer(), NullTimer()
+            bare = max(bare, asyncio.run(broadcasts_per_second(room_id)))
+            server.broadcast_duration, server.broadcast_recipients = instrumented
+            measured = max(measured, asyncio.run(broadcasts_per_second(room_id)))
+        rows.append({
+            "members": members,
+            "bare_us": round(1e6 / bare, 2),
+            "instrumented_us": round(1e6 / measured, 2),
+            "overhead_us": round(1e6 / measured - 1e6 / bare, 2),
+            "overhead_pct": round((1e6 / measured - 1e6 / bare) / (1e6 / bare) * 100, 1)
+        })
+    print(f"\n📊 Histogram observe: {observe_ns:.0f}ns per sample")
+    print_table(f"broadcast_to_room, per call (best of {args.rounds} x {args.seconds}s)", rows)
+
+    started = time.perf_counter()
+    text = server.metrics.render()
+    render_ms = (time.perf_counter() - started) * 1000
+    print(f"\n📊 /metrics render: {render_ms:.2f}ms for {len(text.splitlines())} lines")
+    return rows
+
+BENCHMARKS = {
+    "upload": bench_upload,
+    "static": bench_static,
+    "typing": bench_typing,
+    "codec": bench_codec,
+    "metrics": bench_metrics,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    upload = subparsers.add_parser("upload", help="peak RSS of concurrent uploads")
+    upload.add_argument("--concurrency", type=int, default=8)
+    upload.add_argument("--size-mb", type=int, default=20)
+    upload.add_argument("--variant", choices=["legacy", "stream"], help=argparse.SUPPRESS)
+
+    static = subparsers.add_parser("static", help="requests/sec and CPU per MB of /uploads serving")
+    static.add_argument("--files", type=int, default=50)
+    static.add_argument("--size-kb", type=int, default=512)
+    static.add_argument("--requests", type=int, default=2000)
+    static.add_argument("--concurrency", type=int, default=32)
+
+    typing = subparsers.add_parser("typing", help="frames/sec of typing indicators in simulated rooms")
+    typing.add_argument("--rooms", type=int, default=100)
+    typing.add_argument("--members", type=int, default=20)
+    typing.add_argument("--typists", type=int, default=3)
+    typing.add_argument("--keystroke-ms", type=float, default=150)
+    typing.add_argument("--seconds", type=float, default=10)
+    typing.add_argument("--interval-ms", type=float, default=250)
+    typing.add_argument("--ttl", type=float, default=5)
+    typing.add_argument("--min-interval-ms", type=float, default=1000)
+
+    codec = subparsers.add_parser("codec", help="encode/decode/dispatch cost of wire codecs")
+    codec.add_argument("--seconds", type=float, default=0.5, help="time per measurement")
+
+    metrics = subparsers.add_parser("metrics", help="overhead of metrics instrumentation on broadcasts")
+    metrics.add_argument("--members", type=int, nargs="+", default=[1, 10, 100])
+    metrics.add_argument("--seconds", type=float, default=0.5, help="time per measurement")
+    metrics.add_argument("--rounds", type=int, default=5)
+
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,626 @@
+#!/usr/bin/env python3
+"""
+Load Test Suite for Discord-like Voice Chat Backend
+Starts backend/server.py under uvicorn against the Mongo given by --mongo-url (or
+$MONGO_URL) and drives thousands of simulated WebSocket clients spread over rooms of configurable sizes.
+Clients join, chat, type, toggle voice and exchange offer/answer/ICE bursts; the
+suite reports end-to-end fan-out latency percentiles, frames/sec, and server CPU
+and RSS per 1k connections, and saves everything as JSON for later comparison.
+
+Usage: python backend_load_test.py --mongo-url mongodb://localhost:27017 [--clients 2000] [--duration 60]
+       python backend_load_test.py --server-url http://localhost:8001   # an already running server
+       python backend_load_test.py --local-mongod                       # a throwaway mongod (unverified)
+       python backend_load_test.py --baseline load-results-old.json       # compare with an earlier run
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import urlencode
+from pathlib import Path
+
+import httpx
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parent / "backend"
+
+# Latency samples kept per kind and client process (reservoir sampled beyond this)
+MAX_SAMPLES = 200000
+
+# Realistically sized SDP so offers and answers cost what real ones do
+FAKE_SDP = "v=0\r\no=- 4611731400430051336 2 IN IP4 127.0.0.1\r\ns=-\r\nt=0 0\r\n" + (
+    "a=rtpmap:111 opus/48000/2\r\na=fmtp:111 minptime=10;useinbandfec=1\r\n" * 24)
+
+def print_table(title, rows):
+    print(f"\n📊 {title}")
+    if not rows:
+        return
+    headers = list(rows[0].keys())
+    widths = [max(len(str(h)), *(len(str(row[h])) for row in rows)) for h in headers]
+    print("  " + "  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  " + "  ".join(str(row[h]).ljust(w) for h, w in zip(headers, widths)))
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+def parse_weights(spec, cast=str):
+    # "2:40,5:30" or "chat=30,typing=40" -> [(key, weight), ...]
+    pairs = []
+    for item in spec.split(","):
+        key, _, weight = item.replace("=", ":").partition(":")
+        pairs.append((cast(key.strip()), float(weight or 1)))
+    return pairs
+
+# ---------------------------------------------------------------------------
+# Client side: runs in worker processes, one asyncio loop each
+# ---------------------------------------------------------------------------
+
+class LoadStats:
+    def __init__(self, measure_from, deadline):
+        # Frames and latencies count between the end of the ramp and the deadline
+        self.measure_from = measure_from
+        self.deadline = deadline
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.frames_out = 0
+        self.by_type = {}
+        self.errors = {}
+        self.latency = {}  # kind -> samples in ms
+        self._seen = {}  # kind -> samples offered, for reservoir sampling
+        self.rng = random.Random()
+        self.cpu_seconds = None
+
+    def measuring(self, now):
+        return self.measure_from <= now < self.deadline
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def observe(self, kind, sent_at, now=None, always=False):
+        now = time.time() if now is None else now
+        if not always and not self.measuring(now):
+            return
+        samples = self.latency.setdefault(kind, [])
+        seen = self._seen[kind] = self._seen.get(kind, 0) + 1
+        value = (now - sent_at) * 1000
+        if len(samples) < MAX_SAMPLES:
+            samples.append(value)
+        else:
+            slot = self.rng.randrange(seen)
+            if slot < MAX_SAMPLES:
+                samples[slot] = value
+
+    def to_dict(self):
+        return {"frames_in": self.frames_in, "bytes_in": self.bytes_in, "frames_out": self.frames_out,
+                "by_type": self.by_type, "errors": self.errors, "latency": self.latency,
+                "cpu_seconds": self.cpu_seconds}
+
+class SimClient:
+    def __init__(self, spec, stats, http, room_id, index, size, rng):
+        self.spec = spec
+        self.stats = stats
+        self.http = http
+        self.room_id = room_id
+        self.user_id = f"{room_id}-u{index}"
+        self.username = f"Load {index}"
+        self.peers = [f"{room_id}-u{i}" for i in range(size) if i != index]
+        self.rng = rng
+        self.ws = None
+        self.joined = asyncio.Event()
+        self.in_voice = False
+
+    async def send(self, message):
+        await self.ws.send(json.dumps(message))
+        if self.stats.measuring(time.time()):
+            self.stats.frames_out += 1
+
+    async def run(self, start_at, deadline):
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+        query = urlencode({"user_id": self.user_id, "username": self.username,
+                           "ice_batch": "true" if self.spec["ice_batch"] else "false"})
+        url = f"{self.spec['ws_url']}/api/ws/{self.room_id}?{query}"
+        started = time.time()
+        try:
+            self.ws = await websockets.connect(url, max_size=None, open_timeout=30, close_timeout=1)
+        except Exception as e:
+            self.stats.error(f"connect:{type(e).__name__}")
+            return
+        reader = asyncio.create_task(self.read())
+        try:
+            await self.send({"type": "join", "room_id": self.room_id})
+            await asyncio.wait_for(self.joined.wait(), 30)
+            self.stats.observe("join", started, always=True)
+            await self.act(deadline)
+        except asyncio.TimeoutError:
+            self.stats.error("join_timeout")
+        except websockets.ConnectionClosed:
+            self.stats.error("closed_by_server")
+        finally:
+            reader.cancel()
+            await self.ws.close()
+
+    async def read(self):
+        try:
+            async for frame in self.ws:
+                now = time.time()
+                message = json.loads(frame)
+                message_type = message.get("type")
+                if self.stats.measuring(now):
+                    self.stats.frames_in += 1
+                    self.stats.bytes_in += len(frame)
+                    self.stats.by_type[message_type] = self.stats.by_type.get(message_type, 0) + 1
+                if message_type == "ping":
+                    await self.send({"type": "pong", "id": message.get("id")})
+                elif message_type in ("room_info", "room_delta"):
+                    self.joined.set()
+                elif message_type == "new_message":
+                    text = message["message"].get("message") or ""
+                    if text.startswith("load ") and message["message"].get("user_id") != self.user_id:
+                        self.stats.observe("chat", float(text[5:]), now)
+                elif message_type in ("offer", "answer"):
+                    self.stats.observe("signaling", message.get("sent_at", now), now)
+                    if message_type == "offer":
+                        await self.answer(message["from_user_id"])
+                elif message_type in ("ice-candidate", "ice-candidates"):
+                    candidates = message.get("candidates") or [message.get("candidate")]
+                    for candidate in candidates:
+                        # The end-of-candidates marker carries no timestamp
+                        if candidate and "sent_at" in candidate:
+                            self.stats.observe("ice", candidate["sent_at"], now)
+                elif message_type == "rate_limited":
+                    self.stats.error(f"rate_limited:{message.get('message_type')}")
+        except websockets.ConnectionClosed:
+            pass
+
+    async def act(self, deadline):
+        actions = self.spec["mix"]
+        names = [name for name, _ in actions]
+        weights = [weight for _, weight in actions]
+        think = self.spec["think_ms"] / 1000
+        while True:
+            await asyncio.sleep(self.rng.expovariate(1 / think))
+            if time.time() >= deadline:
+                return
+            action = self.rng.choices(names, weights)[0]
+            if action == "chat":
+                await self.chat()
+            elif action == "typing":
+                await self.type_burst()
+            elif action == "voice":
+                self.in_voice = not self.in_voice
+                await self.send({"type": "join_voice" if self.in_voice else "leave_voice"})
+            elif action == "call" and self.peers:
+                await self.call(self.rng.choice(self.peers))
+
+    async def chat(self):
+        try:
+            response = await self.http.post(f"/api/rooms/{self.room_id}/messages", json={
+                "user_id": self.user_id, "username": self.username, "message": f"load {time.time():.6f}"
+            })
+            if response.status_code != 200:
+                self.stats.error(f"chat_http_{response.status_code}")
+        except httpx.HTTPError:
+            self.stats.error("chat_http")
+
+    async def type_burst(self):
+        # A few "still typing" events while composing, then a stop
+        for _ in range(self.rng.randint(2, 6)):
+            await self.send({"type": "typing", "is_typing": True})
+            await asyncio.sleep(0.15)
+        await self.send({"type": "typing", "is_typing": False})
+
+    async def ice_burst(self, target_user_id):
+        # Trickled candidates arrive back to back, ending with the end-of-candidates marker
+        for i in range(self.spec["ice_burst"]):
+            await self.send({"type": "ice-candidate", "target_user_id": target_user_id, "candidate": {
+                "candidate": f"candidate:{i} 1 udp 2122260223 10.0.0.{i % 250} {50000 + i} typ host",
+                "sdpMid": "0", "sdpMLineIndex": 0, "sent_at": time.time()
+            }})
+        await self.send({"type": "ice-candidate", "target_user_id": target_user_id,
+                         "candidate": {"candidate": "", "sdpMid": "0", "sdpMLineIndex": 0}})
+
+    async def call(self, target_user_id):
+        await self.send({"type": "offer", "target_user_id": target_user_id, "sent_at": time.time(),
+                         "offer": {"type": "offer", "sdp": FAKE_SDP}})
+        await self.ice_burst(target_user_id)
+
+    async def answer(self, target_user_id):
+        await self.send({"type": "answer", "target_user_id": target_user_id, "sent_at": time.time(),
+                         "answer": {"type": "answer", "sdp": FAKE_SDP}})
+        await self.ice_burst(target_user_id)
+
+def process_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+async def measure_cpu(stats):
+    # CPU of this client process over the measured window; a saturated
+    # load generator inflates every latency it reports
+    await asyncio.sleep(max(0.0, stats.measure_from - time.time()))
+    started = process_cpu_seconds()
+    await asyncio.sleep(max(0.0, stats.deadline - time.time()))
+    stats.cpu_seconds = process_cpu_seconds() - started
+
+async def run_clients(spec):
+    rng = random.Random(spec["seed"])
+    measure_from = spec["start_at"] + spec["ramp"]
+    deadline = measure_from + spec["duration"]
+    stats = LoadStats(measure_from, deadline)
+    total = sum(size for _, size in spec["rooms"])
+    limits = httpx.Limits(max_connections=spec["http_connections"], max_keepalive_connections=spec["http_connections"])
+    async with httpx.AsyncClient(base_url=spec["base_url"], limits=limits, timeout=30) as http:
+        clients = []
+        # Interleave rooms so every room fills up gradually during the ramp
+        for index in range(max(size for _, size in spec["rooms"])):
+            for room_id, size in spec["rooms"]:
+                if index < size:
+                    clients.append(SimClient(spec, stats, http, room_id, index, size, random.Random(rng.random())))
+        await asyncio.gather(measure_cpu(stats), *(
+            client.run(spec["start_at"] + spec["ramp"] * i / total, deadline)
+            for i, client in enumerate(clients)
+        ))
+    return stats.to_dict()
+
+def run_worker():
+    # Child process: the spec arrives on stdin, the result leaves as the last stdout line
+    spec = json.loads(sys.stdin.read())
+    raise_fd_limit()
+    print(json.dumps(asyncio.run(run_clients(spec))))
+
+# ---------------------------------------------------------------------------
+# Orchestration: mongod, uvicorn, room setup, client processes, reporting
+# ---------------------------------------------------------------------------
+
+def raise_fd_limit():
+    # Every client connection is a socket on both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"{process.args[0]} exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"Nothing listening on port {port} after {timeout}s")
+
+def start_mongod(workdir):
+    binary = shutil.which("mongod")
+    if binary is None:
+        raise SystemExit("mongod not found on PATH; install MongoDB or pass --mongo-url / --server-url")
+    port = free_port()
+    dbpath = workdir / "mongo"
+    dbpath.mkdir()
+    process = subprocess.Popen([binary, "--dbpath", str(dbpath), "--port", str(port), "--bind_ip", "127.0.0.1"],
+                               stdout=open(workdir / "mongod.log", "w"), stderr=subprocess.STDOUT)
+    wait_for_port(port, process)
+    return process, f"mongodb://127.0.0.1:{port}"
+
+def start_server(workdir, mongo_url, db_name, extra_env):
+    port = free_port()
+    env = dict(os.environ, MONGO_URL=mongo_url, DB_NAME=db_name, CORS_ORIGINS="*", **extra_env)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--ws-max-size", str(16 * 1024 * 1024),
+         "--ws-per-message-deflate", "false"],
+        cwd=BACKEND_DIR, env=env, stdout=open(workdir / "server.log", "w"), stderr=subprocess.STDOUT
+    )
+    wait_for_port(port, process)
+    return process, f"http://127.0.0.1:{port}"
+
+class ProcessSampler:
+    """CPU time and RSS of the server process, read from /proc (Linux)."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.peak_rss_mb = 0.0
+
+    def cpu_seconds(self):
+        if self.pid is None:
+            return None
+        with open(f"/proc/{self.pid}/stat") as f:
+            # Fields after the parenthesised command name; utime and stime are 14 and 15
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def rss_mb(self):
+        if self.pid is None:
+            return None
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) / 1024
+                    self.peak_rss_mb = max(self.peak_rss_mb, rss)
+                    return rss
+        return None
+
+def plan_rooms(clients, room_sizes, seed):
+    rng = random.Random(seed)
+    sizes = [size for size, _ in room_sizes]
+    weights = [weight for _, weight in room_sizes]
+    rooms = []
+    assigned = 0
+    while assigned < clients:
+        size = min(rng.choices(sizes, weights)[0], clients - assigned)
+        rooms.append((f"load-{len(rooms)}-{uuid.uuid4().hex[:6]}", size))
+        assigned += size
+    return rooms
+
+def split_rooms(rooms, processes):
+    # Whole rooms per process, so a sender and its receivers share a clock and a
+    # process; largest rooms first onto the least loaded process
+    shares = [[] for _ in range(processes)]
+    loads = [0] * processes
+    for room in sorted(rooms, key=lambda room: -room[1]):
+        target = loads.index(min(loads))
+        shares[target].append(room)
+        loads[target] += room[1]
+    return [share for share in shares if share]
+
+async def create_rooms(base_url, rooms):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as http:
+        slots = asyncio.Semaphore(32)
+
+        async def create(room_id):
+            async with slots:
+                response = await http.post("/api/rooms", json={"id": room_id, "name": room_id})
+                response.raise_for_status()
+
+        await asyncio.gather(*(create(room_id) for room_id, _ in rooms))
+
+async def run_client_processes(specs, sampler, measure_from, deadline):
+    processes = []
+    for spec in specs:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, __file__, "--worker",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+        )
+        process.stdin.write(json.dumps(spec).encode())
+        process.stdin.close()
+        processes.append(process)
+
+    async def sample():
+        # Server CPU over the steady-state window only, RSS once everyone is connected
+        await asyncio.sleep(max(0.0, measure_from - time.time()))
+        window = {"cpu_start": sampler.cpu_seconds(), "rss_loaded_mb": sampler.rss_mb(), "started": time.time()}
+        while time.time() < deadline:
+            sampler.rss_mb()
+            await asyncio.sleep(min(1.0, max(0.0, deadline - time.time())))
+        window["cpu_end"] = sampler.cpu_seconds()
+        window["ended"] = time.time()
+        return window
+
+    sampling = asyncio.create_task(sample())
+    outputs = await asyncio.gather(*(process.stdout.read() for process in processes))
+    for process in processes:
+        if await process.wait() != 0:
+            raise SystemExit(f"Client process exited with code {process.returncode}")
+    window = await sampling
+    return [json.loads(output.decode().strip().splitlines()[-1]) for output in outputs], window
+
+def merge_results(results):
+    merged = {"frames_in": 0, "bytes_in": 0, "frames_out": 0, "by_type": {}, "errors": {}, "latency": {}}
+    for result in results:
+        for key in ("frames_in", "bytes_in", "frames_out"):
+            merged[key] += result[key]
+        for key in ("by_type", "errors"):
+            for name, count in result[key].items():
+                merged[key][name] = merged[key].get(name, 0) + count
+        for kind, samples in result["latency"].items():
+            merged["latency"].setdefault(kind, []).extend(samples)
+    return merged
+
+def summarize_latency(latency):
+    summary = {}
+    for kind, samples in sorted(latency.items()):
+        ordered = sorted(samples)
+        summary[kind] = {
+            "samples": len(ordered),
+            "p50_ms": round(percentile(ordered, 0.50), 2),
+            "p95_ms": round(percentile(ordered, 0.95), 2),
+            "p99_ms": round(percentile(ordered, 0.99), 2),
+            "max_ms": round(ordered[-1], 2)
+        }
+    return summary
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    rows = []
+
+    def row(metric, old, new):
+        change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else "-"
+        rows.append({"metric": metric, "baseline": old, "current": new, "change": change})
+
+    for kind, current in results["latency"].items():
+        previous = baseline.get("latency", {}).get(kind, {})
+        for quantile in ("p50_ms", "p95_ms", "p99_ms"):
+            row(f"{kind} {quantile}", previous.get(quantile), current[quantile])
+    for key in ("frames_in_per_s", "frames_out_per_s"):
+        row(key, baseline.get("throughput", {}).get(key), results["throughput"][key])
+    for key in ("cpu_cores", "cpu_cores_per_1k", "rss_per_1k_mb"):
+        row(f"server {key}", baseline.get("server", {}).get(key), results["server"][key])
+    print_table(f"Compared with {baseline.get('started_at')} ({baseline.get('revision')})", rows)
+
+def run_load_test(args):
+    raise_fd_limit()
+    room_sizes = parse_weights(args.room_sizes, int)
+    rooms = plan_rooms(args.clients, room_sizes, args.seed)
+    workdir = Path(tempfile.mkdtemp(prefix="load-test-"))
+    mongod = server = None
+    try:
+        if args.server_url:
+            base_url, server_pid = args.server_url.rstrip("/"), args.server_pid
+        else:
+            mongo_url = args.mongo_url
+            if args.local_mongod:
+                mongod, mongo_url = start_mongod(workdir)
+            extra_env = dict(item.split("=", 1) for item in args.server_env)
+            server, base_url = start_server(workdir, mongo_url, f"load_test_{uuid.uuid4().hex[:8]}", extra_env)
+            server_pid = server.pid
+        print(f"Load testing {base_url}: {args.clients} clients in {len(rooms)} rooms, {args.processes} client processes")
+
+        asyncio.run(create_rooms(base_url, rooms))
+        sampler = ProcessSampler(server_pid)
+        rss_idle = sampler.rss_mb()
+
+        start_at = time.time() + 2  # time for the client processes to start up
+        measure_from = start_at + args.ramp
+        deadline = measure_from + args.duration
+        base_spec = {
+            "base_url": base_url,
+            "ws_url": base_url.replace("http://", "ws://").replace("https://", "wss://"),
+            "start_at": start_at, "ramp": args.ramp, "duration": args.duration,
+            "think_ms": args.think_ms, "mix": parse_weights(args.mix), "ice_burst": args.ice_burst,
+            "ice_batch": args.ice_batch, "http_connections": args.http_connections
+        }
+        specs = [dict(base_spec, rooms=share, seed=args.seed * 1000 + i)
+                 for i, share in enumerate(split_rooms(rooms, args.processes))]
+        worker_results, window = asyncio.run(run_client_processes(specs, sampler, measure_from, deadline))
+        stats = httpx.get(f"{base_url}/api/stats", timeout=30).json()
+    finally:
+        for process in (server, mongod):
+            if process is not None:
+                process.terminate()
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        if args.keep_logs:
+            print(f"Logs kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    merged = merge_results(worker_results)
+    elapsed = window["ended"] - window["started"]
+    active = args.duration
+    connected = stats.get("connections", {}).get("total", 0) or args.clients
+    cpu_cores = ((window["cpu_end"] - window["cpu_start"]) / elapsed) if window["cpu_start"] is not None else None
+    results = {
+        "started_at": datetime.fromtimestamp(start_at).isoformat(),
+        "revision": git_revision(),
+        "config": {
+            "clients": args.clients, "rooms": len(rooms), "room_sizes": args.room_sizes, "mix": args.mix,
+            "think_ms": args.think_ms, "ice_burst": args.ice_burst, "ice_batch": args.ice_batch,
+            "ramp": args.ramp, "duration": args.duration, "processes": args.processes, "seed": args.seed,
+            "server_env": args.server_env
+        },
+        "latency": summarize_latency(merged["latency"]),
+        "throughput": {
+            "frames_in": merged["frames_in"],
+            "frames_out": merged["frames_out"],
+            "frames_in_per_s": round(merged["frames_in"] / active),
+            "frames_out_per_s": round(merged["frames_out"] / active),
+            "mb_in_per_s": round(merged["bytes_in"] / active / (1024 * 1024), 2),
+            "by_type": merged["by_type"]
+        },
+        "clients": {
+            "processes": len(worker_results),
+            "max_cpu_cores": round(max(result["cpu_seconds"] or 0.0 for result in worker_results) / args.duration, 3)
+        },
+        "server": {
+            "connections": connected,
+            "cpu_cores": round(cpu_cores, 3) if cpu_cores is not None else None,
+            "cpu_cores_per_1k": round(cpu_cores / connected * 1000, 3) if cpu_cores is not None else None,
+            "rss_idle_mb": round(rss_idle, 1) if rss_idle is not None else None,
+            "rss_loaded_mb": round(window["rss_loaded_mb"], 1) if window["rss_loaded_mb"] is not None else None,
+            "rss_peak_mb": round(sampler.peak_rss_mb, 1) if server_pid else None,
+            "rss_per_1k_mb": (round((window["rss_loaded_mb"] - rss_idle) / connected * 1000, 2)
+                              if rss_idle is not None else None)
+        },
+        "errors": merged["errors"],
+        "server_stats": stats
+    }
+
+    print_table("End-to-end latency (steady state; join over the ramp)",
+                [dict(kind=kind, **summary) for kind, summary in results["latency"].items()])
+    print_table("Throughput and server cost", [{
+        "frames_in_per_s": results["throughput"]["frames_in_per_s"],
+        "frames_out_per_s": results["throughput"]["frames_out_per_s"],
+        "connections": connected,
+        "cpu_cores": results["server"]["cpu_cores"],
+        "cpu_per_1k": results["server"]["cpu_cores_per_1k"],
+        "rss_per_1k_mb": results["server"]["rss_per_1k_mb"]
+    }])
+    if results["clients"]["max_cpu_cores"] > 0.8:
+        print(f"\n⚠️  A client process used {results['clients']['max_cpu_cores']:.0%} of a core; "
+              f"latencies are inflated, rerun with more --processes")
+    if merged["errors"]:
+        print_table("Errors", [{"error": name, "count": count} for name, count in sorted(merged["errors"].items())])
+
+    output = Path(args.output or f"load-results-{datetime.now():%Y%m%d-%H%M%S}.json")
+    output.write_text(json.dumps(results, indent=2, default=str))
+    print(f"\nResults saved to {output}")
+    if args.baseline:
+        compare(results, json.loads(Path(args.baseline).read_text()))
+    return results
+
+def main():
+    if sys.argv[1:] == ["--worker"]:
+        run_worker()
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--room-sizes", default="2:40,5:30,20:20,100:10",
+                        help="room size:weight pairs; rooms are drawn from this distribution")
+    parser.add_argument("--mix", default="chat:15,typing:35,voice:10,call:40",
+                        help="relative weights of client actions: chat, typing, voice, call")
+    parser.add_argument("--think-ms", type=float, default=3000, help="mean pause between actions of one client")
+    parser.add_argument("--ice-burst", type=int, default=8, help="ICE candidates sent after each offer/answer")
+    parser.add_argument("--ice-batch", action="store_true", help="connect with ?ice_batch=true")
+    parser.add_argument("--ramp", type=float, default=20, help="seconds over which clients connect")
+    parser.add_argument("--duration", type=float, default=60, help="steady-state seconds measured after the ramp")
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="client processes; the clients must not be the bottleneck")
+    parser.add_argument("--http-connections", type=int, default=50, help="HTTP connections per client process")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL"),
+                        help="Mongo the started server uses (default $MONGO_URL); its database is left behind")
+    parser.add_argument("--local-mongod", action="store_true",
+                        help="start a throwaway mongod from PATH instead; this mode has not been run yet")
+    parser.add_argument("--server-url", help="test an already running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="pid of --server-url's process, for CPU and RSS figures")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the started server, e.g. WIRE_JSON=orjson")
+    parser.add_argument("--output", help="results file (default load-results-<timestamp>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare with")
+    parser.add_argument("--keep-logs", action="store_true", help="keep the mongod and server logs")
+    args = parser.parse_args()
+    if not (args.server_url or args.mongo_url or args.local_mongod):
+        parser.error("pass --mongo-url (or set MONGO_URL), --server-url or --local-mongod")
+    run_load_test(args)
+
+if __name__ == "__main__":
+    main()
@@ -301,6 +301,11 @@ function App() {
 
       ws.onmessage = async (event) => {
         const message = JSON.parse(event.data);
+        if (message.type === 'ping') {
+          // Application-level heartbeat: answer right away so the server can measure RTT
+          ws.send(JSON.stringify({ type: 'pong', id: message.id }));
+          return;
+        }
         console.log('WebSocket message:', message.type);
         
         await handleWebSocketMessage(message, ws);
@@ -430,6 +435,10 @@ function App() {
           setPendingIceCandidates(prev => [...prev, message.candidate]);
         }
         break;
+
+      case 'rate_limited':
+        console.warn(`Server dropped ${message.message_type} messages, retry after ${message.retry_after_ms}ms`);
+        break;
     }
   };
 
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# server.py runs from backend/ and imports its sibling modules directly
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
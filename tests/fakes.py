@@ -0,0 +1,129 @@
+import asyncio
+import copy
+from datetime import datetime
+
+def bson_datetime(value):
+    # BSON datetimes keep milliseconds; Mongo hands back truncated copies
+    if isinstance(value, datetime):
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+def matches(document: dict, query: dict) -> bool:
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+            continue
+        value = document.get(field)
+        if isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator == "$lt" and not (value is not None and value < operand):
+                    return False
+                if operator == "$gt" and not (value is not None and value > operand):
+                    return False
+                if operator == "$in" and value not in operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, keys, direction=None):
+        if isinstance(keys, str):
+            keys = [(keys, direction)]
+        for field, order in reversed(keys):
+            self.documents.sort(key=lambda document: document.get(field), reverse=order < 0)
+        return self
+
+    def limit(self, count):
+        if count:
+            self.documents = self.documents[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self.documents[:length] if length else list(self.documents)
+
+class FakeCollection:
+    """Just enough of a Motor collection for the write paths and queries under test."""
+
+    def __init__(self):
+        self.documents = []
+        self.calls = []  # (method, size) of every write
+        self.stalled = False  # writes wait while set, like a Mongo that stopped answering
+
+    def find(self, query=None, projection=None):
+        documents = [copy.deepcopy(document) for document in self.documents if matches(document, query or {})]
+        projection = dict(projection or {})
+        hide_id = projection.pop("_id", 1) == 0
+        for document in documents:
+            if hide_id:
+                document.pop("_id", None)
+            if projection:
+                for field in list(document):
+                    if field not in projection:
+                        del document[field]
+        return FakeCursor(documents)
+
+    async def find_one(self, query):
+        for document in self.documents:
+            if matches(document, query):
+                return copy.deepcopy(document)
+        return None
+
+    async def count_documents(self, query, limit=0):
+        count = sum(1 for document in self.documents if matches(document, query))
+        return min(count, limit) if limit else count
+
+    async def distinct(self, field, query=None):
+        values = []
+        for document in self.documents:
+            if matches(document, query or {}) and field in document and document[field] not in values:
+                values.append(document[field])
+        return values
+
+    async def insert_many(self, documents, ordered=True):
+        while self.stalled:
+            await asyncio.sleep(0.005)
+        self.calls.append(("insert_many", len(documents)))
+        for document in documents:
+            document.setdefault("_id", len(self.documents))
+            self.documents.append({field: bson_datetime(value) for field, value in copy.deepcopy(document).items()})
+
+    async def update_one(self, query, update, upsert=False):
+        self.calls.append(("update_one", 1))
+        self._update(query, update, upsert)
+
+    async def bulk_write(self, operations, ordered=True):
+        self.calls.append(("bulk_write", len(operations)))
+        for operation in operations:
+            self._update(operation._filter, operation._doc, operation._upsert)
+
+    def _update(self, query, update, upsert):
+        for document in self.documents:
+            if matches(document, query):
+                document.update(update.get("$set", {}))
+                for field, amount in update.get("$inc", {}).items():
+                    document[field] = document.get(field, 0) + amount
+                return
+        if upsert:
+            document = dict(query, **update.get("$set", {}), **update.get("$setOnInsert", {}))
+            document.update(update.get("$inc", {}))
+            self.documents.append(document)
+
+    async def create_index(self, keys, **options):
+        self.calls.append(("create_index", 1))
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.collections.setdefault(name, FakeCollection())
+
+    async def command(self, *args):
+        return {"ok": 1}
@@ -0,0 +1,83 @@
+import asyncio
+import unittest
+
+from cache import AsyncTTLCache
+
+class SlowLoader:
+    def __init__(self, values=None):
+        self.values = values or {}
+        self.calls = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, key):
+        self.calls.append(key)
+        await self.release.wait()
+        return self.values.get(key)
+
+class AsyncTTLCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_misses_share_one_load(self):
+        loader = SlowLoader({"room": {"id": "room"}})
+        cache = AsyncTTLCache(loader)
+        readers = [asyncio.create_task(cache.get("room")) for _ in range(5)]
+        await asyncio.sleep(0)
+        loader.release.set()
+        results = await asyncio.gather(*readers)
+        self.assertEqual(loader.calls, ["room"])
+        self.assertEqual(results, [{"id": "room"}] * 5)
+        self.assertEqual((cache.stats["misses"], cache.stats["coalesced"]), (1, 4))
+        self.assertEqual(await cache.get("room"), {"id": "room"})
+        self.assertEqual(cache.stats["hits"], 1)
+
+    async def test_failed_load_reaches_every_waiter_and_is_not_cached(self):
+        calls = []
+
+        async def broken(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("mongo down")
+
+        cache = AsyncTTLCache(broken)
+        results = await asyncio.gather(cache.get("room"), cache.get("room"), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        with self.assertRaises(RuntimeError):
+            await cache.get("room")
+        self.assertEqual(len(calls), 2)
+
+    async def test_not_found_uses_negative_ttl(self):
+        loader = SlowLoader()
+        loader.release.set()
+        cache = AsyncTTLCache(loader, ttl=60, negative_ttl=0.02)
+        self.assertIsNone(await cache.get("missing"))
+        self.assertIsNone(await cache.get("missing"))
+        self.assertEqual(len(loader.calls), 1)
+        await asyncio.sleep(0.05)
+        await cache.get("missing")
+        self.assertEqual(len(loader.calls), 2)
+
+    async def test_invalidate_during_load_skips_the_stale_result(self):
+        loader = SlowLoader({"room": "old"})
+        cache = AsyncTTLCache(loader)
+        reader = asyncio.create_task(cache.get("room"))
+        await asyncio.sleep(0)
+        cache.invalidate("room")
+        loader.release.set()
+        self.assertEqual(await reader, "old")
+        loader.values["room"] = "new"
+        self.assertEqual(await cache.get("room"), "new")
+        self.assertEqual(len(loader.calls), 2)
+
+    async def test_least_recently_used_entry_is_evicted(self):
+        loader = SlowLoader({key: key for key in "abc"})
+        loader.release.set()
+        cache = AsyncTTLCache(loader, max_entries=2)
+        await cache.get("a")
+        await cache.get("b")
+        await cache.get("a")
+        await cache.get("c")
+        self.assertEqual(cache.stats["evictions"], 1)
+        await cache.get("a")
+        await cache.get("b")
+        self.assertEqual(loader.calls, ["a", "b", "c", "b"])
+
+if __name__ == "__main__":
+    unittest.main()
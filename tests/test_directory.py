@@ -0,0 +1,82 @@
+import asyncio
+import unittest
+
+from directory import InvalidCursor, RoomDirectory
+from .fakes import FakeCollection
+
+def rooms(*names):
+    return [{"id": name.lower(), "name": name, "created_at": f"2026-01-0{n + 1}"} for n, name in enumerate(names)]
+
+class RoomDirectoryTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = RoomDirectory()
+        for room in rooms("Alpha", "Bravo", "Charlie", "Delta"):
+            self.directory.add(room)
+
+    def test_etag_changes_when_a_user_joins_or_leaves(self):
+        etag = self.directory.etag
+        self.directory.update_counts("bravo", 1, 0)
+        joined = self.directory.etag
+        self.assertNotEqual(joined, etag)
+        # Same counts again: nothing changed for clients
+        self.directory.update_counts("bravo", 1, 0)
+        self.assertEqual(self.directory.etag, joined)
+        self.directory.update_counts("bravo", 0, 0)
+        self.assertNotIn(self.directory.etag, (etag, joined))
+        self.assertNotIn("bravo", self.directory.counts)
+
+    def test_etag_ignores_rooms_without_a_document(self):
+        etag = self.directory.etag
+        self.directory.update_counts("unknown", 3, 1)
+        self.assertEqual(self.directory.etag, etag)
+        self.directory.add({"id": "echo", "name": "Echo"})
+        self.assertNotEqual(self.directory.etag, etag)
+
+    def test_etags_differ_between_processes(self):
+        self.assertNotEqual(RoomDirectory().etag, RoomDirectory().etag)
+
+    def test_cursor_pages_cover_every_room_once(self):
+        for limit in (1, 2, 3, 4):
+            with self.subTest(limit=limit):
+                names, cursor = [], None
+                while True:
+                    page, cursor = self.directory.page(sort="name", limit=limit, cursor=cursor)
+                    names += [room["name"] for room in page]
+                    if cursor is None:
+                        break
+                self.assertEqual(names, ["Alpha", "Bravo", "Charlie", "Delta"])
+
+    def test_activity_sort_and_filters(self):
+        self.directory.update_counts("charlie", 2, 1)
+        self.directory.update_counts("alpha", 2, 0)
+        self.directory.update_counts("delta", 5, 0)
+        page, _ = self.directory.page(sort="activity")
+        self.assertEqual([room["id"] for room in page], ["delta", "charlie", "alpha", "bravo"])
+        page, _ = self.directory.page(sort="activity", voice_only=True)
+        self.assertEqual([(room["id"], room["voice_users"]) for room in page], [("charlie", 1)])
+        page, _ = self.directory.page(query="RAV")
+        self.assertEqual([room["id"] for room in page], ["bravo"])
+
+    def test_page_ends_before_filtered_rooms_without_a_cursor(self):
+        self.directory.update_counts("alpha", 1, 0)
+        page, cursor = self.directory.page(limit=1, active_only=True)
+        self.assertEqual([room["id"] for room in page], ["alpha"])
+        self.assertIsNone(cursor)
+
+    def test_invalid_cursor_is_rejected(self):
+        with self.assertRaises(InvalidCursor):
+            self.directory.page(cursor="not base64!")
+        with self.assertRaises(InvalidCursor):
+            self.directory.page(sort="activity", cursor=RoomDirectory.encode_cursor(["a", "b", "c"]))
+
+    async def test_concurrent_first_requests_load_once(self):
+        collection = FakeCollection()
+        collection.documents = [dict(room, _id=n) for n, room in enumerate(rooms("Alpha", "Bravo"))]
+        directory = RoomDirectory()
+        await asyncio.gather(*(directory.ensure_loaded(collection) for _ in range(5)))
+        self.assertEqual(directory.stats["loads"], 1)
+        self.assertEqual(sorted(directory.rooms), ["alpha", "bravo"])
+        self.assertNotIn("_id", directory.rooms["alpha"])
+
+if __name__ == "__main__":
+    unittest.main()
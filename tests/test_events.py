@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import unittest
+
+from events import RedisEventBus, RoomEvent
+
+try:
+    from fakeredis import TcpFakeServer
+except ImportError:
+    TcpFakeServer = None
+
+@unittest.skipIf(TcpFakeServer is None, "fakeredis is not installed")
+class RedisEventBusTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = TcpFakeServer(("127.0.0.1", 0))
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        host, port = cls.server.server_address
+        cls.url = f"redis://{host}:{port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    async def asyncSetUp(self):
+        self.received = {"a": [], "b": []}
+        self.a = RedisEventBus(self.url, node_id="a")
+        self.b = RedisEventBus(self.url, node_id="b")
+        await self.a.start(self.received["a"].append)
+        await self.b.start(self.received["b"].append)
+
+    async def asyncTearDown(self):
+        await self.a.close()
+        await self.b.close()
+
+    async def wait_for(self, condition, timeout=2.0):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not condition():
+            if asyncio.get_running_loop().time() > deadline:
+                self.fail("timed out waiting for the event bus")
+            await asyncio.sleep(0.01)
+
+    async def test_events_reach_other_nodes_only(self):
+        self.a.track("room", True)
+        self.b.track("room", True)
+        await self.wait_for(lambda: "room" in self.a._subscribed and "room" in self.b._subscribed)
+
+        await self.a.publish(RoomEvent("a", "room", '{"text": "line\\nbreak"}', droppable=True, key="k"))
+        await self.wait_for(lambda: self.received["b"])
+        event = self.received["b"][0]
+        self.assertEqual((event.node_id, event.room_id, event.payload), ("a", "room", '{"text": "line\\nbreak"}'))
+        self.assertTrue(event.droppable)
+        self.assertEqual(event.key, "k")
+        # A node never hears its own events back
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.received["a"], [])
+
+    async def test_targeted_events_keep_their_target(self):
+        self.a.track("room", True)
+        self.b.track("room", True)
+        await self.wait_for(lambda: "room" in self.a._subscribed and "room" in self.b._subscribed)
+        await self.a.publish(RoomEvent("a", "room", "{}", target_user_id="bob"))
+        await self.wait_for(lambda: self.received["b"])
+        self.assertEqual(self.received["b"][0].target_user_id, "bob")
+
+    async def test_untracked_rooms_are_not_delivered(self):
+        self.b.track("room", True)
+        await self.wait_for(lambda: "room" in self.b._subscribed)
+        self.b.track("room", False)
+        await self.wait_for(lambda: not self.b._subscribed and not self.b._syncing)
+        await self.a.publish(RoomEvent("a", "room", "{}"))
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.received["b"], [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+
+from history import HistoryCache, estimate_size
+
+BASE = datetime(2026, 1, 1)
+
+def message(n, text="", room_id="room"):
+    return {"id": f"m{n:03d}", "room_id": room_id, "message": text,
+            "timestamp": BASE + timedelta(seconds=n)}
+
+class RecordingLoader:
+    def __init__(self, messages=()):
+        self.messages = list(messages)
+        self.calls = []
+
+    async def __call__(self, room_id, limit):
+        self.calls.append(room_id)
+        await asyncio.sleep(0.01)
+        return [m for m in self.messages if m["room_id"] == room_id][-limit:]
+
+class HistoryCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def test_ring_buffer_keeps_the_newest_messages(self):
+        cache = HistoryCache(RecordingLoader(), per_room=3)
+        await cache.recent("room", 3)
+        for n in range(5):
+            cache.append("room", message(n))
+        self.assertEqual([m["id"] for m in await cache.recent("room", 3)], ["m002", "m003", "m004"])
+        self.assertEqual([m["id"] for m in await cache.recent("room", 2)], ["m003", "m004"])
+        self.assertEqual(cache.size, 3 * estimate_size(message(0)))
+
+    async def test_out_of_order_append_is_placed_by_timestamp_and_id(self):
+        cache = HistoryCache(RecordingLoader(), per_room=5)
+        await cache.recent("room", 5)
+        for n in (1, 3, 2):
+            cache.append("room", message(n))
+        tied = dict(message(3), id="m000")
+        cache.append("room", tied)
+        self.assertEqual([m["id"] for m in await cache.recent("room", 5)], ["m001", "m002", "m000", "m003"])
+
+    async def test_concurrent_misses_share_one_load(self):
+        loader = RecordingLoader([message(n) for n in range(3)])
+        cache = HistoryCache(loader, per_room=10)
+        results = await asyncio.gather(*(cache.recent("room", 10) for _ in range(4)))
+        self.assertEqual(loader.calls, ["room"])
+        self.assertTrue(all([m["id"] for m in result] == ["m000", "m001", "m002"] for result in results))
+        self.assertEqual((cache.stats["misses"], cache.stats["loads"]), (4, 1))
+
+    async def test_messages_appended_during_a_load_are_kept(self):
+        loader = RecordingLoader([message(n) for n in range(2)])
+        cache = HistoryCache(loader, per_room=10)
+        reader = asyncio.create_task(cache.recent("room", 10))
+        await asyncio.sleep(0)
+        cache.append("room", message(5))
+        # Also in the loader's result: must not show up twice
+        cache.append("room", message(1))
+        self.assertEqual([m["id"] for m in await reader], ["m000", "m001", "m005"])
+
+    async def test_cold_rooms_are_evicted_past_max_bytes(self):
+        room_size = 2 * estimate_size(message(0, "x" * 100))
+        cache = HistoryCache(RecordingLoader(), per_room=10, max_bytes=2 * room_size + estimate_size(message(2)))
+        for room_id in ("a", "b", "c"):
+            for n in range(2):
+                cache.append(room_id, message(n, "x" * 100, room_id))
+            if room_id == "b":
+                cache.append("a", message(2, room_id="a"))
+        self.assertEqual(list(cache.rooms), ["a", "c"])
+        self.assertEqual(cache.stats["evictions"], 1)
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+    async def test_update_replaces_the_cached_message(self):
+        cache = HistoryCache(RecordingLoader(), per_room=10)
+        await cache.recent("room", 10)
+        cache.append("room", message(1))
+        before = await cache.recent("room", 10)
+        self.assertTrue(cache.update("room", "m001", {"variants": {"thumb": "/t.webp"}}))
+        self.assertNotIn("variants", before[0])
+        self.assertEqual((await cache.recent("room", 10))[0]["variants"], {"thumb": "/t.webp"})
+        self.assertFalse(cache.update("other", "m001", {}))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import time
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:1")
+os.environ.setdefault("DB_NAME", "test")
+os.environ["VARIANT_WORKERS"] = "0"
+
+from starlette.testclient import TestClient
+
+import server
+from .fakes import FakeDatabase
+
+BASE = datetime(2026, 1, 1, 12, 0, 0)
+
+class FixedClock(datetime):
+    # Stands in for server.datetime so messages get chosen timestamps
+    now_value = BASE
+
+    @classmethod
+    def utcnow(cls):
+        return cls.now_value
+
+class MessageHistoryPaginationTest(unittest.TestCase):
+    """Cursor pagination over messages sharing a millisecond.
+
+    Three messages arrive per millisecond, sub-millisecond apart, with ids
+    that sort against their arrival order: exactly the ties the
+    (timestamp, id) cursors have to break the same way in the history cache,
+    in the write-behind buffer and in Mongo, which keeps milliseconds only.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # The app's singletons bind to one event loop, so all tests share one client
+        cls.db = FakeDatabase()
+        cls.patches = [
+            mock.patch.object(server, "db", cls.db),
+            mock.patch.object(server.message_writer, "collection", cls.db.messages),
+            mock.patch.object(server.presence_writer, "collection", cls.db.users),
+            mock.patch.object(server.content_store, "blobs", cls.db.blobs),
+        ]
+        for patcher in cls.patches:
+            patcher.start()
+        cls.client = TestClient(server.app)
+        cls.client.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.messages.stalled = False
+        cls.client.__exit__(None, None, None)
+        for patcher in cls.patches:
+            patcher.stop()
+
+    def setUp(self):
+        self.room_id = f"room-{time.monotonic_ns()}"
+
+    def post_messages(self, start: int, count: int):
+        posted = []
+        for n in range(start, start + count):
+            FixedClock.now_value = BASE + timedelta(milliseconds=n // 3, microseconds=100 + 300 * (n % 3))
+            message_id = f"m{999 - n:03d}"
+            with mock.patch.object(server, "datetime", FixedClock), \
+                    mock.patch.object(server, "uuid", SimpleNamespace(uuid4=lambda: message_id)):
+                response = self.client.post(f"/api/rooms/{self.room_id}/messages",
+                                            json={"user_id": "u", "username": "U", "message": str(n)})
+            self.assertEqual(response.status_code, 200)
+            posted.append(response.json())
+        return posted
+
+    def wait_until_flushed(self):
+        deadline = time.monotonic() + 2
+        while server.message_writer.snapshot()["buffered"]:
+            self.assertLess(time.monotonic(), deadline, "write-behind buffer did not flush")
+            time.sleep(0.01)
+
+    def page(self, **params):
+        response = self.client.get(f"/api/rooms/{self.room_id}/messages", params=params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def page_through(self, limit: int, direction: str, **params):
+        pages = [self.page(limit=limit, **params)]
+        while pages[-1]["has_more"]:
+            self.assertLess(len(pages), 50, "pagination does not terminate")
+            pages.append(self.page(limit=limit, **{direction: pages[-1][direction]}))
+        return pages
+
+    def assert_pages(self, pages, limit: int):
+        for page in pages[:-1]:
+            self.assertEqual(len(page["messages"]), limit)
+            self.assertTrue(page["has_more"])
+        self.assertLess(len(pages[-1]["messages"]), limit)
+        self.assertFalse(pages[-1]["has_more"])
+
+    def assert_history(self, posted, limit: int):
+        expected = [message["id"] for message in
+                    sorted(posted, key=lambda message: (message["timestamp"], message["id"]))]
+
+        # Newest page from the cache, older pages from Mongo and the write-behind buffer
+        backward = self.page_through(limit, "before")
+        self.assert_pages(backward, limit)
+        ids = [message["id"] for page in reversed(backward) for message in page["messages"]]
+        self.assertEqual(ids, expected)
+
+        # And forward again from the oldest message
+        oldest = next(page for page in reversed(backward) if page["messages"])
+        forward = self.page_through(limit, "after", after=oldest["before"])
+        self.assert_pages(forward, limit)
+        ids = [message["id"] for page in forward for message in page["messages"]]
+        self.assertEqual(ids, expected[1:])
+
+    def test_cache_and_buffered_messages_with_tied_timestamps(self):
+        # Load the room first, so new messages reach the cache by append in arrival order
+        self.assertEqual(self.page(limit=5)["messages"], [])
+        posted = self.post_messages(0, 6)
+        self.wait_until_flushed()
+        # The rest waits in the write-behind buffer while paging
+        self.db.messages.stalled = True
+        try:
+            posted += self.post_messages(6, 5)
+            self.assertEqual(server.message_writer.snapshot()["buffered"], 5)
+            for limit in (1, 2, 3, 4, 20):
+                with self.subTest(limit=limit):
+                    self.assert_history(posted, limit)
+        finally:
+            self.db.messages.stalled = False
+        self.wait_until_flushed()
+
+    def test_mongo_only_with_tied_timestamps(self):
+        posted = self.post_messages(0, 9)
+        self.wait_until_flushed()
+        server.history_cache.rooms.pop(self.room_id, None)
+        for limit in (2, 3, 5):
+            with self.subTest(limit=limit):
+                # The cache reloads from Mongo on the first page
+                server.history_cache.rooms.pop(self.room_id, None)
+                self.assert_history(posted, limit)
+
+if __name__ == "__main__":
+    unittest.main()
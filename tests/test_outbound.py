@@ -0,0 +1,51 @@
+import asyncio
+import unittest
+
+from outbound import DISCONNECT, OutboundQueue, OutboundStats
+
+class StuckWebSocket:
+    async def send_text(self, payload):
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = code
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.received = []
+
+    async def send_text(self, payload):
+        self.received.append(payload)
+
+class OutboundQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def test_stalled_sockets_do_not_block_other_writers(self):
+        stats = OutboundStats()
+        stuck = [OutboundQueue(StuckWebSocket(), 8, DISCONNECT, stats) for _ in range(2)]
+        healthy_socket = RecordingWebSocket()
+        healthy = OutboundQueue(healthy_socket, 8, DISCONNECT, stats)
+        for queue in stuck + [healthy]:
+            queue.start()
+            queue.put("frame")
+        await asyncio.sleep(0.05)
+        self.assertEqual(healthy_socket.received, ["frame"])
+        for queue in stuck + [healthy]:
+            queue.close()
+
+    async def test_send_timeout_evicts_client(self):
+        stats = OutboundStats()
+        websocket = StuckWebSocket()
+        queue = OutboundQueue(websocket, 8, DISCONNECT, stats, send_timeout=0.05)
+        queue.start()
+        queue.put("frame")
+        await asyncio.sleep(0.2)
+        self.assertTrue(queue.closed)
+        self.assertEqual(stats.send_timeouts, 1)
+        self.assertEqual(stats.evicted, 1)
+        self.assertEqual(websocket.closed_with, 4001)
+
+    def test_unknown_overflow_policy_is_rejected(self):
+        with self.assertRaises(ValueError):
+            OutboundQueue(RecordingWebSocket(), 8, "coalesce", OutboundStats())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import asyncio
+import unittest
+
+from pymongo.errors import BulkWriteError
+
+from persistence import DUPLICATE_KEY, MessageWriter
+from .fakes import FakeCollection
+
+def message(n, room_id="room"):
+    return {"id": f"m{n}", "room_id": room_id, "message": str(n)}
+
+class FlakyCollection(FakeCollection):
+    """Fails the first insert_many without storing anything."""
+
+    failures = 1
+
+    async def insert_many(self, documents, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("primary stepped down")
+        await super().insert_many(documents, ordered)
+
+class MessageWriterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_close_flushes_every_submitted_message(self):
+        collection = FakeCollection()
+        writer = MessageWriter(collection, batch_size=4, flush_interval=10)
+        writer.start()
+        for n in range(10):
+            await writer.submit(message(n))
+        await writer.close()
+        self.assertEqual([document["id"] for document in collection.documents], [f"m{n}" for n in range(10)])
+        self.assertEqual([size for _, size in collection.calls], [4, 4, 2])
+        self.assertEqual(writer.snapshot()["buffered"], 0)
+        self.assertEqual(writer.stats["inserted"], 10)
+
+    async def test_flush_interval_sends_partial_batches(self):
+        collection = FakeCollection()
+        writer = MessageWriter(collection, batch_size=100, flush_interval=0.01)
+        writer.start()
+        await writer.submit(message(0))
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(collection.documents), 1)
+        await writer.close()
+
+    async def test_pending_messages_stay_visible_until_inserted(self):
+        collection = FakeCollection()
+        collection.stalled = True
+        writer = MessageWriter(collection, batch_size=2, flush_interval=0.01)
+        writer.start()
+        for n in range(3):
+            await writer.submit(message(n, "room" if n != 1 else "other"))
+        await asyncio.sleep(0.03)
+        # One batch is in flight, the rest still buffered
+        self.assertEqual([m["id"] for m in writer.pending_for_room("room")], ["m0", "m2"])
+        self.assertEqual(writer.snapshot()["buffered"], 3)
+        collection.stalled = False
+        await writer.close()
+        self.assertEqual(writer.pending_for_room("room"), [])
+
+    async def test_update_of_an_inflight_message_lands_after_the_insert(self):
+        collection = FakeCollection()
+        collection.stalled = True
+        writer = MessageWriter(collection, batch_size=1, flush_interval=0.01)
+        writer.start()
+        await writer.submit(message(0))
+        await writer.submit(message(1))
+        await asyncio.sleep(0.03)
+        await writer.update("m0", {"variants": {"thumb": "a"}})  # in flight
+        await writer.update("m1", {"variants": {"thumb": "b"}})  # still buffered
+        collection.stalled = False
+        await writer.close()
+        self.assertEqual([document["variants"] for document in collection.documents],
+                         [{"thumb": "a"}, {"thumb": "b"}])
+        self.assertEqual([method for method, _ in collection.calls].count("update_one"), 1)
+
+    async def test_failed_insert_is_retried_without_duplicates(self):
+        collection = FlakyCollection()
+        writer = MessageWriter(collection, batch_size=2, flush_interval=0.01, retry_backoff=0.01)
+        writer.start()
+        await writer.submit(message(0))
+        with self.assertLogs("persistence", "WARNING"):
+            await writer.close()
+        self.assertEqual(len(collection.documents), 1)
+        self.assertEqual((writer.stats["retries"], writer.stats["inserted"], writer.stats["failed"]), (1, 1, 0))
+
+    async def test_duplicate_keys_on_retry_count_as_inserted(self):
+        class LandedCollection(FakeCollection):
+            attempts = 0
+
+            async def insert_many(self, documents, ordered=True):
+                self.attempts += 1
+                if self.attempts == 1:
+                    raise ConnectionError("reply lost")
+                if self.attempts == 2:
+                    await super().insert_many(documents, ordered)
+                    raise BulkWriteError({"writeErrors": [{"code": DUPLICATE_KEY}]})
+
+        collection = LandedCollection()
+        writer = MessageWriter(collection, batch_size=2, flush_interval=0.01, retry_backoff=0.01)
+        writer.start()
+        await writer.submit(message(0))
+        with self.assertLogs("persistence", "WARNING"):
+            await writer.close()
+        self.assertEqual(collection.attempts, 2)
+        self.assertEqual((writer.stats["inserted"], writer.stats["failed"]), (1, 0))
+
+    async def test_messages_are_dropped_after_max_retries(self):
+        class DownCollection(FakeCollection):
+            async def insert_many(self, documents, ordered=True):
+                raise ConnectionError("no primary")
+
+        writer = MessageWriter(DownCollection(), flush_interval=0.01, max_retries=2, retry_backoff=0.01)
+        writer.start()
+        await writer.submit(message(0))
+        with self.assertLogs("persistence", "WARNING"):
+            await writer.close()
+        self.assertEqual((writer.stats["retries"], writer.stats["failed"]), (2, 1))
+
+    async def test_full_buffer_blocks_the_producer(self):
+        collection = FakeCollection()
+        collection.stalled = True
+        writer = MessageWriter(collection, batch_size=1, flush_interval=0.01, max_buffer=2)
+        writer.start()
+        for n in range(3):
+            await writer.submit(message(n))
+        await asyncio.sleep(0.02)
+        blocked = asyncio.create_task(writer.submit(message(3)))
+        await asyncio.sleep(0.02)
+        self.assertFalse(blocked.done())
+        collection.stalled = False
+        await blocked
+        await writer.close()
+        self.assertEqual(len(collection.documents), 4)
+        self.assertGreaterEqual(writer.stats["backpressure_waits"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
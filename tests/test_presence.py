@@ -0,0 +1,69 @@
+import asyncio
+import unittest
+
+from presence import PresenceWriter
+from .fakes import FakeCollection
+
+class PresenceWriterTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.collection = FakeCollection()
+        self.writer = PresenceWriter(self.collection, debounce=0.02)
+        self.writer.start()
+
+    async def asyncTearDown(self):
+        await self.writer.close()
+
+    async def test_flapping_reconnect_is_one_write(self):
+        self.writer.mark("alice", True, "Alice")
+        self.writer.mark("alice", False)
+        self.writer.mark("alice", True, "Alice")
+        self.writer.mark("bob", True, "Bob")
+        self.assertEqual(self.collection.calls, [])
+        await asyncio.sleep(0.06)
+        self.assertEqual(self.collection.calls, [("bulk_write", 2)])
+        self.assertEqual(self.writer.stats["collapsed"], 2)
+        self.assertEqual(sorted((user["id"], user["is_online"]) for user in self.collection.documents),
+                         [("alice", True), ("bob", True)])
+
+    async def test_leave_keeps_the_username_of_a_join_in_the_same_window(self):
+        self.writer.mark("alice", True, "Alice")
+        self.writer.mark("alice", False)
+        await asyncio.sleep(0.06)
+        self.assertEqual(self.collection.documents, [{"id": "alice", "is_online": False, "username": "Alice"}])
+
+    async def test_bare_leave_does_not_create_a_user(self):
+        self.writer.mark("ghost", False)
+        await asyncio.sleep(0.06)
+        self.assertEqual(self.collection.calls, [("bulk_write", 1)])
+        self.assertEqual(self.collection.documents, [])
+
+    async def test_close_flushes_within_the_window(self):
+        writer = PresenceWriter(self.collection, debounce=60)
+        writer.start()
+        writer.mark("alice", True, "Alice")
+        await asyncio.sleep(0)
+        await writer.close()
+        self.assertEqual(self.collection.documents, [{"id": "alice", "is_online": True, "username": "Alice"}])
+        self.assertEqual(writer.snapshot()["pending"], 0)
+
+    async def test_failed_writes_are_retried(self):
+        class FlakyCollection(FakeCollection):
+            failures = 1
+
+            async def bulk_write(self, operations, ordered=True):
+                if self.failures:
+                    self.failures -= 1
+                    raise ConnectionError("primary stepped down")
+                await super().bulk_write(operations, ordered)
+
+        collection = FlakyCollection()
+        writer = PresenceWriter(collection, debounce=0.01)
+        writer.start()
+        writer.mark("alice", True, "Alice")
+        await asyncio.sleep(0.06)
+        await writer.close()
+        self.assertEqual(len(collection.documents), 1)
+        self.assertEqual((writer.stats["written"], writer.stats["failed"]), (1, 0))
+
+if __name__ == "__main__":
+    unittest.main()
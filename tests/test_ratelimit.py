@@ -0,0 +1,93 @@
+import unittest
+from unittest import mock
+
+import ratelimit
+from ratelimit import CONNECTION, ROOM, RateLimited, RateLimiter
+from registry import Connection
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(ratelimit.time, "monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connection(self, user_id="alice", room_id="room"):
+        return Connection(object(), room_id, user_id, user_id)
+
+    def test_burst_then_refill(self):
+        limiter = RateLimiter({"message": {CONNECTION: (2, 3)}})
+        conn = self.connection()
+        for _ in range(3):
+            self.assertEqual(limiter.admit(conn, "message"), 0.0)
+        with self.assertRaises(RateLimited) as caught:
+            limiter.admit(conn, "message")
+        self.assertAlmostEqual(caught.exception.retry_after, 0.5)
+        self.clock.now += 0.5
+        self.assertEqual(limiter.admit(conn, "message"), 0.0)
+        self.assertEqual(limiter.stats["admitted"], 4)
+        self.assertEqual(limiter.stats["dropped"], 1)
+
+    def test_deferrable_frames_wait_up_to_the_cap(self):
+        limiter = RateLimiter({"offer": {CONNECTION: (10, 1)}}, deferrable={"offer"}, max_defer=0.25)
+        conn = self.connection()
+        self.assertEqual(limiter.admit(conn, "offer"), 0.0)
+        self.assertAlmostEqual(limiter.admit(conn, "offer"), 0.1)
+        # Deferred frames take their tokens, so the next one queues up behind
+        self.assertAlmostEqual(limiter.admit(conn, "offer"), 0.2)
+        with self.assertRaises(RateLimited):
+            limiter.admit(conn, "offer")
+        self.assertEqual(limiter.stats["deferred"], 2)
+        self.assertEqual(limiter.stats["dropped"], 1)
+
+    def test_shared_room_bucket_drops_by_scope(self):
+        limiter = RateLimiter({"typing": {CONNECTION: (100, 100), ROOM: (1, 1)}})
+        alice, bob = self.connection("alice"), self.connection("bob")
+        limiter.admit(alice, "typing")
+        with self.assertRaises(RateLimited) as caught:
+            limiter.admit(bob, "typing")
+        self.assertEqual(caught.exception.scope, ROOM)
+        self.assertEqual(limiter.dropped_by_scope[ROOM], 1)
+        self.assertEqual(limiter.dropped_by_type, {"typing": 1})
+        # Other rooms have their own bucket
+        limiter.admit(self.connection("carol", "other"), "typing")
+
+    def test_notices_are_throttled_per_type(self):
+        limiter = RateLimiter({"message": {CONNECTION: (0.1, 1)}}, notice_interval=1.0)
+        conn = self.connection()
+        limiter.admit(conn, "message")
+        notified = []
+        for _ in range(3):
+            try:
+                limiter.admit(conn, "message")
+            except RateLimited as e:
+                notified.append(e.notify)
+        self.assertEqual(notified, [True, False, False])
+        self.clock.now += 1.0
+        with self.assertRaises(RateLimited) as caught:
+            limiter.admit(conn, "message")
+        self.assertTrue(caught.exception.notify)
+        self.assertEqual(limiter.stats["notices"], 2)
+        self.assertEqual(caught.exception.notice()["type"], "rate_limited")
+
+    def test_idle_shared_buckets_are_pruned(self):
+        limiter = RateLimiter({"typing": {ROOM: (1, 1)}})
+        limiter.admit(self.connection(), "typing")
+        self.assertEqual(limiter.snapshot()["room_buckets"], 1)
+        self.clock.now += ratelimit.PRUNE_INTERVAL
+        limiter.prune(self.clock.now)
+        self.assertEqual(limiter.snapshot()["room_buckets"], 0)
+
+    def test_unknown_scope_is_rejected(self):
+        with self.assertRaises(ValueError):
+            RateLimiter({"message": {"planet": (1, 1)}})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from registry import Connection, RoomRegistry
+
+class RoomRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = RoomRegistry()
+
+    def join(self, websocket, user_id, room_id="room"):
+        conn = Connection(websocket, room_id, user_id, user_id.title())
+        self.registry.add(conn)
+        return conn
+
+    def test_voice_count_follows_set_voice_and_remove(self):
+        self.join("ws1", "alice")
+        self.join("ws2", "alice")
+        self.join("ws3", "bob")
+        room = self.registry.room("room")
+
+        self.assertTrue(self.registry.set_voice("room", "alice", True))
+        self.assertEqual(room.voice_count, 2)
+        self.assertFalse(self.registry.set_voice("room", "alice", True))
+        self.assertEqual(room.voice_count, 2)
+
+        self.registry.remove("ws1")
+        self.assertEqual(room.voice_count, 1)
+        self.registry.set_voice("room", "bob", True)
+        self.registry.remove("ws3")
+        self.assertEqual(room.voice_count, 1)
+        self.assertEqual(self.registry.rooms["room"].users.keys(), {"alice"})
+
+    def test_remove_invalidates_cached_roster(self):
+        self.join("ws1", "alice")
+        self.join("ws2", "bob")
+        room = self.registry.room("room")
+        roster = room.roster()
+        self.assertIs(room.roster(), roster)
+        self.assertEqual([user["id"] for user in roster], ["alice", "bob"])
+
+        self.registry.remove("ws1")
+        self.assertEqual([user["id"] for user in room.roster()], ["bob"])
+
+    def test_voice_change_invalidates_cached_roster(self):
+        self.join("ws1", "alice")
+        room = self.registry.room("room")
+        self.assertFalse(room.roster()[0]["is_in_voice"])
+        self.registry.set_voice("room", "alice", True)
+        self.assertTrue(room.roster()[0]["is_in_voice"])
+
+    def test_last_connection_removes_room_and_indexes(self):
+        conn = self.join("ws1", "alice")
+        self.assertIs(self.registry.remove("ws1"), conn)
+        self.assertIsNone(self.registry.room("room"))
+        self.assertEqual(self.registry.by_user, {})
+        self.assertEqual(len(self.registry), 0)
+        self.assertIsNone(self.registry.remove("ws1"))
+
+if __name__ == "__main__":
+    unittest.main()
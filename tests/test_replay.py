@@ -0,0 +1,43 @@
+import unittest
+
+from replay import ReplayLog
+
+class ReplayLogTest(unittest.TestCase):
+    def test_resume_returns_missed_events(self):
+        log = ReplayLog(per_room=10)
+        for n in range(5):
+            log.append("room", {"type": "new_message", "n": n})
+        epoch, seq = log.position("room")
+        self.assertEqual(seq, 5)
+        events = log.since("room", epoch, 2)
+        self.assertEqual([event["seq"] for event in events], [3, 4, 5])
+        self.assertEqual(log.since("room", epoch, 5), [])
+
+    def test_epoch_mismatch_falls_back(self):
+        log = ReplayLog(per_room=10)
+        log.append("room", {"type": "new_message"})
+        self.assertIsNone(log.since("room", "stale-epoch", 0))
+        self.assertIsNone(log.since("unknown-room", "stale-epoch", 0))
+        self.assertEqual(log.stats["fallbacks"], 2)
+
+    def test_gap_past_oldest_event_falls_back(self):
+        log = ReplayLog(per_room=3)
+        for n in range(5):
+            log.append("room", {"type": "new_message", "n": n})
+        epoch, _ = log.position("room")
+        self.assertIsNone(log.since("room", epoch, 1))
+        self.assertEqual([event["seq"] for event in log.since("room", epoch, 2)], [3, 4, 5])
+        # A seq ahead of the log cannot come from this epoch either
+        self.assertIsNone(log.since("room", epoch, 6))
+
+    def test_evicted_room_starts_a_new_epoch(self):
+        log = ReplayLog(per_room=10, max_rooms=1)
+        log.append("a", {"type": "new_message"})
+        epoch, _ = log.position("a")
+        log.append("b", {"type": "new_message"})
+        self.assertEqual(log.stats["evictions"], 1)
+        self.assertIsNone(log.since("a", epoch, 1))
+        self.assertNotEqual(log.position("a")[0], epoch)
+
+if __name__ == "__main__":
+    unittest.main()
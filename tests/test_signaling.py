@@ -0,0 +1,67 @@
+import asyncio
+import unittest
+
+from signaling import IceCandidateBatcher
+
+def candidate(n):
+    return {"type": "ice-candidate", "candidate": {"candidate": f"candidate:{n}"}}
+
+class IceCandidateBatcherTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.delivered = []
+
+        async def deliver(room_id, target_id, message):
+            self.delivered.append((room_id, target_id, message))
+
+        self.batcher = IceCandidateBatcher(0.02, deliver)
+
+    async def test_window_expiry_flushes_one_frame(self):
+        for n in range(3):
+            await self.batcher.add("room", "alice", "bob", candidate(n))
+        self.assertEqual(self.delivered, [])
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.delivered), 1)
+        room_id, target_id, message = self.delivered[0]
+        self.assertEqual((room_id, target_id, message["type"], message["from_user_id"]),
+                         ("room", "bob", "ice-candidates", "alice"))
+        self.assertEqual([c["candidate"] for c in message["candidates"]],
+                         ["candidate:0", "candidate:1", "candidate:2"])
+        self.assertEqual(self.batcher.snapshot()["frames_saved"], 2)
+        self.assertEqual(self.batcher._flushing, set())
+
+    async def test_end_of_candidates_flushes_at_once(self):
+        await self.batcher.add("room", "alice", "bob", candidate(0))
+        await self.batcher.add("room", "alice", "bob", {"type": "ice-candidate", "candidate": None})
+        self.assertEqual(len(self.delivered), 1)
+        await asyncio.sleep(0.05)
+        # The cancelled window timer must not send an empty frame
+        self.assertEqual(len(self.delivered), 1)
+
+    async def test_pairs_are_batched_separately(self):
+        await self.batcher.add("room", "alice", "bob", candidate(0))
+        await self.batcher.add("room", "alice", "carol", candidate(1))
+        await self.batcher.flush("room", "alice", "bob")
+        self.assertEqual([target for _, target, _ in self.delivered], ["bob"])
+        await asyncio.sleep(0.05)
+        self.assertEqual([target for _, target, _ in self.delivered], ["bob", "carol"])
+
+    async def test_failed_expiry_flush_is_counted(self):
+        async def broken(room_id, target_id, message):
+            raise RuntimeError("socket gone")
+
+        batcher = IceCandidateBatcher(0.01, broken)
+        await batcher.add("room", "alice", "bob", candidate(0))
+        with self.assertLogs("signaling", "ERROR"):
+            await asyncio.sleep(0.05)
+        self.assertEqual(batcher.stats["errors"], 1)
+        self.assertEqual(batcher.snapshot()["pending"], 0)
+
+    async def test_close_delivers_pending_batches(self):
+        await self.batcher.add("room", "alice", "bob", candidate(0))
+        await self.batcher.close()
+        self.assertEqual(len(self.delivered), 1)
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.delivered), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from starlette.testclient import TestClient
+
+from static_files import IMMUTABLE_CACHE_CONTROL, UploadFiles
+
+BLOB = "ab" * 32 + ".png"
+CONTENT = bytes(range(256)) * 4
+
+class UploadFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmp.name)
+        (self.directory / BLOB).write_bytes(CONTENT)
+        (self.directory / ".incoming").mkdir()
+        (self.directory / ".incoming" / "x.part").write_bytes(b"partial")
+        (self.directory / "variants").mkdir()
+        self.files = UploadFiles(self.directory)
+        self.client = TestClient(self.files)
+
+    def tearDown(self):
+        self.client.close()
+        self.tmp.cleanup()
+
+    def test_full_response_is_immutable(self):
+        response = self.client.get(f"/{BLOB}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, CONTENT)
+        self.assertEqual(response.headers["cache-control"], IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(response.headers["etag"], f'"{"ab" * 32}"')
+        self.assertEqual(response.headers["content-type"], "image/png")
+
+    def test_head_has_length_but_no_body(self):
+        response = self.client.head(f"/{BLOB}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-length"], str(len(CONTENT)))
+        self.assertEqual(response.content, b"")
+
+    def test_conditional_requests_get_304(self):
+        etag = self.client.get(f"/{BLOB}").headers["etag"]
+        response = self.client.get(f"/{BLOB}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        response = self.client.get(f"/{BLOB}", headers={"If-None-Match": '"other"'})
+        self.assertEqual(response.status_code, 200)
+        last_modified = response.headers["last-modified"]
+        response = self.client.get(f"/{BLOB}", headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.client.get(f"/{BLOB}", headers={"Range": "bytes=10-19"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, CONTENT[10:20])
+        self.assertEqual(response.headers["content-range"], f"bytes 10-19/{len(CONTENT)}")
+
+        response = self.client.get(f"/{BLOB}", headers={"Range": "bytes=-5"})
+        self.assertEqual(response.content, CONTENT[-5:])
+        response = self.client.get(f"/{BLOB}", headers={"Range": "bytes=1000-"})
+        self.assertEqual(response.content, CONTENT[1000:])
+        # Multiple ranges are not supported and get the whole file
+        response = self.client.get(f"/{BLOB}", headers={"Range": "bytes=0-1,5-6"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_stale_if_range_gets_whole_file(self):
+        response = self.client.get(f"/{BLOB}", headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, CONTENT)
+
+    def test_unsatisfiable_range_gets_416(self):
+        response = self.client.get(f"/{BLOB}", headers={"Range": f"bytes={len(CONTENT)}-"})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers["content-range"], f"bytes */{len(CONTENT)}")
+
+    def test_file_deleted_after_metadata_was_cached_is_404(self):
+        self.assertEqual(self.client.get(f"/{BLOB}").status_code, 200)
+        os.unlink(self.directory / BLOB)
+        response = self.client.get(f"/{BLOB}")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.files.snapshot()["cached_entries"], 0)
+
+    def test_hidden_entries_directories_and_missing_files_are_404(self):
+        for path in ("/.incoming/x.part", "/variants", "/missing.png", "/../etc/passwd", "/"):
+            self.assertEqual(self.client.get(path).status_code, 404, path)
+
+    def test_zerocopy_send_gets_the_open_file(self):
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            if message["type"] == "http.response.zerocopysend":
+                message = dict(message, data=os.pread(message["file"], message["count"], message["offset"]))
+            sent.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": f"/{BLOB}", "root_path": "",
+                 "headers": [(b"range", b"bytes=4-7")], "extensions": {"http.response.zerocopysend": {}}}
+        asyncio.run(self.files(scope, receive, send))
+        self.assertEqual(sent[0]["status"], 206)
+        self.assertEqual(sent[1]["data"], CONTENT[4:8])
+        self.assertEqual(self.files.stats["zerocopy"], 1)
+
+    def test_only_get_and_head(self):
+        response = self.client.post(f"/{BLOB}")
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response.headers["allow"], "GET, HEAD")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from storage import ContentStore
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+class MemoryUpload:
+    def __init__(self, data: bytes):
+        self.file = io.BytesIO(data)
+
+    async def seek(self, offset: int):
+        self.file.seek(offset)
+
+    async def read(self, size: int = -1) -> bytes:
+        return self.file.read(size)
+
+class NoMessages:
+    # Every message is still in the write-behind buffer
+    async def distinct(self, field, query=None):
+        return []
+
+class Messages:
+    def __init__(self, *file_urls):
+        self.file_urls = file_urls
+        self.queries = []
+
+    async def distinct(self, field, query=None):
+        self.queries.append(query)
+        return [url for url in self.file_urls if url in query[field]["$in"]]
+
+class ContentStoreTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ContentStore(Path(self.tmp.name))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def test_duplicates_share_one_blob(self):
+        first = await self.store.put(MemoryUpload(PNG))
+        second = await self.store.put(MemoryUpload(PNG))
+        self.assertFalse(first.deduplicated)
+        self.assertTrue(second.deduplicated)
+        self.assertEqual(first.path, second.path)
+        self.assertEqual(self.store.stats["bytes_written"], len(PNG))
+
+    async def test_duplicate_upload_protects_old_orphan_from_gc(self):
+        stored = await self.store.put(MemoryUpload(PNG))
+        old = time.time() - 7200
+        os.utime(stored.path, (old, old))
+        await self.store.put(MemoryUpload(PNG))
+        self.assertEqual(await self.store.collect_garbage(NoMessages(), 3600), 0)
+        self.assertTrue(stored.path.exists())
+
+    async def test_orphans_past_grace_period_are_collected(self):
+        stored = await self.store.put(MemoryUpload(PNG))
+        old = time.time() - 7200
+        os.utime(stored.path, (old, old))
+        self.assertEqual(await self.store.collect_garbage(NoMessages(), 3600), 1)
+        self.assertFalse(stored.path.exists())
+
+    async def test_references_are_looked_up_in_batches(self):
+        referenced = await self.store.put(MemoryUpload(PNG))
+        orphan = await self.store.put(MemoryUpload(PNG + b"\x01"))
+        old = time.time() - 7200
+        for stored in (referenced, orphan):
+            os.utime(stored.path, (old, old))
+        messages = Messages(self.store.url_for(referenced.path.name))
+        with mock.patch("storage.GC_LOOKUP_BATCH", 1):
+            self.assertEqual(await self.store.collect_garbage(messages, 3600), 1)
+        self.assertEqual(len(messages.queries), 2)
+        self.assertTrue(referenced.path.exists())
+        self.assertFalse(orphan.path.exists())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from typing_indicators import TypingAggregator
+
+class Node:
+    """One node's aggregator, wired to its peers the way the event bus does it."""
+
+    def __init__(self, node_id, cluster, ttl=5.0):
+        self.node_id = node_id
+        self.cluster = cluster
+        self.sent = []  # snapshots delivered to this node's sockets
+        self.aggregator = TypingAggregator(self.emit, ttl=ttl, min_interval=0, publish=self.publish)
+        cluster.append(self)
+
+    async def emit(self, room_id, message):
+        self.sent.append(sorted(user["user_id"] for user in message["users"]))
+
+    async def publish(self, room_id, message):
+        for node in self.cluster:
+            if node is not self:
+                node.aggregator.merge(room_id, self.node_id, message["users"])
+
+class TypingAggregatorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_snapshots_merge_typers_of_all_nodes(self):
+        cluster = []
+        a, b = Node("a", cluster), Node("b", cluster)
+        a.aggregator.update("room", "alice", "Alice", True)
+        b.aggregator.update("room", "bob", "Bob", True)
+        await a.aggregator.flush()
+        await b.aggregator.flush()
+        await a.aggregator.flush()
+        self.assertEqual(a.sent[-1], ["alice", "bob"])
+        self.assertEqual(b.sent[-1], ["alice", "bob"])
+
+        b.aggregator.update("room", "bob", "Bob", False)
+        await b.aggregator.flush()
+        await a.aggregator.flush()
+        self.assertEqual(a.sent[-1], ["alice"])
+        self.assertEqual(b.sent[-1], ["alice"])
+
+    async def test_refresh_without_change_only_publishes(self):
+        cluster = []
+        a, b = Node("a", cluster), Node("b", cluster)
+        a.aggregator.update("room", "alice", "Alice", True)
+        await a.aggregator.flush()
+        await b.aggregator.flush()
+        a.aggregator.update("room", "alice", "Alice", True)
+        await a.aggregator.flush()
+        await b.aggregator.flush()
+        self.assertEqual(a.sent, [["alice"]])
+        self.assertEqual(b.sent, [["alice"]])
+        self.assertEqual(a.aggregator.stats["published"], 2)
+
+    async def test_remote_typers_expire(self):
+        cluster = []
+        a, b = Node("a", cluster, ttl=0), Node("b", cluster, ttl=0)
+        b.aggregator.merge("room", "a", [{"user_id": "alice", "username": "Alice"}])
+        await b.aggregator.flush()
+        self.assertEqual(b.sent, [[]])
+        self.assertEqual(b.aggregator.snapshot()["remote_typers"], 0)
+
+if __name__ == "__main__":
+    unittest.main()